@@ -1,14 +1,26 @@
 import ply.yacc as yacc
 from lexer import APLLexer
 import logging
-from ast import Token, BinOp, UnaryOp, Var, Const,\
+from ast import BinOp, UnaryOp, Var, Const, ASGN, DEREF, ADDR, NOT, UMINUS, BINARY_OPS,\
     Decl, DeclList, If, While, Function, Param, Block,\
-    FunctionCall, ReturnStmt
+    FunctionCall, ReturnStmt, write_ast
 from cfg import CFG
-from symtablev2 import mktable, Stack, get_width, print_procedures, print_variables
+from symtablev2 import mktable, Stack, ScopeStack, make_signature, print_procedures,\
+    print_variables, get_type, INT, FLOAT, VOID, BOOL, FUNCTION
 from asm import ASMCodeGenerator
+from artifacts import ARTIFACTS, output_filenames, parse_artifacts
+from funccache import FunctionCache, TokenRecorder, cached_codegen
+from stream import StreamEmitter
+from fold import fold
+from optimize import optimize, format_stats
 import sys
 import os
+import io
+import hashlib
+import contextlib
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
 logging.basicConfig(
     level=logging.INFO,
@@ -17,20 +29,100 @@ logging.basicConfig(
 )
 log = logging.getLogger()
 
+CACHE_DIR = os.environ.get(
+    'APLC_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '__aplcache__')
+)
+
+
+def grammar_hash(parser_class):
+    '''
+    hash of everything the LALR tables depend on: tokens, precedence,
+    the docstrings of the p_* rules and the ply table format version
+    '''
+    h = hashlib.sha1()
+    h.update(yacc.__tabversion__.encode())
+    h.update(repr(parser_class.tokens).encode())
+    h.update(repr(parser_class.precedence).encode())
+    for name in sorted(dir(parser_class)):
+        if name.startswith('p_') and name != 'p_error':
+            h.update(name.encode())
+            h.update((getattr(parser_class, name).__doc__ or '').encode())
+    return h.hexdigest()
+
+
+def build_yacc(module, debug=False, cache_dir=None):
+    '''
+    build the yacc parser for `module`, loading the LALR tables from
+    <cache_dir>/parsetab_<grammar_hash>.pickle if present.
+    tables are regenerated (and parser.out written) only on a cache miss
+    or when debug is set.
+    '''
+    if cache_dir is None:
+        cache_dir = CACHE_DIR
+    os.makedirs(cache_dir, exist_ok=True)
+
+    table_file = os.path.join(cache_dir, 'parsetab_%s.pickle' % grammar_hash(type(module)))
+
+    if not debug and os.path.exists(table_file):
+        try:
+            return yacc.yacc(module=module, debug=False, optimize=True,
+                             picklefile=table_file)
+        except Exception as e:
+            log.warning('unable to load parse table cache %s: %r' % (table_file, e))
+
+    # write under a temporary name so that concurrent compiles never
+    # read a half written table file
+    temp_file = '%s.%d.tmp' % (table_file, os.getpid())
+    parser = yacc.yacc(module=module, debug=debug, outputdir=cache_dir,
+                       picklefile=temp_file)
+    if os.path.exists(temp_file):
+        os.replace(temp_file, table_file)
+    return parser
+
+
+class CompileError(Exception):
+    '''
+    diagnostic stopping the compile of one input.
+    APLParser.parse fills in the filename and line when they are not given.
+    '''
+
+    def __init__(self, message, lineno=None, filename=None):
+        Exception.__init__(self, message, lineno, filename)
+        self.message = message
+        self.lineno = lineno
+        self.filename = filename
+
+    def __str__(self):
+        location = ''
+        if self.filename is not None:
+            location += '%s:' % (self.filename)
+        if self.lineno is not None:
+            location += '%d:' % (self.lineno)
+        return (location + ' ' if location else '') + self.message
+
+
+def internal_error(exc, lineno=None, filename=None):
+    '''
+    CompileError reporting the unexpected exception `exc`, a bug of the
+    compiler, after printing its traceback
+    '''
+    traceback.print_exc(file=sys.stdout)
+    message = traceback.format_exception_only(type(exc), exc)[-1].strip()
+    return CompileError('internal compiler error: %s' % (message), lineno, filename)
+
 
 def check_direct_access(p):
     if isinstance(p, Var):
-        if p.entry['type'] != 'function' and p.entry['type'][1] == 0:
-            print('[error] direct access of non-pointer %s.' % (p.value))
-            sys.exit(0)
+        if p.entry['type'] is not FUNCTION and p.entry['type'].pointer_level == 0:
+            raise CompileError('[error] direct access of non-pointer %s.' % (p.value))
 
 
 def print_op_error(op, lhs, rhs):
     _lhs = lhs[0] + '*' * lhs[1]
     _rhs = rhs[0] + '*' * rhs[1]
-    print('invalid usage of operator %s' % (op))
-    print('LHS is of type: ', _lhs, ', RHS is of type: ', _rhs)
-    sys.exit(0)
+    raise CompileError('invalid usage of operator %s\nLHS is of type:  %s , RHS is of type:  %s' %
+                       (op, _lhs, _rhs))
 
 
 class APLParser(object):
@@ -47,17 +139,54 @@ class APLParser(object):
         ('nonassoc', 'ELSE'),
     )
 
-    def __init__(self, ast_filename, cfg_filename, sym_filename, asm_filename):
-        self.lexer = APLLexer()
+    def __init__(self, ast_filename=None, cfg_filename=None, sym_filename=None, asm_filename=None,
+                 debug=False, lexer_backend='ply', func_cache_dir=None, stream=False, optimize=False):
+        '''
+        Args:
+            stream (bool): generate code for each function as soon as it is
+                parsed, keeping only one function in memory at a time
+            optimize (bool): fold constants while parsing and run the passes
+                of optimize.py over the CFG
+        '''
+        if stream and func_cache_dir is not None:
+            raise ValueError('the function cache can not be used when streaming')
+
+        self.lexer = APLLexer(lexer_backend)
         # self.parser = yacc.yacc(module=self, debug=True, debuglog=log)
-        self.parser = yacc.yacc(module=self, debug=True)
-        self.ast_file = open(ast_filename, 'w')
-        self.cfg_file = open(cfg_filename, 'w')
-        self.sym_file = open(sym_filename, 'w')
-        self.asm_file = open(asm_filename, 'w')
+        self.parser = build_yacc(self, debug=debug)
+
+        # per-function cache of .cfg and asm output, disabled if None
+        self.func_cache = FunctionCache(func_cache_dir) if func_cache_dir is not None else None
+        self.token_recorder = None
+
+        self.stream = stream
+        self.emitter = None
+
+        self.optimize = optimize
+        # optimize() statistics of the last compile, function name -> Counter
+        self.opt_stats = None
+
+        if ast_filename is not None:
+            self.reset(ast_filename, cfg_filename, sym_filename, asm_filename)
+
+    def reset(self, ast_filename, cfg_filename, sym_filename, asm_filename):
+        '''
+        clear the per-compile state so the parser can be reused for another file
+        Args:
+            *_filename: output filename, or an already open file object,
+                None to not emit that artifact
+        '''
+        self.ast_file = open_output(ast_filename)
+        self.cfg_file = open_output(cfg_filename)
+        self.sym_file = open_output(sym_filename)
+        self.asm_file = open_output(asm_filename)
+
+        self.lexer.lexer.lineno = 1
+        self.lexer.lexer.linestart = 0
+        self.filename = None
 
         self.offset = Stack()
-        self.tableptr = Stack()
+        self.tableptr = ScopeStack()
         self.nest_level = 1
 
         self.offset.push(0)
@@ -68,6 +197,50 @@ class APLParser(object):
         self.last_stars = None
         self.block_id = 0
 
+        self.opt_stats = OrderedDict() if self.optimize else None
+
+        if self.emitter is not None:
+            self.emitter.close()
+        self.emitter = None
+        if self.stream:
+            self.emitter = StreamEmitter(self.tableptr.top(), self.ast_file, self.cfg_file,
+                                         self.asm_file, self.opt_stats)
+
+    def close(self):
+        if self.emitter is not None:
+            self.emitter.close()
+        for f in (self.ast_file, self.cfg_file, self.sym_file, self.asm_file):
+            if f is not None:
+                f.close()
+
+    def compile_file(self, data_file, emit=ARTIFACTS):
+        '''
+        compile `data_file`, writing <data_file>.{ast,cfg,sym,s}
+        Args:
+            emit: the artifacts to write, the others are never formatted
+        '''
+        with open(data_file, 'r') as file:
+            data = file.read()
+
+        filenames = dict(zip(emit, output_filenames(data_file, emit)))
+        self.reset(*[filenames.get(name) for name in ARTIFACTS])
+        self.filename = data_file
+        try:
+            self.parse(data)
+        finally:
+            self.close()
+
+    def compile_source(self, data, emit=ARTIFACTS):
+        '''compile the source text `data`, returns {artifact: output text} of `emit`'''
+        outputs = {name: io.StringIO() for name in emit}
+        self.reset(*[outputs.get(name) for name in ARTIFACTS])
+        self.parse(data)
+        return {name: out.getvalue() for name, out in outputs.items()}
+
+    def fold(self, ast):
+        '''`ast` with its constant operations folded if optimizing'''
+        return fold(ast) if self.optimize else ast
+
     def pop_tableptr(self):
         curr_symt = self.tableptr.top()
         curr_symt.addwidth(self.offset.top())
@@ -77,31 +250,46 @@ class APLParser(object):
 
     def p_code(self, p):
         'code : global_statement_list'
-        logging.debug('code: %s' % (p[1]))
+        logging.debug('code: %s', p[1])
+
+        # a phase runs only if an artifact that is emitted needs it
+        if self.ast_file is not None:
+            for node in p[1]:
+                write_ast(node, self.ast_file)
 
-        for node in p[1]:
-            self.ast_file.write(str(node))
+        if self.sym_file is not None:
+            print_procedures(self.tableptr.top(), self.sym_file)
+            print_variables(self.tableptr.top(), self.sym_file)
 
-        self.ast_file.close()
+        if self.emitter is not None:
+            # functions were already emitted by p_global_statement
+            self.emitter.finish()
+            return
 
-        cfg = CFG(p[1])
-        self.cfg_file.write(str(cfg))
-        self.cfg_file.close()
+        if self.cfg_file is None and self.asm_file is None:
+            return
 
-        # print(self.tableptr.top())
-        print_procedures(self.tableptr.top(), self.sym_file)
-        print_variables(self.tableptr.top(), self.sym_file)
+        if self.func_cache is not None:
+            cached_codegen(p[1], self.tableptr.top(), self.token_recorder.tokens,
+                           self.func_cache, self.cfg_file, self.asm_file, self.opt_stats)
+            return
 
-        ASMCodeGenerator(cfg, self.tableptr.top(), self.asm_file)
+        cfg = CFG(p[1], split_calls=self.optimize)
+        if self.optimize:
+            self.opt_stats.update(optimize(cfg, self.tableptr.top()))
+        if self.cfg_file is not None:
+            cfg.write(self.cfg_file)
+
+        if self.asm_file is not None:
+            ASMCodeGenerator(cfg, self.tableptr.top(), self.asm_file)
 
     def p_global_statement_list(self, p):
-        '''global_statement_list : global_statement global_statement_list
+        '''global_statement_list : global_statement_list global_statement
                                  | empty'''
         if len(p) == 3:
-            if isinstance(p[1], DeclList):
-                p[0] = p[2]
-            else:
-                p[0] = [p[1]] + p[2]
+            p[0] = p[1]
+            if p[2] is not None and not isinstance(p[2], DeclList):
+                p[0].append(p[2])
         else:
             p[0] = []
 
@@ -112,29 +300,37 @@ class APLParser(object):
                             | main_function_def'''
         p[0] = p[1]
 
+        if self.emitter is not None and isinstance(p[0], Function):
+            self.emitter.function(p[0])
+            # already emitted, do not keep the function around
+            p[0] = None
+
     def p_main_function_def(self, p):
         '''main_function_def : void main LPAREN M RPAREN LBRACKET statement_list RBRACKET'''
-        p[0] = Function((p[1], 0), p[2], [], p[7])
+        p[0] = Function(get_type(p[1]), p[2], [], p[7])
+        p[0].span = (p.lexpos(3), p.lexpos(8))
         self.pop_tableptr()
 
     def p_function_def(self, p):
         '''function_def : type stars id_d LPAREN M formal_params RPAREN LBRACKET statement_list RBRACKET'''
-        p[0] = Function((p[1], len(p[2])), p[3].value, p[6], p[9])
+        p[0] = Function(get_type(p[1], len(p[2])), p[3].value, p[6], p[9])
+        p[0].span = (p.lexpos(4), p.lexpos(10))
         self.pop_tableptr()
 
     def p_function_proto(self, p):
         '''function_proto : type stars id_d LPAREN M formal_params RPAREN SEMICOLON'''
-        p[0] = Function((p[1], len(p[2])), p[3].value, p[6], None)
+        p[0] = Function(get_type(p[1], len(p[2])), p[3].value, p[6], None)
         self.pop_tableptr()
 
     def p_void_function_def(self, p):
         '''function_def : void id_d LPAREN M formal_params RPAREN LBRACKET statement_list RBRACKET'''
-        p[0] = Function((p[1], 0), p[2].value, p[5], p[8])
+        p[0] = Function(get_type(p[1]), p[2].value, p[5], p[8])
+        p[0].span = (p.lexpos(3), p.lexpos(9))
         self.pop_tableptr()
 
     def p_void_function_proto(self, p):
         '''function_def : void id_d LPAREN M formal_params RPAREN SEMICOLON'''
-        p[0] = Function((p[1], 0), p[2].value, p[5], None)
+        p[0] = Function(get_type(p[1]), p[2].value, p[5], None)
         self.pop_tableptr()
 
     def p_M(self, p):
@@ -143,15 +339,14 @@ class APLParser(object):
 
         curr_symt = self.tableptr.top()
         func_name = self.last_id
-        ret_type = (self.last_type, len(self.last_stars))
+        ret_type = get_type(self.last_type, len(self.last_stars))
 
         # check if already exists
         if func_name in curr_symt.symbols:
             # print('prototype for function %s exists.' % (func_name))
             entry = curr_symt.symbols[func_name]
-            if ret_type != entry['ret_type']:
-                print('[function %s] return type mismatch with prototype.' % (func_name))
-                sys.exit(0)
+            if ret_type is not entry['ret_type']:
+                raise CompileError('[function %s] return type mismatch with prototype.' % (func_name))
 
             table = entry['tableptr']
             self.tableptr.push(table)
@@ -173,43 +368,42 @@ class APLParser(object):
         # type check prototype parameters
 
         curr_symt = self.tableptr.top()
-        temp_param_len = curr_symt.num_params
-        if temp_param_len > 0:
-            if temp_param_len != len(p[1]):
-                print('parameter mismatch with prototype')
-                sys.exit(0)
-
-            index = 0
-            for k, v in curr_symt.symbols.items():
-                param = p[1][index]
-                if v['type'] != (param.dtype, param.pointer_level):
-                    print('parameter #%d type mismatch with prototype.' % (index + 1))
-                    sys.exit(0)
-                index += 1
-                if index == temp_param_len:
-                    break
-
-            curr_symt.symbols.clear()
-
-        for param in p[1]:
-            _type = (param.dtype, param.pointer_level)
-            width = get_width(_type)
-            curr_symt.enter(param.id, _type, width)
-            self.offset.updateTop(self.offset.top() + width)
-
-        curr_symt.num_params = len(p[1])
+        f_entry = self.tableptr.items[0].symbols[curr_symt.name]
+        params = [(param.id, get_type(param.dtype, param.pointer_level)) for param in p[1]]
+
+        proto_types = f_entry['signature'].types
+        if len(proto_types) > 0:
+            if len(proto_types) != len(params):
+                raise CompileError('parameter mismatch with prototype')
+
+            for index, (_type, (_, param_type)) in enumerate(zip(proto_types, params)):
+                if _type is not param_type:
+                    raise CompileError('parameter #%d type mismatch with prototype.' % (index + 1))
+
+            curr_symt.clear()
+
+        signature = make_signature(params)
+        for name, _type, width in zip(signature.names, signature.types, signature.widths):
+            curr_symt.enter(name, _type, width)
+        self.offset.updateTop(self.offset.top() + signature.size)
+
+        curr_symt.num_params = len(params)
+        f_entry['signature'] = signature
 
     def p_formal_param_list(self, p):
-        '''formal_param_list : formal_param COMMA formal_param_list
-                             | formal_param
+        '''formal_param_list : formal_param_seq
+                             | formal_param_seq COMMA
                              | empty'''
+        p[0] = p[1] if p[1] is not None else []
+
+    def p_formal_param_seq(self, p):
+        '''formal_param_seq : formal_param_seq COMMA formal_param
+                            | formal_param'''
         if len(p) == 4:
-            p[0] = [p[1]] + p[3]
-        elif len(p) == 2:
-            if p[1]:
-                p[0] = [p[1]]
-            else:
-                p[0] = []
+            p[0] = p[1]
+            p[0].append(p[3])
+        else:
+            p[0] = [p[1]]
 
     def p_formal_param(self, p):
         '''formal_param : type stars id_d'''
@@ -260,14 +454,13 @@ class APLParser(object):
         self.pop_tableptr()
 
     def p_statement_list(self, p):
-        '''statement_list : statement statement_list
-                          | block statement_list
+        '''statement_list : statement_list statement
+                          | statement_list block
                           | empty'''
         if len(p) == 3:
-            if isinstance(p[1], DeclList):
-                p[0] = p[2]
-            else:
-                p[0] = [p[1]] + p[2]
+            p[0] = p[1]
+            if not isinstance(p[2], DeclList):
+                p[0].append(p[2])
         else:
             p[0] = []
 
@@ -292,16 +485,12 @@ class APLParser(object):
             check_direct_access(p[2])
 
             p[0] = ReturnStmt(p[2])
-            if p[2].dtype != ret_type:
-                print('invalid return.')
-                print('expected %s, got %s.' % (str(ret_type), str(p[2].dtype)))
-                sys.exit(0)
+            if p[2].dtype is not ret_type:
+                raise CompileError('invalid return.\nexpected %s, got %s.' % (str(ret_type), str(p[2].dtype)))
         else:
             p[0] = ReturnStmt(None)
-            if ret_type != ('void', 0):
-                print('invalid return.')
-                print('expected %s, got %s.' % (str(ret_type), 'void'))
-                sys.exit(0)
+            if ret_type is not VOID:
+                raise CompileError('invalid return.\nexpected %s, got %s.' % (str(ret_type), 'void'))
 
     def p_block_statement(self, p):
         '''block_statement : block
@@ -331,59 +520,57 @@ class APLParser(object):
         f_name = p[1].value
 
         entry = p[1].entry
-        if entry['type'] != 'function':
-            print('undefined function %s.' % (f_name))
-            sys.exit(0)
-
-        f_symtable = entry['tableptr']
-        if f_symtable.num_params != len(param_list):
-            print('function %s expected %d parameters, got %d.' % (f_name, f_symtable.num_params, len(param_list)))
-            sys.exit(0)
+        if entry['type'] is not FUNCTION:
+            raise CompileError('undefined function %s.' % (f_name))
 
-        index = 0
-        for k, v in f_symtable.symbols.items():
-            if index == f_symtable.num_params:
-                break
+        param_types = entry['signature'].types
+        if len(param_types) != len(param_list):
+            raise CompileError('function %s expected %d parameters, got %d.' %
+                               (f_name, len(param_types), len(param_list)))
 
-            if v['type'] != param_list[index].dtype:
-                print('function %s expected %s as param #%d, got %s.' % (f_name, str(v['type']), index + 1, param_list[index].dtype))
-                sys.exit(0)
-
-            index += 1
+        for index, (_type, param) in enumerate(zip(param_types, param_list)):
+            if _type is not param.dtype:
+                raise CompileError('function %s expected %s as param #%d, got %s.' %
+                                   (f_name, str(_type), index + 1, param.dtype))
 
         p[0].dtype = entry['ret_type']
 
     def p_expr_list(self, p):
-        '''expr_list : expression COMMA expr_list
-                     | expression
+        '''expr_list : expr_seq
+                     | expr_seq COMMA
                      | empty'''
-        if p[1] is not None:
-            check_direct_access(p[1])
+        p[0] = p[1] if p[1] is not None else []
 
-        if len(p) > 2:
-            p[0] = [p[1]] + p[3]
+    def p_expr_seq(self, p):
+        '''expr_seq : expr_seq COMMA expression
+                    | expression'''
+        if len(p) == 4:
+            check_direct_access(p[3])
+            p[0] = p[1]
+            p[0].append(p[3])
         else:
-            p[0] = [p[1]] if p[1] is not None else []
+            check_direct_access(p[1])
+            p[0] = [p[1]]
 
     def p_declaration(self, p):
         '''declaration : type list'''
         decl_vars = []
         curr_symt = self.tableptr.top()
         for v in p[2]:
-            p_level = v[1]
-            width = get_width((p[1], p_level))
-            curr_symt.enter(v[0], (p[1], p_level), width)
-            self.offset.updateTop(self.offset.top() + width)
+            _type = get_type(p[1], v[1])
+            curr_symt.enter(v[0], _type, _type.width)
+            self.offset.updateTop(self.offset.top() + _type.width)
 
             decl_vars.append(Decl(v[0], p[1], v[1]))
 
         p[0] = DeclList(decl_vars)
 
     def p_list_pointer(self, p):
-        '''list : stars id_d COMMA list
+        '''list : list COMMA stars id_d
                 | stars id_d'''
         if len(p) > 3:
-            p[0] = [(p[2].value, len(p[1]))] + p[4]
+            p[0] = p[1]
+            p[0].append((p[4].value, len(p[3])))
         else:
             p[0] = [(p[2].value, len(p[1]))]
 
@@ -394,28 +581,25 @@ class APLParser(object):
 
     def p_assignment_lhs(self, p):
         '''assignment : lhs EQUALS expression'''
-        t = Token('ASGN', '=')
-        p[0] = BinOp(p[1], p[3], t)
+        p[0] = BinOp(p[1], p[3], ASGN)
 
         check_direct_access(p[1])
         check_direct_access(p[3])
 
-        if p[1].dtype != p[3].dtype:
+        if p[1].dtype is not p[3].dtype:
             print_op_error(p[2], p[1].dtype, p[3].dtype)
 
         p[0].dtype = p[1].dtype
 
     def p_lhs(self, p):
         '''lhs : STAR lhs'''
-        t = Token('DEREF', p[1])
-        p[0] = UnaryOp(p[2], t)
+        p[0] = UnaryOp(p[2], DEREF)
 
         dtype = p[2].dtype
-        if dtype[1] <= 0:
-            print('invalid usage of pointer.')
-            sys.exit(0)
+        if dtype.pointee is None:
+            raise CompileError('invalid usage of pointer.')
 
-        p[0].dtype = (dtype[0], dtype[1]-1)
+        p[0].dtype = dtype.pointee
 
     def p_lhs_id(self, p):
         '''lhs : id'''
@@ -426,27 +610,18 @@ class APLParser(object):
                       | expression MINUS expression
                       | expression STAR expression
                       | expression DIVIDE expression'''
-        t = None
-        if p[2] == '+':
-            t = Token('PLUS', '+')
-        elif p[2] == '-':
-            t = Token('MINUS', '-')
-        elif p[2] == '*':
-            t = Token('MUL', '*')
-        elif p[2] == '/':
-            t = Token('DIV', '/')
-
-        p[0] = BinOp(p[1], p[3], t)
+        p[0] = BinOp(p[1], p[3], BINARY_OPS[p[2]])
 
         check_direct_access(p[1])
         check_direct_access(p[3])
 
-        if p[1].dtype != p[3].dtype or\
-           p[1].dtype[1] != 0 or\
-           p[1].dtype[0] == 'void':
+        if p[1].dtype is not p[3].dtype or\
+           p[1].dtype.pointer_level != 0 or\
+           p[1].dtype is VOID:
             print_op_error(p[2], p[1].dtype, p[3].dtype)
 
         p[0].dtype = p[1].dtype
+        p[0] = self.fold(p[0])
 
     def p_logical_expression_binop(self, p):
         '''logical_expression : expression LT expression
@@ -457,60 +632,41 @@ class APLParser(object):
                               | expression NE expression
                               | logical_expression BOOL_AND logical_expression
                               | logical_expression BOOL_OR logical_expression'''
-        t = None
-        if p[2] == '<':
-            t = Token('LT', p[2])
-        elif p[2] == '<=':
-            t = Token('LE', p[2])
-        elif p[2] == '>':
-            t = Token('GT', p[2])
-        elif p[2] == '>=':
-            t = Token('GE', p[2])
-        elif p[2] == '==':
-            t = Token('EQ', p[2])
-        elif p[2] == '!=':
-            t = Token('NE', p[2])
-        elif p[2] == '&&':
-            t = Token('AND', p[2])
-        elif p[2] == '||':
-            t = Token('OR', p[2])
-
-        p[0] = BinOp(p[1], p[3], t)
+        p[0] = BinOp(p[1], p[3], BINARY_OPS[p[2]])
 
         check_direct_access(p[1])
         check_direct_access(p[3])
 
-        if p[1].dtype != p[3].dtype or\
-           p[1].dtype[1] != 0 or\
-           p[1].dtype[0] == 'void':
+        if p[1].dtype is not p[3].dtype or\
+           p[1].dtype.pointer_level != 0 or\
+           p[1].dtype is VOID:
             print_op_error(p[2], p[1].dtype, p[3].dtype)
 
-        p[0].dtype = ('bool', 0)
+        p[0].dtype = BOOL
+        p[0] = self.fold(p[0])
 
     def p_logical_expression_not(self, p):
         '''logical_expression : BOOL_NOT logical_expression'''
-        t = Token('NOT', '!')
-        p[0] = UnaryOp(p[2], t)
+        p[0] = UnaryOp(p[2], NOT)
 
-        if p[2].dtype != ('bool', 0):
-            print('invalid usage of operator logical NOT.')
-            sys.exit(0)
+        if p[2].dtype is not BOOL:
+            raise CompileError('invalid usage of operator logical NOT.')
 
-        p[0].dtype = ('bool', 0)
+        p[0].dtype = BOOL
+        p[0] = self.fold(p[0])
 
     def p_expression_uminus(self, p):
         '''expression : MINUS expression %prec UMINUS'''
-        t = Token('UMINUS', '-')
-        p[0] = UnaryOp(p[2], t)
+        p[0] = UnaryOp(p[2], UMINUS)
 
         check_direct_access(p[2])
 
         dtype = p[2].dtype
-        if dtype[0] == 'void' or dtype[1] != 0:
-            print('invalid use of operator unary minus on expression of type: ', dtype)
-            sys.exit(0)
+        if dtype is VOID or dtype.pointer_level != 0:
+            raise CompileError('invalid use of operator unary minus on expression of type:  %s' % (str(dtype)))
 
         p[0].dtype = dtype
+        p[0] = self.fold(p[0])
 
     def p_expression_paren(self, p):
         '''expression : LPAREN expression RPAREN
@@ -526,45 +682,38 @@ class APLParser(object):
 
     def p_exression_deref(self, p):
         '''expression : STAR expression'''
-        t = Token('DEREF', p[1])
-        p[0] = UnaryOp(p[2], t)
+        p[0] = UnaryOp(p[2], DEREF)
 
         dtype = p[2].dtype
-        if dtype[1] <= 0:
-            print('invalid usage of pointer.')
-            sys.exit(0)
+        if dtype.pointee is None:
+            raise CompileError('invalid usage of pointer.')
 
-        p[0].dtype = (dtype[0], dtype[1]-1)
+        p[0].dtype = dtype.pointee
 
     def p_addr(self, p):
         '''addr : AND id'''
 
-        if p[2].entry['type'] == 'function':
-            print('invalid usage of function %s.' % (p[2].value))
-            sys.exit(0)
+        if p[2].entry['type'] is FUNCTION:
+            raise CompileError('invalid usage of function %s.' % (p[2].value))
 
-        t = Token('ADDR', p[1])
-        p[0] = UnaryOp(p[2], t)
+        p[0] = UnaryOp(p[2], ADDR)
 
-        dtype = p[2].entry['type']
-        p[0].dtype = (dtype[0], dtype[1]+1)
+        p[0].dtype = p[2].entry['type'].pointer
 
     def p_id(self, p):
         '''id : ID'''
-        curr_symt = self.tableptr.top()
-        entry = curr_symt.look_up(p[1])
+        entry = self.tableptr.look_up(p[1])
         if entry is None:
-            print('undefined identifier %s.' % (p[1]))
-            sys.exit(0)
+            raise CompileError('undefined identifier %s.' % (p[1]), p.lineno(1))
         p[0] = Var(p[1], entry)
 
     def p_number_int(self, p):
         '''number : INTEGER'''
-        p[0] = Const(p[1], ('int', 0))
+        p[0] = Const(p[1].value, INT, p[1].text)
 
     def p_number_real(self, p):
         '''number : REAL'''
-        p[0] = Const(p[1], ('float', 0))
+        p[0] = Const(p[1].value, FLOAT, p[1].text)
 
     def p_empty(self, p):
         'empty :'
@@ -574,37 +723,146 @@ class APLParser(object):
         if p:
             # stack_state_str = " ".join([symbol.type for symbol
             #                             in self.parser.symstack[1:]])
-            print("Syntax error at '%s' line %d" %
-                  (p.value, p.lineno))
+            raise CompileError("Syntax error at '%s' line %d" % (p.value, p.lineno), p.lineno)
         else:
-            print("Syntax error at EOF")
-        sys.exit(0)
+            raise CompileError("Syntax error at EOF")
 
     def parse(self, text):
-        return self.parser.parse(text, self.lexer)
+        lexer = self.lexer
+        if self.func_cache is not None:
+            # the cache keys on the tokens of each function
+            lexer = self.token_recorder = TokenRecorder(self.lexer)
+        try:
+            return self.parser.parse(text, lexer)
+        except CompileError as e:
+            if e.lineno is None:
+                e.lineno = self.lexer.lexer.lineno
+            if e.filename is None:
+                e.filename = self.filename
+            raise
+        except Exception as e:
+            raise internal_error(e, self.lexer.lexer.lineno, self.filename)
+
+
+def open_output(f):
+    return open(f, 'w') if isinstance(f, str) else f
+
+
+def capture_diagnostics(func, *args):
+    '''
+    run func(*args), returning (result, error, warnings) where error is the
+    CompileError it raised or None, and warnings everything printed while
+    it ran. any other exception is reported as an internal compiler error,
+    failing this input alone
+    '''
+    warnings = io.StringIO()
+    result = None
+    error = None
+    with contextlib.redirect_stdout(warnings):
+        try:
+            result = func(*args)
+        except CompileError as e:
+            error = e
+        except Exception as e:
+            error = internal_error(e)
+    return result, error, warnings.getvalue()
+
+
+def build(data_files, debug=False, lexer_backend='ply', func_cache_dir=None, emit=ARTIFACTS,
+          stream=False, optimize=False):
+    '''
+    compile every file in `data_files` with a single APLParser, so the
+    lexer and the parse tables are only built once. a file failing to
+    compile does not stop the others.
+    returns a list of (data_file, error, warnings) as capture_diagnostics
+    '''
+    parser = APLParser(debug=debug, lexer_backend=lexer_backend, func_cache_dir=func_cache_dir,
+                       stream=stream, optimize=optimize)
+    results = []
+    for data_file in data_files:
+        _, error, warnings = capture_diagnostics(parser.compile_file, data_file, emit)
+        results.append((data_file, error, warnings))
+    return results
+
+
+# warm parser of a build_parallel worker process, and the artifacts it emits
+worker_parser = None
+worker_emit = ARTIFACTS
+
+
+def init_worker(lexer_backend, func_cache_dir, emit=ARTIFACTS, stream=False, optimize=False):
+    global worker_parser, worker_emit
+    worker_parser = APLParser(lexer_backend=lexer_backend, func_cache_dir=func_cache_dir,
+                              stream=stream, optimize=optimize)
+    worker_emit = emit
+
+
+def compile_in_worker(data_file):
+    '''returns (data_file, error, warnings) as capture_diagnostics'''
+    _, error, warnings = capture_diagnostics(worker_parser.compile_file, data_file, worker_emit)
+    return data_file, error, warnings
+
+
+def build_parallel(data_files, jobs=None, debug=False, lexer_backend='ply', func_cache_dir=None,
+                   emit=ARTIFACTS, stream=False, optimize=False):
+    '''
+    compile `data_files` on a pool of `jobs` worker processes (all cores
+    by default), each holding a ready built APLParser.
+    returns a list of (data_file, error, warnings), in the order of
+    `data_files`
+    '''
+    # build (or load) the parse tables once here, so the workers only
+    # ever read the table cache
+    APLParser(debug=debug, lexer_backend=lexer_backend)
+
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    chunksize = max(1, len(data_files) // (jobs * 4))
+
+    with ProcessPoolExecutor(jobs, initializer=init_worker,
+                             initargs=(lexer_backend, func_cache_dir, emit, stream,
+                                       optimize)) as pool:
+        return list(pool.map(compile_in_worker, data_files, chunksize=chunksize))
 
 
 if __name__ == "__main__":
 
-    if len(sys.argv) < 2:
+    args = sys.argv[1:]
+    debug = '--debug' in args
+    if debug:
+        args.remove('--debug')
+
+    stream = '--stream' in args
+    if stream:
+        args.remove('--stream')
+
+    optimized = '-O' in args
+    if optimized:
+        args.remove('-O')
+
+    emit = ARTIFACTS
+    for arg in args:
+        if arg.startswith('--emit='):
+            args.remove(arg)
+            try:
+                emit = parse_artifacts(arg[len('--emit='):])
+            except ValueError as e:
+                print(e)
+                sys.exit(-1)
+            break
+
+    if len(args) < 1:
         print('Invalid arguments!')
         sys.exit(-1)
 
-    data = None
-    data_file = sys.argv[1]
-    with open(data_file, 'r') as file:
-        data = file.read()
-
-    dirname = os.path.dirname(data_file)
-    basename = os.path.basename(data_file)
-
-    ast_filename = os.path.join(dirname, basename + '.ast')
-    cfg_filename = os.path.join(dirname, basename + '.cfg')
-    sym_filename = os.path.join(dirname, basename + '.sym')
-    asm_filename = os.path.join(dirname, basename + '.s')
-
-    # with open(out_file, 'w') as file:
-    parser = APLParser(ast_filename, cfg_filename, sym_filename, asm_filename)
-    parser.parse(data)
+    parser = APLParser(debug=debug, stream=stream, optimize=optimized)
+    try:
+        parser.compile_file(args[0], emit)
+    except CompileError as e:
+        # the message alone, as the compiler has always printed it
+        print(e.message)
+        sys.exit(0)
 
-    print('Successfully Compiled.')
\ No newline at end of file
+    print('Successfully Compiled.')
+    if optimized and parser.opt_stats:
+        print(format_stats(parser.opt_stats))
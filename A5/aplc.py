@@ -0,0 +1,141 @@
+'''
+Command line driver for compiling many files with one warm compiler.
+
+usage:
+    python3 aplc.py build [-j N] [-O] [--debug] [--lexer {ply,dfa}] [--func-cache DIR | --stream]
+                          [--emit ast,cfg,sym,asm] <file> [<file> ...]
+    python3 aplc.py serve [--socket PATH] [-O] [--lexer {ply,dfa}] [--func-cache DIR]
+    python3 aplc.py compile [--socket PATH] [--emit ast,cfg,sym,asm] <file> [<file> ...]
+'''
+import argparse
+import sys
+import time
+
+from artifacts import ARTIFACTS, output_filenames, parse_artifacts
+import server
+
+
+def cmd_build(args):
+    from Parser import build, build_parallel
+
+    start = time.perf_counter()
+    failed = 0
+
+    if args.jobs == 1:
+        results = build(args.files, debug=args.debug, lexer_backend=args.lexer,
+                        func_cache_dir=args.func_cache, emit=args.emit, stream=args.stream,
+                        optimize=args.optimize)
+    else:
+        jobs = args.jobs if args.jobs > 0 else None
+        results = build_parallel(args.files, jobs, debug=args.debug, lexer_backend=args.lexer,
+                                 func_cache_dir=args.func_cache, emit=args.emit,
+                                 stream=args.stream, optimize=args.optimize)
+
+    for data_file, error, warnings in results:
+        if warnings:
+            print('%s:' % (data_file))
+            sys.stdout.write(warnings)
+        if error is not None:
+            print(error)
+            failed += 1
+
+    elapsed = time.perf_counter() - start
+
+    if failed:
+        print('%d of %d file(s) failed to compile.' % (failed, len(args.files)))
+        sys.exit(1)
+    print('Successfully Compiled %d file(s) in %.3f s.' % (len(args.files), elapsed))
+
+
+def cmd_serve(args):
+    print('serving on %s' % (args.socket))
+    try:
+        server.serve(args.socket, lexer_backend=args.lexer, func_cache_dir=args.func_cache,
+                     optimize=args.optimize)
+    except KeyboardInterrupt:
+        pass
+
+
+def cmd_compile(args):
+    failed = 0
+
+    for data_file in args.files:
+        with open(data_file, 'r') as file:
+            response = server.request(file.read(), args.emit, args.socket)
+
+        if response['warnings']:
+            print('%s:' % (data_file))
+            sys.stdout.write(response['warnings'])
+
+        error = response['error']
+        if error is not None:
+            if error['line'] is None:
+                print('%s: %s' % (data_file, error['message']))
+            else:
+                print('%s:%d: %s' % (data_file, error['line'], error['message']))
+            failed += 1
+            continue
+
+        artifacts = response['artifacts']
+        for name, filename in zip(args.emit, output_filenames(data_file, args.emit)):
+            with open(filename, 'w') as file:
+                file.write(artifacts[name])
+
+    if failed:
+        print('%d of %d file(s) failed to compile.' % (failed, len(args.files)))
+        sys.exit(1)
+
+
+def parse_emit(value):
+    try:
+        return parse_artifacts(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def make_argparser():
+    argparser = argparse.ArgumentParser(prog='aplc')
+    commands = argparser.add_subparsers(dest='command')
+    commands.required = True
+
+    build_cmd = commands.add_parser('build', help='compile source files')
+    build_cmd.add_argument('files', nargs='+', metavar='file')
+    build_cmd.add_argument('-j', '--jobs', type=int, default=1,
+                           help='number of worker processes, 0 for one per core')
+    build_cmd.add_argument('--debug', action='store_true',
+                           help='regenerate the parse tables and write parser.out')
+    build_cmd.add_argument('--lexer', choices=('ply', 'dfa'), default='ply')
+    build_cmd.add_argument('-O', '--optimize', action='store_true',
+                           help='fold constants and optimize the three address code')
+    codegen = build_cmd.add_mutually_exclusive_group()
+    codegen.add_argument('--func-cache', metavar='DIR',
+                       help='reuse per-function .cfg and asm results cached in DIR')
+    codegen.add_argument('--stream', action='store_true',
+                       help='generate code for each function as soon as it is parsed')
+    build_cmd.add_argument('--emit', type=parse_emit, default=ARTIFACTS,
+                           help='comma separated subset of %s to write, phases only needed '
+                                'for the others are skipped' % (','.join(ARTIFACTS)))
+    build_cmd.set_defaults(func=cmd_build)
+
+    serve_cmd = commands.add_parser('serve', help='run a compile server')
+    serve_cmd.add_argument('--socket', default=server.DEFAULT_SOCKET)
+    serve_cmd.add_argument('--lexer', choices=('ply', 'dfa'), default='ply')
+    serve_cmd.add_argument('-O', '--optimize', action='store_true',
+                           help='fold constants and optimize the three address code')
+    serve_cmd.add_argument('--func-cache', metavar='DIR',
+                           help='reuse per-function .cfg and asm results cached in DIR')
+    serve_cmd.set_defaults(func=cmd_serve)
+
+    compile_cmd = commands.add_parser('compile', help='compile source files on a running server')
+    compile_cmd.add_argument('files', nargs='+', metavar='file')
+    compile_cmd.add_argument('--socket', default=server.DEFAULT_SOCKET)
+    compile_cmd.add_argument('--emit', type=parse_emit, default=ARTIFACTS,
+                             help='comma separated subset of %s' % (','.join(ARTIFACTS)))
+    compile_cmd.set_defaults(func=cmd_compile)
+
+    return argparser
+
+
+if __name__ == '__main__':
+    args = make_argparser().parse_args()
+    args.func(args)
@@ -0,0 +1,23 @@
+# compiler outputs, in the order APLParser.reset takes them
+ARTIFACTS = ('ast', 'cfg', 'sym', 'asm')
+
+ARTIFACT_EXTENSIONS = {
+    'ast': '.ast',
+    'cfg': '.cfg',
+    'sym': '.sym',
+    'asm': '.s',
+}
+
+
+def output_filenames(data_file, artifacts=ARTIFACTS):
+    '''output filenames of `artifacts` for the source file `data_file`'''
+    return tuple(data_file + ARTIFACT_EXTENSIONS[name] for name in artifacts)
+
+
+def parse_artifacts(value):
+    '''tuple of the artifacts in the comma separated list `value`'''
+    artifacts = tuple(x for x in value.split(',') if x)
+    for name in artifacts:
+        if name not in ARTIFACTS:
+            raise ValueError('unknown artifact %s' % (name))
+    return artifacts
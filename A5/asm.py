@@ -1,8 +1,59 @@
 from collections import OrderedDict
+from itertools import islice
 from ast import BinOp, UnaryOp, FunctionCall, ReturnStmt,\
     Var, Const
-from symtablev2 import get_width
-from copy import deepcopy
+from symtablev2 import INT, FLOAT, BOOL, FUNCTION, BLOCK
+
+# temporaries kept in registers at a time, of each of the int and float registers
+TEMP_REGISTERS = 8
+
+
+def node_statements(node):
+    '''the statements of the three address code of `node`, then what its jump reads'''
+    if node.is_return:
+        return node.body + [node.return_id]
+    if node.logical:
+        return node.body + [node.cond]
+    return node.body
+
+
+def temp_reads(stmt):
+    '''
+    (names of the temporaries `stmt` reads, once per read; the calls it
+    makes: None for none, 'args' if it is a call, or assigns one, with
+    plain values as arguments, 'other' otherwise)
+    '''
+    names = []
+    call = None
+    if isinstance(stmt, BinOp) and stmt.op == 'ASGN':
+        stack = [stmt.right_child]
+        if not isinstance(stmt.left_child, Var):
+            stack.append(stmt.left_child.child)
+        top = stmt.right_child
+    else:
+        stack = [stmt]
+        top = stmt
+
+    while stack:
+        ast = stack.pop()
+        if isinstance(ast, Var):
+            if ast.entry is None:
+                names.append(ast.value)
+        elif isinstance(ast, BinOp):
+            stack.append(ast.left_child)
+            stack.append(ast.right_child)
+        elif isinstance(ast, UnaryOp):
+            stack.append(ast.child)
+        elif isinstance(ast, FunctionCall):
+            simple = ast is top and all(isinstance(p, (Var, Const, UnaryOp)) for p in ast.actual_params)
+            call = 'args' if simple and call is None else 'other'
+            stack.extend(ast.actual_params)
+
+    if call is not None and top is not stmt and not isinstance(stmt.left_child, Var):
+        # the pointer stored through is computed after the call
+        call = 'other'
+    return names, call
+
 
 def code_string(code):
     temp_string = ''
@@ -16,10 +67,21 @@ def code_string(code):
 
 class ASMCodeGenerator():
 
-    def __init__(self, cfg, symtable, asm_file):
+    def __init__(self, cfg, symtable, asm_file, data=True, label_prefix='label', fcmp_prefix='',
+                 fcmp_start=0):
+        '''
+        Args:
+            cfg (CFG): functions to generate code for, None for only the data part
+            data (bool): write the .data part, otherwise only the code
+            label_prefix (str), fcmp_prefix (str): prefixes of the basic block
+                labels and of the numbers of float comparison labels
+            fcmp_start (int): number of the first float comparison label
+        '''
         self.cfg = cfg
         self.symtable = symtable
         self.asm_file = asm_file
+        self.label_prefix = label_prefix
+        self.fcmp_prefix = fcmp_prefix
 
         self.label_count = 0
 
@@ -63,10 +125,19 @@ class ASMCodeGenerator():
             'f8': True,
         })
 
-        self.fcmp_count = 0
+        # registers of temporaries read again later: the reads before the
+        # last get the register itself, and freeing it after use leaves it
+        self.shared_registers = set()
 
-        self.data_part()
-        self.text_part()
+        self.fcmp_count = fcmp_start
+
+        if data:
+            self.data_part()
+        else:
+            self.global_vars = self.global_variables()
+
+        if cfg is not None:
+            self.text_part()
 
     def get_register(self, freg=False):
 
@@ -87,24 +158,29 @@ class ASMCodeGenerator():
             self.registers[reg] = False
 
     def free_register(self, reg):
+        if reg in self.shared_registers:
+            return
         if reg in self.float_registers:
             self.float_registers[reg] = True
         elif reg in self.registers:
             self.registers[reg] = True
 
-    def data_part(self):
-        data_string = '\t.data\n'
-
+    def global_variables(self):
         global_vars = []
         for k, v in self.symtable.symbols.items():
-            if v['type'] not in ('function', 'block'):
+            if v['type'] is not FUNCTION and v['type'] is not BLOCK:
                 # variable
                 global_vars.append((k, v))
 
-        global_vars = sorted(global_vars, key=lambda x: x[0])
+        return sorted(global_vars, key=lambda x: x[0])
+
+    def data_part(self):
+        data_string = '\t.data\n'
+
+        global_vars = self.global_variables()
         for (k, v) in global_vars:
             data_string += 'global_' + k + ':\t'
-            if v['type'][1] > 0 or v['type'][0] == 'int':
+            if v['type'].pointer_level > 0 or v['type'].base == 'int':
                 data_string += '.word\t0\n'
             else:
                 data_string += '.space\t8\n'
@@ -116,12 +192,12 @@ class ASMCodeGenerator():
 
         func_start = 0
 
-        for i in range(0, self.cfg.node_count):
-            node = self.cfg.nodes[i]
-            # if node.func is not None or node.end:
-            if node.is_return:
-                self.func_code(self.cfg.nodes[func_start:i+1])
-                func_start = i+1
+        # a function runs up to the first block of the next one, returns
+        # can be anywhere in it
+        for i in range(1, self.cfg.node_count + 1):
+            if i == self.cfg.node_count or self.cfg.nodes[i].func is not None:
+                self.func_code(self.cfg.nodes[func_start:i])
+                func_start = i
 
     def get_variable_offset(self, name, local_vars, params):
         '''
@@ -164,26 +240,32 @@ class ASMCodeGenerator():
             return t_reg
 
         if isinstance(ast, Const):
-            if ast.dtype[0] == 'int':
+            if ast.dtype is INT or ast.dtype is BOOL:
                 reg = self.get_register()
-                code.append('li $%s, %s' % (reg, ast.value))
+                code.append('li $%s, %s' % (reg, ast.text))
                 self.use_register(reg)
                 return reg
-            elif ast.dtype[0] == 'float':
+            elif ast.dtype is FLOAT:
                 '''li.s $f10, <const>'''
                 reg = self.get_register(freg=True)
-                code.append('li.s $%s, %s' % (reg, ast.value))
+                code.append('li.s $%s, %s' % (reg, ast.text))
                 self.use_register(reg)
                 return reg
 
         elif isinstance(ast, Var):
+            if ast.entry is None:
+                return self.temp_code(ast, code)
+
             '''lw $<reg>, <c_offset>($sp)'''
-            reg = self.get_register()
+            # a float variable is only read as *&x
+            freg = ast.dtype is FLOAT
+            load = 'l.s' if freg else 'lw'
+            reg = self.get_register(freg)
             loc, is_global = self.get_variable_offset(ast.value, local_vars, params)
             if is_global:
-                code.append('lw $%s, %s' % (reg, loc))
+                code.append('%s $%s, %s' % (load, reg, loc))
             else:
-                code.append('lw $%s, %d($sp)' % (reg, loc))
+                code.append('%s $%s, %d($sp)' % (load, reg, loc))
             self.use_register(reg)
             return reg
 
@@ -201,13 +283,13 @@ class ASMCodeGenerator():
 
                 reg1 = self.simple_expression_code(ast.child, local_vars, params, code)
 
-                if ast.dtype[1] > 0 or ast.dtype[0] == 'int':
+                if ast.dtype.pointer_level > 0 or ast.dtype.base == 'int':
                     reg2 = self.get_register()
                     code.append('lw $%s, 0($%s)' % (reg2, reg1))
                     self.free_register(reg1)
                     self.use_register(reg2)
                     return reg2
-                elif ast.dtype == ('float', 0):
+                elif ast.dtype is FLOAT:
                     reg2 = self.get_register(freg=True)
                     code.append('l.s $%s, 0($%s)' % (reg2, reg1))
                     self.free_register(reg1)
@@ -231,7 +313,7 @@ class ASMCodeGenerator():
                 return reg
 
             elif ast.op == 'UMINUS':
-                if ast.dtype == ('int', 0):
+                if ast.dtype is INT:
                     '''
                     negu $s1, $s0
                     move $s0, $s1
@@ -242,7 +324,7 @@ class ASMCodeGenerator():
                     self.use_register(reg2)
                     self.free_register(reg1)
                     return move_reg(reg2)
-                elif ast.dtype == ('float', 0):
+                elif ast.dtype is FLOAT:
                     '''
                     neg.s $f12, $f10
                     mov.s $f10, $f12
@@ -265,7 +347,7 @@ class ASMCodeGenerator():
 
         elif isinstance(ast, BinOp):
 
-            if ast.left_child.dtype == ('int', 0):
+            if ast.left_child.dtype is INT:
                 '''integer operations'''
 
                 reg1 = self.simple_expression_code(ast.left_child, local_vars, params, code)
@@ -321,7 +403,7 @@ class ASMCodeGenerator():
                 self.free_register(reg2)
                 return move_reg(reg)
 
-            elif ast.left_child.dtype == ('bool', 0):
+            elif ast.left_child.dtype is BOOL:
 
                 reg1 = self.simple_expression_code(ast.left_child, local_vars, params, code)
                 reg2 = self.simple_expression_code(ast.right_child, local_vars, params, code)
@@ -340,7 +422,7 @@ class ASMCodeGenerator():
                 self.free_register(reg2)
                 return move_reg(reg)
 
-            elif ast.left_child.dtype == ('float', 0):
+            elif ast.left_child.dtype is FLOAT:
                 '''float operations'''
 
                 reg1 = self.simple_expression_code(ast.left_child, local_vars, params, code)
@@ -403,12 +485,12 @@ class ASMCodeGenerator():
                     elif ast.op == 'EQ':
                         code.append('c.eq.s $%s, $%s' % (reg2, reg1))
 
-                    code.append('bc1f L_CondFalse_%d' % (cond_label))
+                    code.append('bc1f L_CondFalse_%s%d' % (self.fcmp_prefix, cond_label))
                     code.append('li $%s, 1' % (reg))
-                    code.append('j L_CondEnd_%d' % (cond_label))
-                    code.append('@L_CondFalse_%d:' % (cond_label))
+                    code.append('j L_CondEnd_%s%d' % (self.fcmp_prefix, cond_label))
+                    code.append('@L_CondFalse_%s%d:' % (self.fcmp_prefix, cond_label))
                     code.append('li $%s, 0' % (reg))
-                    code.append('@L_CondEnd_%d:' % (cond_label))
+                    code.append('@L_CondEnd_%s%d:' % (self.fcmp_prefix, cond_label))
 
                     self.free_register(reg1)
                     self.free_register(reg2)
@@ -422,40 +504,34 @@ class ASMCodeGenerator():
                     self.use_register(reg)
 
                     code.append('c.eq.s $%s, $%s' % (reg2, reg1))
-                    code.append('bc1f L_CondTrue_%d' % (cond_label))
+                    code.append('bc1f L_CondTrue_%s%d' % (self.fcmp_prefix, cond_label))
                     code.append('li $%s, 0' % (reg))
-                    code.append('j L_CondEnd_%d' % (cond_label))
-                    code.append('@L_CondTrue_%d:' % (cond_label))
+                    code.append('j L_CondEnd_%s%d' % (self.fcmp_prefix, cond_label))
+                    code.append('@L_CondTrue_%s%d:' % (self.fcmp_prefix, cond_label))
                     code.append('li $%s, 1' % (reg))
-                    code.append('@L_CondEnd_%d:' % (cond_label))
+                    code.append('@L_CondEnd_%s%d:' % (self.fcmp_prefix, cond_label))
 
                     self.free_register(reg1)
                     self.free_register(reg2)
                     return move_reg(reg)
 
         elif isinstance(ast, FunctionCall):
-            num_params = len(ast.actual_params)
             regs = {}
-            param_widths = []
 
             for i, p in enumerate(ast.actual_params):
                 if not isinstance(p, (Var, Const, UnaryOp)):
                     regs[i] = self.simple_expression_code(p, local_vars, params, code)
 
-                param_widths.append(get_width(p.dtype))
-
-            params_offsets = [0] * num_params
-            offset = 0
-
-            for i, w in enumerate(reversed(param_widths)):
-                params_offsets[num_params - i - 1] = offset
-                offset -= w
+            # argument types were checked against the signature by the parser
+            signature = self.symtable.symbols[ast.id]['signature']
+            params_offsets = signature.call_offsets
+            offset = -signature.size
 
             code.append('# setting up activation record for called function')
 
             for i, p in enumerate(ast.actual_params):
 
-                if p.dtype[1] > 0 or p.dtype[0] == 'int':
+                if p.dtype.pointer_level > 0 or p.dtype.base == 'int':
                     if isinstance(p, (Var, Const, UnaryOp)):
                         reg = self.simple_expression_code(p, local_vars, params, code)
                         code.append('sw $%s, %d($sp)' % (reg, params_offsets[i]))
@@ -463,7 +539,7 @@ class ASMCodeGenerator():
                     else:
                         code.append('sw $%s, %d($sp)' % (regs[i], params_offsets[i]))
                         self.free_register(regs[i])
-                elif p.dtype == ('float', 0):
+                elif p.dtype is FLOAT:
                     if isinstance(p, (Var, Const, UnaryOp)):
                         reg = self.simple_expression_code(p, local_vars, params, code)
                         code.append('s.s $%s, %d($sp)' % (reg, params_offsets[i]))
@@ -477,6 +553,78 @@ class ASMCodeGenerator():
             code.append('add $sp, $sp, %d' % (-offset) + ' # destroying activation record of called function')
             return 'v1'
 
+    def place_temps(self, cfg_nodes, offset):
+        '''
+        decide where each temporary of the three address code of cfg_nodes
+        lives. one set once and only read later in the same block, with no
+        call in between, stays in the register its value is computed in
+        (while few enough are held at a time); the others get a stack slot,
+        the slots starting at `offset`.
+        returns the size of the slots
+        '''
+        self.temp_offsets = {}
+        # temporary -> reads left, and register holding it once set
+        self.temp_uses = {}
+        self.temp_regs = {}
+
+        # temporary -> [(block, position) of each assignment, of each read]
+        places = OrderedDict()
+        # (block, position) -> None if no call is made there, 'args' if only
+        # the call the statement consists of, reading plain arguments
+        calls = {}
+
+        for b, node in enumerate(cfg_nodes):
+            for k, stmt in enumerate(node_statements(node)):
+                names, call = temp_reads(stmt)
+                calls[(b, k)] = call
+                for name in names:
+                    places.setdefault(name, ([], []))[1].append((b, k))
+                if isinstance(stmt, BinOp) and isinstance(stmt.left_child, Var) and\
+                   stmt.left_child.entry is None:
+                    places.setdefault(stmt.left_child.value, ([], []))[0].append((b, k))
+
+        # (block, position, is float) -> number of temporaries held in registers there
+        held = {}
+        for name, (sets, reads) in places.items():
+            self.temp_uses[name] = len(reads)
+            if len(sets) == 1 and all(r[0] == sets[0][0] and r[1] > sets[0][1] for r in reads):
+                b, start = sets[0]
+                end = max([k for _, k in reads] + [start])
+                freg = cfg_nodes[b].body[start].left_child.dtype is FLOAT
+                span = range(start, end)
+                if (all(calls[(b, k)] is None for k in range(start + 1, end)) and
+                        calls[(b, end)] in (None, 'args') and
+                        all(held.get((b, k, freg), 0) < TEMP_REGISTERS for k in span)):
+                    for k in span:
+                        held[(b, k, freg)] = held.get((b, k, freg), 0) + 1
+                    continue
+
+            self.temp_offsets[name] = offset
+            offset += 4
+
+        return 4 * len(self.temp_offsets)
+
+    def temp_code(self, ast, code):
+        '''register holding the value of the temporary `ast`'''
+        name = ast.value
+        freg = ast.dtype is FLOAT
+
+        reg = self.temp_regs.get(name)
+        if reg is not None:
+            self.temp_uses[name] -= 1
+            if self.temp_uses[name] == 0:
+                # last read, the register is handed over
+                del self.temp_regs[name]
+                self.shared_registers.discard(reg)
+            else:
+                self.shared_registers.add(reg)
+            return reg
+
+        reg = self.get_register(freg)
+        code.append('%s $%s, %d($sp)' % ('l.s' if freg else 'lw', reg, self.temp_offsets[name]))
+        self.use_register(reg)
+        return reg
+
     def return_code(self, ast, local_vars, params):
         code = []
         reg = self.simple_expression_code(ast, local_vars, params, code)
@@ -506,7 +654,24 @@ class ASMCodeGenerator():
             self.use_register(reg)
             rhs_reg = reg
 
-        if isinstance(ast.left_child, Var):
+        if isinstance(ast.left_child, Var) and ast.left_child.entry is None:
+            name = ast.left_child.value
+            if name in self.temp_offsets:
+                code.append('%s $%s, %d($sp)' % ('s.s' if ast.left_child.dtype is FLOAT else 'sw',
+                                                 rhs_reg, self.temp_offsets[name]))
+            elif self.temp_uses[name]:
+                if rhs_reg in self.shared_registers:
+                    # a copy of a temporary read again later, which keeps its register
+                    freg = ast.left_child.dtype is FLOAT
+                    copy = self.get_register(freg)
+                    code.append('%s $%s, $%s' % ('mov.s' if freg else 'move', copy, rhs_reg))
+                    self.use_register(copy)
+                    rhs_reg = copy
+                # kept in the register until read
+                self.temp_regs[name] = rhs_reg
+                return code_string(code)
+
+        elif isinstance(ast.left_child, Var):
             loc, is_global = self.get_variable_offset(ast.left_child.value, local_vars, params)
             if is_global:
                 code.append('sw $%s, %s' % (rhs_reg, loc))
@@ -518,7 +683,7 @@ class ASMCodeGenerator():
             lhs_reg = self.simple_expression_code(lhs_ast.child, local_vars, params, code)
 
             if lhs_ast.op == 'DEREF':
-                if ast.dtype == ('float', 0):
+                if ast.dtype is FLOAT:
                     code.append('s.s $%s, 0($%s)' % (rhs_reg, lhs_reg))
                 else:
                     code.append('sw $%s, 0($%s)' % (rhs_reg, lhs_reg))
@@ -529,7 +694,12 @@ class ASMCodeGenerator():
 
         return code_string(code)
 
-    def logical_code(self, ast, local_vars, params, goto_t, goto_f):
+    def logical_code(self, ast, local_vars, params, goto_t, goto_f, next_id=None):
+        '''
+        Args:
+            next_id (int): id of the block placed after this one, whose
+                label is not jumped to
+        '''
         code = []
 
         '''
@@ -538,8 +708,12 @@ class ASMCodeGenerator():
         j <node.goto_f>
         '''
         reg = self.simple_expression_code(ast, local_vars, params, code)
-        code.append('bne $%s, $0, label%d' % (reg, goto_t))
-        code.append('j label%d' % (goto_f))
+        if goto_t == next_id:
+            code.append('beq $%s, $0, %s%d' % (reg, self.label_prefix, goto_f))
+        else:
+            code.append('bne $%s, $0, %s%d' % (reg, self.label_prefix, goto_t))
+            if goto_f != next_id:
+                code.append('j %s%d' % (self.label_prefix, goto_f))
 
         self.free_register(reg)
         return code_string(code)
@@ -548,21 +722,19 @@ class ASMCodeGenerator():
 
         code = ''
 
-        if node.is_return:
-            # return node
-            if node.old_body[0] is not None:
-                code += self.return_code(node.old_body[0], local_vars, params)
-
-            code += '\tj epilogue_' + func_name + '\n\n'
-            return code
-
-        if node.logical:
-            code += self.logical_code(node.old_body[0], local_vars, params, node.goto_t, node.goto_f)
-            return code
+        if node.optimized:
+            # three address code, the jump reading node.cond or node.return_id
+            statements = node.body
+            value = node_statements(node)[-1] if node.is_return or node.logical else None
+        elif node.is_return or node.logical:
+            statements = []
+            value = node.old_body[0]
+        else:
+            statements = node.old_body
 
-        for line_ast in node.old_body:
+        for line_ast in statements:
             if isinstance(line_ast, BinOp):
-                assert line_ast.token.type == 'ASGN'
+                assert line_ast.op == 'ASGN'
                 # code += '\t' + line_ast.as_line() + '\n'
                 code += self.assignment_code(line_ast, local_vars, params)
             elif isinstance(line_ast, FunctionCall):
@@ -570,7 +742,21 @@ class ASMCodeGenerator():
                 self.simple_expression_code(line_ast, local_vars, params, f_code)
                 code += code_string(f_code)
 
-        code += '\tj label' + str(node.goto) + '\n'
+        if node.is_return:
+            # return node
+            if value is not None:
+                code += self.return_code(value, local_vars, params)
+
+            code += '\tj epilogue_' + func_name + '\n\n'
+            return code
+
+        if node.logical:
+            code += self.logical_code(value, local_vars, params, node.goto_t, node.goto_f,
+                                      node.id + 1 if node.optimized else None)
+            return code
+
+        if not (node.optimized and node.goto == node.id + 1):
+            code += '\tj ' + self.label_prefix + str(node.goto) + '\n'
         return code
 
     def func_code(self, cfg_nodes):
@@ -589,22 +775,16 @@ class ASMCodeGenerator():
         code_string += '\tsw $fp, -4($sp)\t# Save the frame pointer\n'
         code_string += '\tsub $fp, $sp, 8\t# Update the frame pointer\n'
 
-        f_entry = self.symtable.look_up(func_name)
+        f_entry = self.symtable.symbols[func_name]
         f_symtable = f_entry['tableptr']
+        signature = f_entry['signature']
 
-        num_params = f_symtable.num_params
+        params = [(k, f_symtable.symbols[k]) for k in signature.names]
         local_vars = []
-        params = []
         local_vars_size = 0
 
-        i = 0
-        for k, v in f_symtable.symbols.items():
-            if i < num_params:
-                params.append((k, v))
-                i += 1
-                continue
-
-            if v['type'] not in ('block', ):
+        for k, v in islice(f_symtable.symbols.items(), len(signature.names), None):
+            if v['type'] is not BLOCK:
                 local_vars.append((k, v))
                 local_vars_size += v['width']
 
@@ -615,10 +795,13 @@ class ASMCodeGenerator():
             var[1]['offset'] = offset
             offset += var[1]['width']
 
-        offset = 8 + local_vars_size + 4
-        for p in params:
-            p[1]['offset'] = offset
-            offset += p[1]['width']
+        if cfg_nodes[0].optimized:
+            # the stack slots of the temporaries follow the locals
+            local_vars_size += self.place_temps(cfg_nodes, offset)
+
+        params_start = 8 + local_vars_size + 4
+        for p, offset in zip(params, signature.offsets):
+            p[1]['offset'] = params_start + offset
 
         code_string += '\tsub $sp, $sp, %d\t# Make space for the locals\n' % (8 + local_vars_size)
         code_string += '# Prologue ends\n'
@@ -627,7 +810,7 @@ class ASMCodeGenerator():
 
         for node in cfg_nodes:
 
-            code_string += 'label' + str(node.id) + ':\n'
+            code_string += self.label_prefix + str(node.id) + ':\n'
             self.label_count += 1
 
             code_string += self.node_code(node, local_vars, params, func_name)
@@ -1,143 +1,240 @@
+from io import StringIO
 
-class Token(object):
 
-    def __init__(self, type, value):
-        self.type = type
-        self.value = value
+class Op(str):
+    '''
+    operator of a BinOp/UnaryOp: its name (the string itself) and its
+    source symbol. there is a single instance per operator, see OPS.
+    '''
+
+    def __new__(cls, name, symbol):
+        op = str.__new__(cls, name)
+        op.symbol = symbol
+        return op
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (get_op, (str(self),))
+
+
+ASGN = Op('ASGN', '=')
+PLUS = Op('PLUS', '+')
+MINUS = Op('MINUS', '-')
+MUL = Op('MUL', '*')
+DIV = Op('DIV', '/')
+LT = Op('LT', '<')
+LE = Op('LE', '<=')
+GT = Op('GT', '>')
+GE = Op('GE', '>=')
+EQ = Op('EQ', '==')
+NE = Op('NE', '!=')
+AND = Op('AND', '&&')
+OR = Op('OR', '||')
+NOT = Op('NOT', '!')
+UMINUS = Op('UMINUS', '-')
+DEREF = Op('DEREF', '*')
+ADDR = Op('ADDR', '&')
+
+OPS = {str(op): op for op in (ASGN, PLUS, MINUS, MUL, DIV, LT, LE, GT, GE, EQ, NE,
+                              AND, OR, NOT, UMINUS, DEREF, ADDR)}
+
+# source symbol -> operator, for the binary operators
+BINARY_OPS = {op.symbol: op for op in (PLUS, MINUS, MUL, DIV, LT, LE, GT, GE, EQ, NE, AND, OR)}
+
+
+def get_op(name):
+    return OPS[name]
 
 
 class AST(object):
+    __slots__ = ()
+
+    def __repr__(self):
+        return self.as_string(0)
+
+    def as_string(self, depth=0):
+        out = StringIO()
+        write_ast(self, out, depth)
+        return out.getvalue()
+
+    def as_line(self):
+        return line_string(self)
+
+    def string_parts(self, depth):
+        """
+        pieces of as_string: strings, and (child, depth) pairs to be
+        expanded in their place
+        """
+        raise NotImplementedError
+
+    def line_parts(self):
+        """pieces of as_line: strings, and child nodes to be expanded in their place"""
+        raise NotImplementedError
+
+
+# flush the output buffer of write_ast every this many pieces
+WRITE_CHUNK = 4096
+
+
+def write_ast(node, file, depth=0):
+    """
+    write node.as_string(depth) to `file` piece by piece, with an explicit
+    stack so that arbitrarily deep trees do not hit the recursion limit
+    """
+    out = []
+    stack = [(node, depth)]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            out.append(item)
+            if len(out) >= WRITE_CHUNK:
+                file.write(''.join(out))
+                out = []
+        else:
+            parts = item[0].string_parts(item[1])
+            parts.reverse()
+            stack.extend(parts)
+    file.write(''.join(out))
+
+
+def line_string(node):
+    """node.as_line(), without recursion"""
+    out = []
+    stack = [node]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            out.append(item)
+        else:
+            parts = item.line_parts()
+            parts.reverse()
+            stack.extend(parts)
+    return ''.join(out)
+
+
+def join_parts(items, separator):
+    """items with `separator` between every two of them"""
+    parts = []
+    for i, item in enumerate(items):
+        if i > 0:
+            parts.append(separator)
+        parts.append(item)
+    return parts
 
-    def __init__(self, token, const_leaves=False):
-        self.token = token
-        # self.const_leaves = const_leaves
 
 class BinOp(AST):
+    __slots__ = ('left_child', 'right_child', 'op', 'dtype')
 
-    def __init__(self, left_child, right_child, token):
-        AST.__init__(self, token)
+    def __init__(self, left_child, right_child, op):
         self.left_child = left_child
         self.right_child = right_child
-        self.op = token.type
-        # self.const_leaves = left_child.const_leaves and right_child.const_leaves
+        self.op = op
         self.dtype = None
 
-    def __repr__(self):
-        return self.as_string(0)
-
-    def as_string(self, depth=0):
-        name = self.token.type
+    def string_parts(self, depth):
+        name = self.op
         tab = '\t' * depth
-        return tab + name + '\n' + tab + '(\n' + self.left_child.as_string(depth + 1) +\
-               tab + '\t,\n' + self.right_child.as_string(depth + 1) + tab + ')\n'
+        return [tab + name + '\n' + tab + '(\n', (self.left_child, depth + 1),
+                tab + '\t,\n', (self.right_child, depth + 1), tab + ')\n']
 
-    def as_line(self):
-        return self.left_child.as_line() + ' ' + str(self.token.value) + ' ' + self.right_child.as_line()
+    def line_parts(self):
+        return [self.left_child, ' ' + self.op.symbol + ' ', self.right_child]
 
 
 class UnaryOp(AST):
+    __slots__ = ('child', 'op', 'dtype')
 
-    def __init__(self, child, token):
-        AST.__init__(self, token)
+    def __init__(self, child, op):
         self.child = child
-        self.op = token.type
-        # self.const_leaves = child.const_leaves
+        self.op = op
         self.dtype = None
 
-    def __repr__(self):
-        return self.as_string(0)
-
-    def as_string(self, depth=0):
-        name = self.token.type
+    def string_parts(self, depth):
+        name = self.op
         tab = '\t' * depth
-        return tab + name + '\n' + tab + '(\n' +\
-               self.child.as_string(depth + 1) + tab + ')\n'
+        return [tab + name + '\n' + tab + '(\n', (self.child, depth + 1), tab + ')\n']
 
-    def as_line(self):
-        return str(self.token.value) + self.child.as_line()
+    def line_parts(self):
+        return [self.op.symbol, self.child]
 
 
 class Decl(AST):
+    __slots__ = ('dtype', 'id', 'pointer_level')
 
     def __init__(self, _id, dtype, pointer_level=0):
-        AST.__init__(self, Token('DECL', dtype))
         self.dtype = dtype
         self.id = _id
         self.pointer_level = pointer_level
 
-    def __repr__(self):
-        return self.as_string(0)
-
-    def as_string(self, depth=0):
+    def string_parts(self, depth):
         tab = '\t' * depth
-        return tab + self.dtype + '*'*self.pointer_level + ' ' + self.id + '\n'
+        return [tab + self.dtype + '*'*self.pointer_level + ' ' + self.id + '\n']
 
 
 class DeclList(AST):
+    __slots__ = ('vars', )
 
     def __init__(self, _vars):
-        AST.__init__(self, Token('DECLLIST', 'dlist'))
         self.vars = _vars
 
-    def __repr__(self):
-        return self.as_string(0)
-
-    def as_string(self, depth=0):
-        ret_string = ''
-        for v in self.vars:
-            ret_string += v.as_string(depth)
-        return ret_string
+    def string_parts(self, depth):
+        return [(v, depth) for v in self.vars]
 
 
 class Var(AST):
+    __slots__ = ('value', 'entry', 'dtype')
 
     def __init__(self, value, symt_entry=None):
-        AST.__init__(self, Token('VAR', value))
         self.value = value
         self.entry = symt_entry
         self.dtype = None
         if symt_entry is not None:
             self.dtype = symt_entry['type']
 
-    def __repr__(self):
-        return self.as_string(0)
-
-    def as_string(self, depth=0):
+    def string_parts(self, depth):
         name = self.value
-        return '\t'*depth + 'VAR(%s)\n' % (name)
+        return ['\t'*depth + 'VAR(%s)\n' % (name)]
 
-    def as_line(self):
-        return str(self.token.value)
+    def line_parts(self):
+        return [str(self.value)]
 
 
 class Const(AST):
+    __slots__ = ('dtype', 'value', 'text')
 
-    def __init__(self, value, dtype=None):
-        AST.__init__(self, Token('CONST', value), True)
+    def __init__(self, value, dtype=None, text=None):
+        """
+        Args:
+            value (int or float): the number, 1 or 0 for bool
+            text (str): how the number is written out, str(value) by default
+        """
         self.dtype = dtype
         self.value = value
+        self.text = text if text is not None else str(value)
 
-    def __repr__(self):
-        return self.as_string(0)
-
-    def as_string(self, depth=0):
-        name = self.token.value
-        return '\t'*depth + 'CONST(%s)\n' % (name)
+    def string_parts(self, depth):
+        name = self.text
+        return ['\t'*depth + 'CONST(%s)\n' % (name)]
 
-    def as_line(self):
-        return str(self.token.value)
+    def line_parts(self):
+        return [self.text]
 
 
 class If(AST):
+    __slots__ = ('cond', 'body', 'else_body')
 
     def __init__(self, cond, body, else_body):
-        '''
+        """
         Args:
             cond (AST): ast of logical condition
             body (list of ASTs): asts of body statements
             else_body (AST): ast of else part
-        '''
-        AST.__init__(self, Token('IF', 'if'))
+        """
         self.cond = cond
         self.body = body
 
@@ -146,135 +243,109 @@ class If(AST):
 
         self.else_body = else_body
 
-    def __repr__(self):
-        return self.as_string(0)
-
-    def as_string(self, depth=0):
+    def string_parts(self, depth):
         name = 'IF'
         tab = '\t' * depth
 
-        body_string = tab + name + '\n' + tab + '(\n' + self.cond.as_string(depth + 1) + tab + '\t,\n'
-
-        for stmt in self.body:
-            body_string += stmt.as_string(depth + 1)
+        parts = [tab + name + '\n' + tab + '(\n', (self.cond, depth + 1), tab + '\t,\n']
+        parts.extend((stmt, depth + 1) for stmt in self.body)
 
         if len(self.else_body) > 0:
-            body_string += tab + '\t,\n'
+            parts.append(tab + '\t,\n')
 
-        for stmt in self.else_body:
-            body_string += stmt.as_string(depth + 1)
-
-        return body_string + tab + ')\n'
+        parts.extend((stmt, depth + 1) for stmt in self.else_body)
+        parts.append(tab + ')\n')
+        return parts
 
 
 class While(AST):
+    __slots__ = ('cond', 'body')
 
     def __init__(self, cond, body):
-        '''
+        """
         Args:
             cond (AST): ast of logical condition
             body (list of ASTs): asts of body statements
-        '''
-        AST.__init__(self, Token('WHILE', 'while'))
+        """
         self.cond = cond
         self.body = body
 
-    def __repr__(self):
-        return self.as_string(0)
-
-    def as_string(self, depth=0):
+    def string_parts(self, depth):
         name = 'WHILE'
         tab = '\t' * depth
 
-        body_string = tab + name + '\n' + tab + '(\n' + self.cond.as_string(depth + 1) + tab + '\t,\n'
-
-        for stmt in self.body:
-            body_string += stmt.as_string(depth + 1)
-
-        return body_string + tab + ')\n'
+        parts = [tab + name + '\n' + tab + '(\n', (self.cond, depth + 1), tab + '\t,\n']
+        parts.extend((stmt, depth + 1) for stmt in self.body)
+        parts.append(tab + ')\n')
+        return parts
 
 
 class Function(AST):
+    __slots__ = ('name', 'params', 'ret_type', 'body', 'has_def', 'span')
 
     def __init__(self, ret_type, name, params, body):
-        AST.__init__(self, Token('FUNC', name))
         self.name = name
         self.params = params
         self.ret_type = ret_type
         self.body = body
         self.has_def = True
+        # lexpos of the first and last token of the definition
+        self.span = None
 
         if self.body is None:
             self.body = []
             self.has_def = False
 
-    def __repr__(self):
-        return self.as_string(0)
-
-    def as_string(self, depth=0):
+    def string_parts(self, depth):
         if not self.has_def:
-            return ''
+            return []
 
         signature = 'FUNCTION ' + str(self.name)
         if self.name == 'main':
             signature = '\n\nFunction Main'
 
-        signature += '\nPARAMS ('
-
-        if len(self.params) > 0:
-            for i in range(len(self.params) - 1):
-                signature += str(self.params[i]) + ', '
-            signature += str(self.params[len(self.params) - 1])
-
+        signature += '\nPARAMS (' + ', '.join(str(param) for param in self.params)
         signature += ')\nRETURNS ' + '*'*self.ret_type[1] + self.ret_type[0]
 
         tab = '\t' * depth
 
-        body_string = tab + signature + '\n'
-        for stmt in self.body:
-            body_string += stmt.as_string(depth + 1)
-
-        return body_string + '\n'
+        parts = [tab + signature + '\n']
+        parts.extend((stmt, depth + 1) for stmt in self.body)
+        parts.append('\n')
+        return parts
 
 
 class Param(AST):
+    __slots__ = ('dtype', 'id', 'pointer_level')
 
     def __init__(self, _id, dtype, pointer_level=0):
-        AST.__init__(self, Token('PARAM', dtype))
         self.dtype = dtype
         self.id = _id
         self.pointer_level = pointer_level
 
-    def __repr__(self):
-        return self.as_string(0)
-
-    def as_string(self, depth=0):
+    def string_parts(self, depth):
         tab = '\t' * depth
-        return tab + self.dtype + ' ' + '*'*self.pointer_level + (self.id if self.id is not None else '')
+        return [tab + self.dtype + ' ' + '*'*self.pointer_level + (self.id if self.id is not None else '')]
 
 
 class Block(AST):
+    __slots__ = ('asts', )
 
     def __init__(self, ast_list):
-        AST.__init__(self, Token('BLOCK', 'block'))
         self.asts = ast_list
 
-    def __repr__(self):
-        return self.as_string(0)
-
-    def as_string(self, depth=0):
+    def string_parts(self, depth):
         name = 'BLOCK'
         tab = '\t' * depth
 
-        body_string = tab + name + '\n' + tab + '(\n'
-
-        for ast in self.asts:
-            body_string += ast.as_string(depth + 1)
-
-        return body_string + tab + ')\n'
+        parts = [tab + name + '\n' + tab + '(\n']
+        parts.extend((ast, depth + 1) for ast in self.asts)
+        parts.append(tab + ')\n')
+        return parts
 
 
 class FunctionCall(AST):
+    __slots__ = ('id', 'actual_params', 'dtype')
 
     def __init__(self, _id, actual_params):
         """
@@ -282,66 +353,42 @@ class FunctionCall(AST):
             _id (str)
             actual_params (list of asts)
         """
-        AST.__init__(self, Token('FUNC_CALL', _id))
         self.id = _id
         self.actual_params = actual_params
         self.dtype = None
 
-    def __repr__(self):
-        return self.as_string(0)
-
-    def as_string(self, depth=0):
+    def string_parts(self, depth):
         tab = '\t' * depth
-        body_string = tab + 'CALL ' + self.id + '(\n'
-        for i, p in enumerate(self.actual_params):
-            body_string += p.as_string(depth + 1)
-            if i != len(self.actual_params) - 1:
-                body_string += tab + '\t,\n'
+        parts = [tab + 'CALL ' + self.id + '(\n']
+        parts.extend(join_parts([(p, depth + 1) for p in self.actual_params], tab + '\t,\n'))
+        parts.append(tab + ')\n')
+        return parts
 
-        body_string += tab + ')\n'
-        return body_string
-
-    def as_line(self):
-        line_string = self.id + '('
-        n = len(self.actual_params)
-        if n > 0:
-            for p in self.actual_params[:-1]:
-                line_string += p.as_line() + ', '
-            line_string += self.actual_params[n - 1].as_line()
-        line_string += ')'
-        return line_string
+    def line_parts(self):
+        return [self.id + '('] + join_parts(self.actual_params, ', ') + [')']
 
 
 class ReturnStmt(AST):
+    __slots__ = ('expression', )
 
     def __init__(self, expression):
-        '''
+        """
         Args:
             expression (AST) - ast of return expression
-        '''
-        AST.__init__(self, Token('RETURN', ''))
+        """
         self.expression = expression
 
-    def __repr__(self):
-        return self.as_string(0)
-
-    def as_string(self, depth=0):
-        # tab = '\t' * depth
-        body_string = 'RETURN\n(\n'
+    def string_parts(self, depth):
+        parts = ['RETURN\n(\n']
         if self.expression is not None:
-            body_string += self.expression.as_string(depth)
-        return body_string + ')\n'
+            parts.append((self.expression, depth))
+        parts.append(')\n')
+        return parts
 
-    def as_line(self):
-        return 'return ' + self.expression.as_line() + '\n'
+    def line_parts(self):
+        return ['return ', self.expression, '\n']
 
 
 if __name__ == '__main__':
-    t1 = Token('PLUS', '+')
-    t2 = Token('VAR', 'a')
-    t3 = Token('VAR', 'b')
-    t4 = Token('DEREF', '*')
-    t5 = Token('CONST', '5')
-
-    tree = BinOp(UnaryOp(BinOp(Var(t2), Var(t3), t1), t4), Const(t5), t1)
-    print(tree)
\ No newline at end of file
+    tree = BinOp(UnaryOp(BinOp(Var('a'), Var('b'), PLUS), DEREF), Const(5), PLUS)
+    print(tree)
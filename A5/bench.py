@@ -0,0 +1,352 @@
+'''
+Benchmarks for the compiler phases.
+
+usage: python3 bench.py <benchmark> [args...]
+'''
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+from lexer import APLLexer
+
+
+FUNCTION_TEMPLATE = '''
+int *f%(n)d(int *a, float *x) {
+    int i, *p;
+    float y, *q;
+    p = &i;
+    q = &y;
+    *p = *a * 3 + 42;
+    *q = *x / 2.5 - 0.125;
+    while (*p > 0 && !(*p == 7)) {
+        *p = *p - 1;
+        if (*q >= 1.0) {
+            *q = -*q;
+        } else
+            *q = *q + 1.0;
+    }
+    return p;
+}
+'''
+
+
+def generate_source(num_funcs):
+    '''valid program with `num_funcs` copies of FUNCTION_TEMPLATE'''
+    parts = [FUNCTION_TEMPLATE % {'n': n} for n in range(num_funcs)]
+    parts.append('void main() {\n    return;\n}\n')
+    return ''.join(parts)
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def bench_lexer(size_mb='4'):
+    '''tokens/second of the ply and dfa lexer backends'''
+    source = generate_source(1)
+    source = source * int(float(size_mb) * 2**20 / len(source) + 1)
+    print('source: %.1f MB' % (len(source) / 2**20))
+
+    for backend in ('ply', 'dfa'):
+        lexer = APLLexer(backend)
+
+        def run():
+            lexer.input(source)
+            count = 0
+            while lexer.token() is not None:
+                count += 1
+            return count
+
+        count, elapsed = timed(run)
+        print('%-4s %9d tokens  %6.2f s  %10.0f tokens/s' %
+              (backend, count, elapsed, count / elapsed))
+
+
+class ParseOnlyMixin(object):
+    def p_code(self, p):
+        'code : global_statement_list'
+        p[0] = p[1]
+
+
+def parse_with_symtable(source):
+    '''AST list and global symbol table of `source`, without running the later phases'''
+    from Parser import APLParser
+
+    class ParseOnly(ParseOnlyMixin, APLParser):
+        pass
+
+    parser = ParseOnly(os.devnull, os.devnull, os.devnull, os.devnull)
+    asts = parser.parse(source)
+    parser.close()
+    return asts, parser.tableptr.items[0]
+
+
+def parse_only(source):
+    '''AST list of `source`, without running the later phases'''
+    return parse_with_symtable(source)[0]
+
+
+def count_nodes(asts):
+    from ast import AST
+
+    count = 0
+    stack = list(asts)
+    while stack:
+        node = stack.pop()
+        count += 1
+        if hasattr(node, '__dict__'):
+            fields = list(vars(node))
+        else:
+            fields = [x for c in type(node).__mro__ for x in getattr(c, '__slots__', ())]
+        for name in fields:
+            value = getattr(node, name, None)
+            if isinstance(value, AST):
+                stack.append(value)
+            elif isinstance(value, list):
+                stack.extend(x for x in value if isinstance(x, AST))
+    return count
+
+
+def bench_lists(max_n='32000'):
+    '''
+    parse time of long statement, global, parameter and argument lists;
+    time per element stays flat when list building is linear
+    '''
+    def statements(n):
+        return ('void main() {\n    int i, *p;\n    p = &i;\n' +
+                '    *p = *p + 1;\n' * n + '    return;\n}\n')
+
+    def globals_(n):
+        names = ['g%d' % i for i in range(n)]
+        return ('int %s;\n' % (', '.join('*' + x for x in names)) +
+                ''.join('float *h%d;\n' % i for i in range(n)) +
+                'void main() {\n    return;\n}\n')
+
+    def params(n):
+        names = ['a%d' % i for i in range(n)]
+        return ('void f(%s) {\n    return;\n}\n' % (', '.join('int *' + x for x in names)) +
+                'void main() {\n    int *p;\n    f(%s);\n    return;\n}\n' % (', '.join(['p'] * n)))
+
+    n = 1000
+    while n <= int(max_n):
+        row = []
+        for make in (statements, globals_, params):
+            source = make(n)
+            _, elapsed = timed(parse_only, source)
+            row.append('%8.2f us' % (elapsed / n * 1e6))
+        print('n = %6d  per element: statements %s  globals %s  params %s' % tuple([n] + row))
+        n *= 2
+
+
+def bench_astmem(num_funcs='2000'):
+    '''bytes of AST per node, measured with tracemalloc'''
+    source = generate_source(int(num_funcs))
+    parse_only(generate_source(1))
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    asts = parse_only(source)
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    nodes = count_nodes(asts)
+    print('%d AST nodes, %.1f MB, %.1f bytes/node' %
+          (nodes, (after - before) / 2**20, (after - before) / nodes))
+
+
+def bench_stream(max_funcs='800'):
+    '''peak memory of a full compile, with and without --stream'''
+    from Parser import APLParser
+
+    num_funcs = 100
+    while num_funcs <= int(max_funcs):
+        source = generate_source(num_funcs)
+        row = []
+        for stream in (False, True):
+            parser = APLParser(stream=stream)
+            parser.reset(os.devnull, os.devnull, os.devnull, os.devnull)
+            gc.collect()
+            tracemalloc.start()
+            _, elapsed = timed(parser.parse, source)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            parser.close()
+            row += [peak / 2**20, elapsed]
+        print('%5d functions  whole file %7.1f MB %6.2f s  stream %7.1f MB %6.2f s' %
+              tuple([num_funcs] + row))
+        num_funcs *= 2
+
+
+def bench_nesting(max_depth='3200'):
+    '''
+    parse time per identifier use at the bottom of deeply nested blocks,
+    and the cost of one lookup through the parent chain vs ScopeStack
+    '''
+    from symtablev2 import mktable, ScopeStack, get_type
+
+    uses = 2000
+    depth = 100
+    while depth <= int(max_depth):
+        source = ('int *g;\nvoid main() {\n' + '{\n' * depth + 'g = g;\n' * (uses // 2) +
+                  '}\n' * depth + 'return;\n}\n')
+        _, elapsed = timed(parse_only, source)
+
+        scopes = ScopeStack()
+        scopes.push(mktable(None, 'global'))
+        scopes.top().enter('g', get_type('int', 1), 4)
+        for i in range(depth):
+            scopes.push(mktable(scopes.top(), '@block_%d' % (i)))
+        innermost = scopes.top()
+
+        _, chain = timed(lambda: [innermost.look_up('g') for _ in range(uses)])
+        _, stack = timed(lambda: [scopes.look_up('g') for _ in range(uses)])
+
+        print('depth %5d  parse %6.2f us/use  lookup: parent chain %8.1f ns  scope stack %5.1f ns' %
+              (depth, elapsed / uses * 1e6, chain / uses * 1e9, stack / uses * 1e9))
+        depth *= 2
+
+
+def bench_cfg(num_funcs='1000'):
+    '''time and memory of building the CFG of `num_funcs` functions'''
+    from cfg import CFG
+
+    source = generate_source(int(num_funcs))
+
+    # CFG adds the implicit returns to the ASTs, so each run gets a fresh parse
+    asts = parse_only(source)
+    gc.collect()
+    cfg, elapsed = timed(CFG, asts)
+
+    asts = parse_only(source)
+    gc.collect()
+    tracemalloc.start()
+    cfg = CFG(asts)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print('%d basic blocks  %.3f s  %.1f us/block  retained %.1f MB  peak %.1f MB' %
+          (cfg.node_count, elapsed, elapsed / cfg.node_count * 1e6, current / 2**20, peak / 2**20))
+
+
+def bench_cleanup(max_depth='1600'):
+    '''
+    time of CFG.clean_up on nested if/while statements with empty bodies,
+    which leave long chains of blank nodes
+    '''
+    from cfg import CFG
+
+    class TimedCFG(CFG):
+        def clean_up(self):
+            blocks = len(self.nodes)
+            _, self.clean_up_time = timed(CFG.clean_up, self)
+            self.blocks_before = blocks
+
+    # create_nodes recurses once per nesting level
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 20 * int(max_depth)))
+
+    depth = 100
+    while depth <= int(max_depth):
+        nest = ''.join('if (*p > %d) {\n' % (i) for i in range(depth))
+        source = ('void main() {\nint i, *p;\np = &i;\n' + nest + '} else {}\n' * depth +
+                  'return;\n}\n')
+        cfg = TimedCFG(parse_only(source))
+        print('depth %5d  %6d -> %5d blocks  clean_up %8.3f s  %6.2f us/block' %
+              (depth, cfg.blocks_before, cfg.node_count, cfg.clean_up_time,
+               cfg.clean_up_time / cfg.blocks_before * 1e6))
+        depth *= 2
+
+
+def bench_dominators(num_funcs='1000'):
+    '''time of the per function graphs, dominator trees and dominance frontiers'''
+    from cfg import CFG
+
+    cfg = CFG(parse_only(generate_source(int(num_funcs))))
+
+    def analyse():
+        for func_cfg in cfg.functions():
+            func_cfg.dominance_frontiers()
+            func_cfg.dominates(0, len(func_cfg.nodes) - 1)
+
+    _, elapsed = timed(analyse)
+    _, cached = timed(analyse)
+    print('%d functions, %d basic blocks  %.3f s  %.1f us/block  cached %.4f s' %
+          (len(cfg.functions()), cfg.node_count, elapsed, elapsed / cfg.node_count * 1e6, cached))
+
+
+LOOP_TEMPLATE = '''
+    *p = *a * 3 + 42;
+    *q = *x / 2.5 - 0.125;
+    while (*p > 0 && !(*p == 7)) {
+        *p = *p - 1;
+        if (*q >= 1.0) {
+            *q = -*q;
+        } else
+            *q = *q + 1.0;
+    }
+    a = p;
+'''
+
+
+def bench_dataflow(num_copies='1000'):
+    '''time of the dataflow analyses on one large function'''
+    from cfg import CFG
+    from dataflow import Variables, Liveness, ReachingDefinitions, AvailableExpressions,\
+        AvailableCopies
+
+    source = ('int *f(int *a, float *x) {\n    int i, *p;\n    float y, *q;\n    p = &i;\n    q = &y;\n' +
+              LOOP_TEMPLATE * int(num_copies) + '    return p;\n}\n' +
+              'void main() {\n    return;\n}\n')
+    asts, symtable = parse_with_symtable(source)
+    func_cfg = CFG(asts, split_calls=True).functions()[0]
+    print('%d basic blocks' % (len(func_cfg.nodes)))
+
+    variables, elapsed = timed(Variables, func_cfg, symtable)
+    print('%-22s %7.3f s' % ('variables', elapsed))
+    for analysis in (Liveness, ReachingDefinitions, AvailableExpressions, AvailableCopies):
+        _, elapsed = timed(analysis, func_cfg, variables)
+        print('%-22s %7.3f s' % (analysis.__name__, elapsed))
+
+
+def bench_optimize(num_copies='1000'):
+    '''time of the -O passes on one large function, with what they changed'''
+    from cfg import CFG
+    from optimize import optimize, format_stats
+
+    source = ('int *f(int *a, float *x) {\n    int i, *p;\n    float y, *q;\n    p = &i;\n    q = &y;\n' +
+              LOOP_TEMPLATE * int(num_copies) + '    return p;\n}\n' +
+              'void main() {\n    return;\n}\n')
+    asts, symtable = parse_with_symtable(source)
+    cfg = CFG(asts, split_calls=True)
+    blocks = cfg.node_count
+
+    stats, elapsed = timed(optimize, cfg, symtable)
+    print('%d -> %d basic blocks  %.3f s' % (blocks, cfg.node_count, elapsed))
+    print(format_stats(stats))
+
+
+BENCHMARKS = {
+    'lexer': bench_lexer,
+    'lists': bench_lists,
+    'astmem': bench_astmem,
+    'stream': bench_stream,
+    'nesting': bench_nesting,
+    'cfg': bench_cfg,
+    'cleanup': bench_cleanup,
+    'dominators': bench_dominators,
+    'dataflow': bench_dataflow,
+    'optimize': bench_optimize,
+}
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print('usage: python3 bench.py {%s} [args...]' % (','.join(BENCHMARKS)))
+        sys.exit(-1)
+
+    BENCHMARKS[sys.argv[1]](*sys.argv[2:])
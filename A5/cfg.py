@@ -1,13 +1,16 @@
-from ast import Token, BinOp, UnaryOp, Var,\
-    If, While, Function, ReturnStmt, FunctionCall
-from copy import deepcopy
+from ast import BinOp, UnaryOp, Var, Const, ASGN,\
+    If, While, Function, ReturnStmt, FunctionCall, line_string
+from io import StringIO
 
 
 class CFGNode(object):
 
-    def __init__(self, _id, body, temp_start, logical=False, end=False, func=None, is_return=False):
+    def __init__(self, _id, body, temp_start, logical=False, end=False, func=None, is_return=False,
+                 temp_prefix='t', split_calls=False):
+        # the ASTs are shared with the parser and never modified here:
+        # split_expr builds new nodes for anything it changes
         self.id = _id
-        self.body = deepcopy(body)
+        self.body = body
         self.logical = logical
         self.end = end
         self.is_return = is_return
@@ -21,117 +24,171 @@ class CFGNode(object):
 
         self.temp_start = temp_start
         self.temp_count = 0
+        self.temp_prefix = temp_prefix
+        # a call inside an expression gets its own temporary, computed where
+        # the call is made, and so does the operand before it, so that code
+        # generated from temp_body reads the operands before the call and
+        # makes it before the operands after it, as the code of old_body does
+        self.split_calls = split_calls
         self.temp_body = []
+        # set by the passes of optimize.py: body, cond and return_id are
+        # then the code of the block, old_body no longer is
+        self.optimized = False
 
         self.process_body()
         self.body = self.temp_body
-        self.old_body = deepcopy(body)
-
-        self.parents = []
+        self.old_body = body
 
     def process_body(self):
         for ast in self.body:
             if self.is_return:
                 self.return_id = self.split_expr(ast)
+            elif self.logical:
+                # the temporary holding the condition
+                self.cond = self.split_expr(ast)
             else:
                 if isinstance(ast, FunctionCall):
                     self.temp_body.append(self.split_expr(ast))
                 else:
                     self.split_expr(ast)
 
-    def split_expr(self, expr_ast):
-
+    def new_temp(self, dtype):
+        temp_var = Var(self.temp_prefix + str(self.temp_count + self.temp_start))
+        temp_var.dtype = dtype
+        self.temp_count += 1
+        return temp_var
+
+    def makes_call(self, start):
+        '''whether the code appended to temp_body from index `start` on makes a call'''
+        return any(isinstance(stmt, BinOp) and isinstance(stmt.right_child, FunctionCall)
+                   for stmt in self.temp_body[start:])
+
+    def split_expr(self, expr_ast, operand=False):
+        '''
+        append the three address code of `expr_ast` to temp_body, returns the
+        Var/Const/UnaryOp holding its value. the new nodes keep the types
+        the parser gave the expression. `operand` tells whether it is an
+        operand of another expression, rather than a statement or a
+        condition or value of its own.
+        '''
         if isinstance(expr_ast, BinOp):
-            tl = self.split_expr(expr_ast.left_child)
-            tr = self.split_expr(expr_ast.right_child)
-
-            if expr_ast.token.type == 'ASGN':
-                self.temp_body.append(BinOp(tl, tr, expr_ast.token))
+            tl = self.split_expr(expr_ast.left_child, expr_ast.op != 'ASGN')
+            start = len(self.temp_body)
+            tr = self.split_expr(expr_ast.right_child, expr_ast.op != 'ASGN')
+
+            if self.split_calls and expr_ast.op != 'ASGN' and self.makes_call(start) and\
+               not isinstance(tl, Const) and not (isinstance(tl, Var) and tl.entry is None):
+                # the call may change what the left operand reads
+                temp_var = self.new_temp(tl.dtype)
+                self.temp_body.insert(start, BinOp(temp_var, tl, ASGN))
+                tl = temp_var
+
+            if expr_ast.op == 'ASGN':
+                asgn = BinOp(tl, tr, expr_ast.op)
+                asgn.dtype = expr_ast.dtype
+                self.temp_body.append(asgn)
                 return None
 
-            temp_var = Var('t' + str(self.temp_count + self.temp_start))
-            self.temp_count += 1
-            self.temp_body.append(BinOp(temp_var, BinOp(tl, tr, expr_ast.token), Token('ASGN', '=')))
+            temp_var = self.new_temp(expr_ast.dtype)
+            value = BinOp(tl, tr, expr_ast.op)
+            value.dtype = expr_ast.dtype
+            self.temp_body.append(BinOp(temp_var, value, ASGN))
             return temp_var
 
         elif isinstance(expr_ast, UnaryOp):
-            if expr_ast.token.type in ('NOT', 'UMINUS'):
-                t = self.split_expr(expr_ast.child)
-                temp_var = Var('t' + str(self.temp_count + self.temp_start))
-                self.temp_count += 1
-                self.temp_body.append(BinOp(temp_var, UnaryOp(t, expr_ast.token), Token('ASGN', '=')))
+            if expr_ast.op in ('NOT', 'UMINUS'):
+                t = self.split_expr(expr_ast.child, True)
+                temp_var = self.new_temp(expr_ast.dtype)
+                value = UnaryOp(t, expr_ast.op)
+                value.dtype = expr_ast.dtype
+                self.temp_body.append(BinOp(temp_var, value, ASGN))
                 return temp_var
             else:
-                t = self.split_expr(expr_ast.child)
-                return UnaryOp(t, expr_ast.token)
+                t = self.split_expr(expr_ast.child, True)
+                value = UnaryOp(t, expr_ast.op)
+                value.dtype = expr_ast.dtype
+                return value
 
         elif isinstance(expr_ast, FunctionCall):
-            t_params = [self.split_expr(x) for x in expr_ast.actual_params]
+            t_params = [self.split_expr(x, True) for x in expr_ast.actual_params]
 
-            # temp_var = Var('t' + str(self.temp_count + self.temp_start))
-            # self.temp_count += 1
-            # self.temp_body.append(BinOp(temp_var, FunctionCall(expr_ast.id, t_params), Token('ASGN', '=')))
-            # return temp_var
-
-            return FunctionCall(expr_ast.id, t_params)
+            call = FunctionCall(expr_ast.id, t_params)
+            call.dtype = expr_ast.dtype
+            if operand and self.split_calls:
+                temp_var = self.new_temp(expr_ast.dtype)
+                self.temp_body.append(BinOp(temp_var, call, ASGN))
+                return temp_var
+            return call
 
         else:
             return expr_ast
 
     def __repr__(self):
-        string = ''
+        out = StringIO()
+        self.write(out)
+        return out.getvalue()
 
+    def write(self, file):
+        '''write the text of this basic block to `file`'''
         if self.func is not None:
-            string += 'function ' + self.func.name + '('
-            if len(self.func.params) > 0:
-                for i in range(len(self.func.params) - 1):
-                    string += str(self.func.params[i]) + ', '
-                string += str(self.func.params[len(self.func.params) - 1])
-            string += ')\n'
+            params = ', '.join(str(param) for param in self.func.params)
+            file.write('function ' + self.func.name + '(' + params + ')\n')
 
-        string += '<bb ' + str(self.id) + '>\n'
+        file.write('<bb ' + str(self.id) + '>\n')
 
         if self.end:
-            string += 'End'
-            return string
+            file.write('End')
+            return
 
-        for ast in self.body:
-            string += ast.as_line() + '\n'
+        file.write(''.join(line_string(ast) + '\n' for ast in self.body))
 
         if self.is_return:
-            string += 'return'
+            line = 'return'
             if self.return_id is not None:
-                string += ' ' + self.return_id.as_line()
-            return string + '\n'
+                line += ' ' + line_string(self.return_id)
+            file.write(line + '\n')
+            return
 
         if self.logical and self.goto_t and self.goto_f:
-            string += 'if(t' + str(self.temp_start + self.temp_count - 1) + ') goto <bb ' + str(self.goto_t) + '>\n'
-            string += 'else goto <bb ' + str(self.goto_f) + '>\n'
+            file.write('if(' + line_string(self.cond) + ') goto <bb ' + str(self.goto_t) + '>\n')
+            file.write('else goto <bb ' + str(self.goto_f) + '>\n')
         elif self.goto:
-            string += 'goto <bb ' + str(self.goto) + '>\n'
-
-        return string
+            file.write('goto <bb ' + str(self.goto) + '>\n')
 
 
 class CFG(object):
 
-    def __init__(self, asts):
+    def __init__(self, asts, temp_prefix='t', node_start=0, temp_start=0, split_calls=False):
         """
         Args:
             asts (list of AST objs):
+            temp_prefix (str): prefix of temporary variable names
+            node_start (int), temp_start (int): first basic block id and
+                temporary number, for lowering a file one function at a time
+            split_calls (bool): compute the calls inside expressions into
+                temporaries (see CFGNode), for the passes of optimize.py
         """
         self.asts = asts
         self.node_count = 0
         self.nodes = []
-        self.temp_count = 0
+        self.temp_start = temp_start
+        self.temp_count = temp_start
+        self.temp_prefix = temp_prefix
+        self.split_calls = split_calls
 
         self.create_nodes(self.asts)
-        end_node = CFGNode(self.node_count, [], self.temp_count, end=True)
+        end_node = CFGNode(self.node_count, [], self.temp_count, end=True, temp_prefix=temp_prefix)
         self.nodes.append(end_node)
         self.node_count += 1
 
         self.clean_up()
 
+        if node_start:
+            self.shift_ids(node_start)
+
+        # FunctionCFG views of self.nodes, built by functions()
+        self._functions = None
+
     def addNode(self, node):
         self.node_count += 1
         self.temp_count += node.temp_count
@@ -144,11 +201,13 @@ class CFG(object):
 
         while (i < n):
             j = i
-            while j < n and (ast_list[j].token.type == 'ASGN' or isinstance(ast_list[j], FunctionCall)):
+            while j < n and ((isinstance(ast_list[j], BinOp) and ast_list[j].op == 'ASGN') or
+                             isinstance(ast_list[j], FunctionCall)):
                 j += 1
 
             if i != j:
-                node = CFGNode(self.node_count, list(ast_list[i:j]), self.temp_count, func=func)
+                node = CFGNode(self.node_count, list(ast_list[i:j]), self.temp_count, func=func,
+                               temp_prefix=self.temp_prefix, split_calls=self.split_calls)
                 self.addNode(node)
                 node.goto = self.node_count
                 func = None
@@ -166,16 +225,17 @@ class CFG(object):
                     self.create_function_node(ast_list[j])
                     func = None
                 elif isinstance(ast_list[j], ReturnStmt):
-                    node = CFGNode(self.node_count, [ast_list[j].expression], self.temp_count, func=func, is_return=True)
-                    self.nodes.append(node)
-                    self.node_count += 1
+                    node = CFGNode(self.node_count, [ast_list[j].expression], self.temp_count, func=func,
+                                   is_return=True, temp_prefix=self.temp_prefix,
+                                   split_calls=self.split_calls)
+                    self.addNode(node)
                     func = None
                 j += 1
 
             i = j
 
         # create a blank CFG node
-        node = CFGNode(self.node_count, [], self.temp_count)
+        node = CFGNode(self.node_count, [], self.temp_count, temp_prefix=self.temp_prefix)
         self.addNode(node)
         node.goto = self.node_count
 
@@ -183,7 +243,8 @@ class CFG(object):
 
         assert isinstance(ast, If)
 
-        cond_node = CFGNode(self.node_count, [ast.cond], self.temp_count, logical=True, func=func)
+        cond_node = CFGNode(self.node_count, [ast.cond], self.temp_count, logical=True, func=func,
+                            temp_prefix=self.temp_prefix, split_calls=self.split_calls)
         self.addNode(cond_node)
 
         cond_node.goto_t = self.node_count
@@ -204,7 +265,8 @@ class CFG(object):
 
         assert isinstance(ast, While)
 
-        cond_node = CFGNode(self.node_count, [ast.cond], self.temp_count, logical=True, func=func)
+        cond_node = CFGNode(self.node_count, [ast.cond], self.temp_count, logical=True, func=func,
+                            temp_prefix=self.temp_prefix, split_calls=self.split_calls)
         self.addNode(cond_node)
 
         cond_node.goto_t = self.node_count
@@ -230,60 +292,405 @@ class CFG(object):
         self.create_nodes(ast.body, func=ast)
 
     def clean_up(self):
-        '''removes blank nodes'''
-        for node in self.nodes:
-            if node.logical:
-                if node.goto_t is not None:
-                    self.nodes[node.goto_t].parents.append((node.id, 1))
-                if node.goto_f is not None:
-                    self.nodes[node.goto_f].parents.append((node.id, 2))
+        '''
+        removes blank nodes: jumps to a blank node are redirected to the
+        first non blank node its gotos lead to, resolving each chain of
+        blank nodes once (with path compression), and the remaining nodes
+        are renumbered in order
+        '''
+        nodes = self.nodes
+
+        # target[i]: index of the first non blank node reached from node i,
+        # -1 while not known yet
+        target = []
+        new_ids = []
+        num_proper_nodes = 0
+        for i, node in enumerate(nodes):
+            if node.body or node.logical or node.end or node.is_return:
+                target.append(i)
+                new_ids.append(num_proper_nodes)
+                num_proper_nodes += 1
             else:
-                if node.goto is not None:
-                    self.nodes[node.goto].parents.append((node.id, 0))
+                target.append(-1)
+                new_ids.append(None)
 
-        num_proper_nodes = 0
+        def resolve(goto):
+            if goto is None:
+                return None
 
-        # find empty nodes, redirect parents
-        for node in self.nodes:
-            if not node.body and not node.end and not node.is_return:
-                for p in node.parents:
-                    if p[1] == 0:
-                        self.nodes[p[0]].goto = node.goto
-                    elif p[1] == 1:
-                        self.nodes[p[0]].goto_t = node.goto
-                    elif p[1] == 2:
-                        self.nodes[p[0]].goto_f = node.goto
-
-                if node.goto is not None:
-                    self.nodes[node.goto].parents += node.parents
+            path = []
+            i = goto
+            while i is not None and target[i] == -1:
+                path.append(i)
+                i = nodes[i].goto
+
+            if i is not None:
+                i = target[i]
+            for j in path:
+                target[j] = i
+
+            return new_ids[i] if i is not None else None
+
+        # remove blank nodes, update ids and gotos
+        self.nodes = []
+        for i, node in enumerate(nodes):
+            if new_ids[i] is None:
+                continue
+
+            node.id = new_ids[i]
+            if node.logical:
+                node.goto_t = resolve(node.goto_t)
+                node.goto_f = resolve(node.goto_f)
             else:
-                num_proper_nodes += 1
+                node.goto = resolve(node.goto)
+            self.nodes.append(node)
 
-        # rename node ids, update gotos
-        for index, node in enumerate(self.nodes[::-1]):
-            if node.body or node.end or node.is_return:
-                node.id = num_proper_nodes - 1
-                num_proper_nodes -= 1
-
-                for p in node.parents:
-                    if p[1] == 0:
-                        self.nodes[p[0]].goto = node.id
-                    elif p[1] == 1:
-                        self.nodes[p[0]].goto_t = node.id
-                    elif p[1] == 2:
-                        self.nodes[p[0]].goto_f = node.id
-
-        # remove blank nodes
-        self.nodes = [x for x in self.nodes if x.body or x.end or x.is_return]
         self.nodes.pop()
         self.node_count = len(self.nodes)
 
+    def shift_ids(self, offset):
+        '''add `offset` to every basic block id and goto'''
+        for node in self.nodes:
+            node.id += offset
+            if node.logical:
+                if node.goto_t is not None:
+                    node.goto_t += offset
+                if node.goto_f is not None:
+                    node.goto_f += offset
+            elif node.goto is not None:
+                node.goto += offset
+
+    def functions(self):
+        '''a FunctionCFG for every function, in order'''
+        if self._functions is None:
+            self._functions = []
+            start = 0
+            for i in range(1, self.node_count + 1):
+                if i == self.node_count or self.nodes[i].func is not None:
+                    self._functions.append(FunctionCFG(self.nodes[start:i]))
+                    start = i
+        return self._functions
+
+    def invalidate(self):
+        '''drop the cached analyses, after nodes or gotos were changed'''
+        self._functions = None
+
+    def renumber(self):
+        '''
+        rebuild nodes from functions() after passes removed blocks from
+        them, numbering the blocks consecutively again from the first id
+        '''
+        if not self.nodes:
+            return
+        next_id = self.nodes[0].id
+        self.nodes = []
+        for func_cfg in self.functions():
+            func_cfg.shift(next_id - func_cfg.base)
+            next_id += len(func_cfg.nodes)
+            self.nodes.extend(func_cfg.nodes)
+        self.node_count = len(self.nodes)
 
     def __repr__(self):
+        out = StringIO()
+        self.write(out)
+        return out.getvalue()
 
-        string = ''
-
+    def write(self, file):
+        '''write the .cfg text to `file` one basic block at a time'''
         for node in self.nodes:
-            string += '\n' + str(node)
-
-        return string
+            file.write('\n')
+            node.write(file)
+
+
+class FunctionCFG(object):
+    '''
+    the basic blocks of one function, nodes[0] being its entry. blocks are
+    referred to by their index in nodes; jumps out of the function (there
+    are none after clean_up, bar the gotos of a trailing return) have no
+    successor.
+    the graph and the analyses below are computed on first use and cached
+    until invalidate() is called.
+    '''
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+        self.func = nodes[0].func
+        # id of nodes[0], ids are consecutive
+        self.base = nodes[0].id
+        self.temp_count = 0
+        self.invalidate()
+
+    def invalidate(self):
+        '''drop the cached graph and analyses, after a node or goto changed'''
+        self._succs = None
+        self._preds = None
+        self._rpo = None
+        self._idom = None
+        self._dom_tree = None
+        self._dom_order = None
+        self._frontiers = None
+        self._loops = None
+
+    def index(self, node_id):
+        '''index of the node with id `node_id`, None if not in this function'''
+        if node_id is None:
+            return None
+        i = node_id - self.base
+        return i if 0 <= i < len(self.nodes) else None
+
+    def new_temp(self, dtype):
+        '''
+        a temporary for code a pass adds, named apart from the ones of
+        split_expr until renumber_temps() numbers them all
+        '''
+        temp_var = Var('%sn%d' % (self.nodes[0].temp_prefix, self.temp_count))
+        temp_var.dtype = dtype
+        self.temp_count += 1
+        return temp_var
+
+    def shift(self, offset):
+        '''add `offset` to the ids of the blocks and to the gotos between them'''
+        if offset == 0:
+            return
+        for node in self.nodes:
+            node.id += offset
+            if node.logical:
+                if self.index(node.goto_t) is not None:
+                    node.goto_t += offset
+                if self.index(node.goto_f) is not None:
+                    node.goto_f += offset
+            elif self.index(node.goto) is not None:
+                node.goto += offset
+        self.base += offset
+
+    def remove_nodes(self, keep):
+        '''
+        drop every block i with keep[i] false, none of the kept blocks
+        jumping to it, and number the others consecutively from base
+        '''
+        self.set_nodes([node for i, node in enumerate(self.nodes) if keep[i]])
+
+    def insert_blocks(self, blocks):
+        '''
+        add blocks of three address code, each given as (i, body, preds):
+        `body` jumping to block i, placed right before it, that the blocks
+        of the indices in `preds` jump to instead of to block i
+        '''
+        before = [[] for _ in self.nodes]
+        jumping = []
+        for i, body, preds in blocks:
+            assert i > 0, 'the entry of a function stays first'
+            node = CFGNode(None, [], 0, temp_prefix=self.nodes[0].temp_prefix)
+            node.body = body
+            node.goto = self.nodes[i].id
+            node.optimized = self.nodes[i].optimized
+            before[i].append(node)
+            jumping.append((node, [self.nodes[p] for p in preds]))
+
+        nodes = []
+        for new, node in zip(before, self.nodes):
+            nodes.extend(new)
+            nodes.append(node)
+        self.set_nodes(nodes)
+
+        for node, preds in jumping:
+            for pred in preds:
+                if pred.logical:
+                    if pred.goto_t == node.goto:
+                        pred.goto_t = node.id
+                    if pred.goto_f == node.goto:
+                        pred.goto_f = node.id
+                else:
+                    pred.goto = node.id
+
+    def set_nodes(self, nodes):
+        '''
+        make `nodes` the blocks of the function, numbered consecutively
+        from base, the jumps between them following them (new blocks have
+        id None, their gotos being the ids the blocks had before)
+        '''
+        new_ids = {}
+        for k, node in enumerate(nodes):
+            if node.id is not None:
+                new_ids[node.id] = self.base + k
+
+        for k, node in enumerate(nodes):
+            node.id = self.base + k
+            if node.logical:
+                node.goto_t = new_ids.get(node.goto_t, node.goto_t)
+                node.goto_f = new_ids.get(node.goto_f, node.goto_f)
+            else:
+                node.goto = new_ids.get(node.goto, node.goto)
+
+        self.nodes = nodes
+        self.invalidate()
+
+    def successors(self):
+        '''
+        successors[i]: indices of the blocks block i jumps to, the true
+        branch first for conditions
+        '''
+        if self._succs is None:
+            self._succs = []
+            for node in self.nodes:
+                if node.is_return:
+                    gotos = ()
+                elif node.logical:
+                    gotos = (node.goto_t, node.goto_f)
+                else:
+                    gotos = (node.goto,)
+                self._succs.append([i for i in map(self.index, gotos) if i is not None])
+        return self._succs
+
+    def predecessors(self):
+        '''predecessors[i]: indices of the blocks jumping to block i'''
+        if self._preds is None:
+            self._preds = [[] for _ in self.nodes]
+            for i, succs in enumerate(self.successors()):
+                for j in succs:
+                    self._preds[j].append(i)
+        return self._preds
+
+    def reverse_postorder(self):
+        '''
+        indices of the blocks reachable from the entry, in reverse postorder.
+        successors are searched last to first, which puts the body of a loop
+        (the true branch of its condition) before the code after the loop
+        '''
+        if self._rpo is None:
+            succs = self.successors()
+            visited = [False] * len(self.nodes)
+            postorder = []
+
+            visited[0] = True
+            stack = [(0, reversed(succs[0]))]
+            while stack:
+                i, it = stack[-1]
+                for j in it:
+                    if not visited[j]:
+                        visited[j] = True
+                        stack.append((j, reversed(succs[j])))
+                        break
+                else:
+                    stack.pop()
+                    postorder.append(i)
+
+            postorder.reverse()
+            self._rpo = postorder
+        return self._rpo
+
+    def idom(self):
+        '''
+        idom[i]: index of the immediate dominator of block i; the entry is
+        its own, unreachable blocks have None.
+        Cooper, Harvey and Kennedy, "A Simple, Fast Dominance Algorithm"
+        '''
+        if self._idom is None:
+            rpo = self.reverse_postorder()
+            preds = self.predecessors()
+
+            order = [None] * len(self.nodes)
+            for k, i in enumerate(rpo):
+                order[i] = k
+
+            idom = [None] * len(self.nodes)
+            idom[0] = 0
+
+            def intersect(a, b):
+                while a != b:
+                    while order[a] > order[b]:
+                        a = idom[a]
+                    while order[b] > order[a]:
+                        b = idom[b]
+                return a
+
+            changed = True
+            while changed:
+                changed = False
+                for i in rpo[1:]:
+                    new_idom = None
+                    for p in preds[i]:
+                        if idom[p] is None:
+                            continue
+                        new_idom = p if new_idom is None else intersect(p, new_idom)
+                    if idom[i] != new_idom:
+                        idom[i] = new_idom
+                        changed = True
+
+            self._idom = idom
+        return self._idom
+
+    def dominator_tree(self):
+        '''dominator_tree[i]: indices of the blocks block i immediately dominates'''
+        if self._dom_tree is None:
+            idom = self.idom()
+            self._dom_tree = [[] for _ in self.nodes]
+            for i in self.reverse_postorder()[1:]:
+                self._dom_tree[idom[i]].append(i)
+        return self._dom_tree
+
+    def dominates(self, a, b):
+        '''whether block a dominates block b (every block dominates itself)'''
+        if self._dom_order is None:
+            # preorder number and number of descendants in the dominator tree
+            tree = self.dominator_tree()
+            pre = [None] * len(self.nodes)
+            size = [1] * len(self.nodes)
+            preorder = []
+            stack = [0]
+            while stack:
+                i = stack.pop()
+                pre[i] = len(preorder)
+                preorder.append(i)
+                stack.extend(reversed(tree[i]))
+            for i in reversed(preorder):
+                if i != 0:
+                    size[self._idom[i]] += size[i]
+            self._dom_order = (pre, size)
+
+        pre, size = self._dom_order
+        if pre[a] is None or pre[b] is None:
+            return False
+        return pre[a] <= pre[b] < pre[a] + size[a]
+
+    def dominance_frontiers(self):
+        '''dominance_frontiers[i]: set of the indices in the dominance frontier of block i'''
+        if self._frontiers is None:
+            idom = self.idom()
+            preds = self.predecessors()
+            self._frontiers = [set() for _ in self.nodes]
+            for i in self.reverse_postorder():
+                reachable = [p for p in preds[i] if idom[p] is not None]
+                if len(reachable) < 2:
+                    continue
+                for p in reachable:
+                    runner = p
+                    while runner != idom[i]:
+                        self._frontiers[runner].add(i)
+                        runner = idom[runner]
+        return self._frontiers
+
+    def loops(self):
+        '''
+        the natural loops of the function: (header, set of the indices of
+        the blocks in the loop) for each block a back edge jumps to, the
+        loops of back edges to the same header merged. outer loops come
+        before the loops nested in them
+        '''
+        if self._loops is None:
+            preds = self.predecessors()
+            idom = self.idom()
+            self._loops = []
+            for h in self.reverse_postorder():
+                latches = [p for p in preds[h] if self.dominates(h, p)]
+                if not latches:
+                    continue
+                body = set([h])
+                stack = latches
+                while stack:
+                    i = stack.pop()
+                    if i not in body and idom[i] is not None:
+                        body.add(i)
+                        stack.extend(preds[i])
+                self._loops.append((h, body))
+        return self._loops
@@ -0,0 +1,250 @@
+'''
+Copy propagation and temporary coalescing over the three address code of
+a FunctionCFG.
+
+split_expr gives every operator a fresh temporary, which the statement
+after it often just copies into a variable or stores through a pointer,
+and pointers set to a variable's address are read all through a function.
+propagate_copies() replaces the reads of a copied variable by what it was
+copied from, leaving the copy dead for remove_dead_stores();
+coalesce_temps() computes a temporary read once straight into where it is
+copied; renumber_temps() numbers the temporaries left from 0 in every
+function.
+'''
+from ast import BinOp, UnaryOp, Var, FunctionCall, ASGN
+from dataflow import AvailableCopies, block_statements, var_key, iter_bits, is_copy
+from fold import substitute
+
+
+def substitute_statement(stmt, values):
+    '''`stmt` with the variables it reads replaced by their values in `values`'''
+    if isinstance(stmt, BinOp) and stmt.op == ASGN:
+        lhs = stmt.left_child
+        if not isinstance(lhs, Var):
+            lhs = substitute(lhs, values)
+        rhs = substitute(stmt.right_child, values)
+        if lhs is stmt.left_child and rhs is stmt.right_child:
+            return stmt
+        new = BinOp(lhs, rhs, ASGN)
+        new.dtype = stmt.dtype
+        return new
+    return substitute(stmt, values)
+
+
+def propagate_copies(func_cfg, variables):
+    '''
+    replace the reads of a variable that, on every path, holds a copy of
+    another variable, a constant or an address still valid there.
+    returns the number of statements changed
+    '''
+    copies = AvailableCopies(func_cfg, variables)
+
+    changed = 0
+    for i in func_cfg.reverse_postorder():
+        node = func_cfg.nodes[i]
+
+        # var_key -> value of the copies available, and the bitset of the
+        # variables each depends on
+        values = {}
+        depends = {}
+        for c in iter_bits(copies.block_in[i]):
+            dst, src = copies.copies[c]
+            values[var_key(dst)] = src
+            depends[var_key(dst)] = copies.uses[c]
+
+        statements = block_statements(node)
+        for k, (stmt, (_, defs, clobbers)) in enumerate(zip(statements, variables.effects(i))):
+            if stmt is None:
+                continue
+            if values:
+                new = substitute_statement(stmt, values)
+                if new is not stmt:
+                    statements[k] = stmt = new
+                    changed += 1
+
+                written = defs | clobbers
+                if written:
+                    for key in [key for key, uses in depends.items() if uses & written]:
+                        del values[key], depends[key]
+
+            if is_copy(stmt):
+                dst, src = stmt.left_child, stmt.right_child
+                values[var_key(dst)] = src
+                depends[var_key(dst)] = variables.bit(dst) | variables.reads(src)
+
+        node.body = statements[:len(node.body)]
+        if node.is_return:
+            node.return_id = statements[-1]
+        elif node.logical:
+            node.cond = statements[-1]
+
+    return changed
+
+
+def count_temp_reads(ast, counts):
+    '''add the reads of temporaries in the expression `ast` to counts (var_key -> reads)'''
+    stack = [ast]
+    while stack:
+        ast = stack.pop()
+        if isinstance(ast, Var):
+            if ast.entry is None:
+                key = var_key(ast)
+                counts[key] = counts.get(key, 0) + 1
+        elif isinstance(ast, BinOp):
+            stack.append(ast.left_child)
+            stack.append(ast.right_child)
+        elif isinstance(ast, UnaryOp):
+            stack.append(ast.child)
+        elif isinstance(ast, FunctionCall):
+            stack.extend(ast.actual_params)
+
+
+def temp_counts(func_cfg):
+    '''(assignments, reads) of every temporary of func_cfg, as dicts var_key -> count'''
+    sets = {}
+    reads = {}
+    for node in func_cfg.nodes:
+        for stmt in block_statements(node):
+            if stmt is None:
+                continue
+            if isinstance(stmt, BinOp) and stmt.op == ASGN:
+                lhs = stmt.left_child
+                if isinstance(lhs, Var):
+                    if lhs.entry is None:
+                        sets[var_key(lhs)] = sets.get(var_key(lhs), 0) + 1
+                else:
+                    count_temp_reads(lhs.child, reads)
+                count_temp_reads(stmt.right_child, reads)
+            else:
+                count_temp_reads(stmt, reads)
+    return sets, reads
+
+
+def has_call(ast):
+    stack = [ast]
+    while stack:
+        ast = stack.pop()
+        if isinstance(ast, FunctionCall):
+            return True
+        if isinstance(ast, BinOp):
+            stack.append(ast.left_child)
+            stack.append(ast.right_child)
+        elif isinstance(ast, UnaryOp):
+            stack.append(ast.child)
+    return False
+
+
+def coalesce_temps(func_cfg, variables):
+    '''
+    merge a temporary set once and read once, by being copied later in its
+    block (x = t, *p = t, the condition or the returned value), into the
+    copy: t = a + b; ...; x = t becomes ...; x = a + b, provided nothing in
+    between writes what a + b reads. a value made by a call is only merged
+    into the statement right after it.
+    returns the number of temporaries removed
+    '''
+    sets, reads = temp_counts(func_cfg)
+
+    coalesced = 0
+    for i, node in enumerate(func_cfg.nodes):
+        statements = block_statements(node)
+        last = len(statements) - 1
+
+        # var_key -> (position, value, bitset of the variables it reads,
+        # whether it makes a call) of the temporaries that can be merged
+        pending = {}
+        for k, (stmt, (_, defs, clobbers)) in enumerate(zip(statements, variables.effects(i))):
+            if stmt is None:
+                continue
+
+            if k == last:
+                src = stmt
+            elif isinstance(stmt, BinOp) and stmt.op == ASGN:
+                src = stmt.right_child
+            else:
+                src = None
+            key = var_key(src) if isinstance(src, Var) and src.entry is None else None
+
+            if key in pending:
+                j, value, _, call = pending.pop(key)
+                if not call or j == k - 1:
+                    statements[j] = None
+                    if k == last:
+                        statements[k] = value
+                    else:
+                        new = BinOp(stmt.left_child, value, ASGN)
+                        new.dtype = stmt.dtype
+                        statements[k] = new
+                        # t1 = t0 is now t1 = a + b, which may be merged in turn
+                        stmt = new
+                    coalesced += 1
+
+            written = defs | clobbers
+            for key in [key for key, (_, _, uses, call) in pending.items() if uses & written or call]:
+                del pending[key]
+
+            if k < last and isinstance(stmt, BinOp) and stmt.op == ASGN and\
+               isinstance(stmt.left_child, Var) and stmt.left_child.entry is None:
+                key = var_key(stmt.left_child)
+                if sets[key] == 1 and reads.get(key) == 1:
+                    value = stmt.right_child
+                    pending[key] = (k, value, variables.reads(value), has_call(value))
+
+        if node.is_return or node.logical:
+            node.body = [stmt for stmt in statements[:last] if stmt is not None]
+            if node.is_return:
+                node.return_id = statements[last]
+            else:
+                node.cond = statements[last]
+        else:
+            node.body = [stmt for stmt in statements if stmt is not None]
+
+    return coalesced
+
+
+def renumber_temps(func_cfg):
+    '''
+    name the temporaries of func_cfg t0, t1, ... (after the temp_prefix of
+    its blocks) in the order they first appear
+    '''
+    prefix = func_cfg.nodes[0].temp_prefix
+    names = {}
+
+    def collect(ast):
+        stack = [ast]
+        while stack:
+            ast = stack.pop()
+            if isinstance(ast, Var):
+                key = var_key(ast)
+                if ast.entry is None and key not in names:
+                    names[key] = Var(prefix + str(len(names)))
+                    names[key].dtype = ast.dtype
+            elif isinstance(ast, BinOp):
+                stack.append(ast.right_child)
+                stack.append(ast.left_child)
+            elif isinstance(ast, UnaryOp):
+                stack.append(ast.child)
+            elif isinstance(ast, FunctionCall):
+                stack.extend(reversed(ast.actual_params))
+
+    for node in func_cfg.nodes:
+        for stmt in block_statements(node):
+            if stmt is not None:
+                collect(stmt)
+
+    for node in func_cfg.nodes:
+        body = []
+        for stmt in node.body:
+            new = substitute_statement(stmt, names)
+            if isinstance(stmt, BinOp) and stmt.op == ASGN and isinstance(stmt.left_child, Var):
+                lhs = names.get(var_key(stmt.left_child), stmt.left_child)
+                new = BinOp(lhs, new.right_child, ASGN)
+                new.dtype = stmt.dtype
+            body.append(new)
+        node.body = body
+
+        if node.is_return:
+            if node.return_id is not None:
+                node.return_id = substitute(node.return_id, names)
+        elif node.logical:
+            node.cond = substitute(node.cond, names)
@@ -0,0 +1,588 @@
+'''
+Iterative dataflow analyses over the three address code of a FunctionCFG.
+
+Every set is a Python int used as a bitset, bit i standing for the i-th
+variable, definition or expression of the function, so that meets and
+transfer functions are a handful of big integer operations per block.
+The blocks are visited from a worklist ordered by reverse postorder
+(postorder for backward problems), which settles acyclic code in one pass
+and loops in a few.
+
+Positions in a block: statement k of the block is node.body[k], and the
+last position, len(node.body), is its jump: the branch on node.cond or
+the returned value.
+'''
+import heapq
+
+from ast import BinOp, UnaryOp, Var, FunctionCall, ASGN, DEREF, ADDR
+from symtablev2 import FUNCTION, BLOCK
+
+
+def var_key(var):
+    '''key of the variable `var`, telling temporaries apart from variables of the same name'''
+    return (var.entry is None, var.value)
+
+
+def terminator(node):
+    '''the expression read by the jump of `node`, None if none'''
+    if node.is_return:
+        return node.return_id
+    if node.logical:
+        return node.cond
+    return None
+
+
+def block_statements(node):
+    '''the statements of `node` followed by its terminator'''
+    return node.body + [terminator(node)]
+
+
+class Variables(object):
+    '''
+    the variables and temporaries of a function, each given a bit.
+    variables are told apart by name, as the code generator does: the
+    params and locals of the function, globals and the temporaries made by
+    CFGNode.split_expr (see var_key).
+    '''
+
+    def __init__(self, func_cfg, symtable):
+        '''
+        Args:
+            func_cfg (FunctionCFG)
+            symtable (SymbolTable): the global symbol table
+        '''
+        self.cfg = func_cfg
+        self.names = []
+        self.bits = {}
+
+        f_table = symtable.symbols[func_cfg.func.name]['tableptr']
+        self.local_names = set(k for k, v in f_table.symbols.items()
+                               if v['type'] is not BLOCK and v['type'] is not FUNCTION)
+
+        # bitsets of the temporaries, the globals and the variables whose
+        # address is taken
+        self.temps = 0
+        self.globals = 0
+        self.address_taken = 0
+
+        for node in func_cfg.nodes:
+            for stmt in block_statements(node):
+                self.add_names(stmt)
+
+        # what a store through a pointer or a function call may read or write.
+        # passes only remove or move code, so the sets stay safe to use
+        # after the function was changed
+        self.memory = self.globals | self.address_taken
+
+        self._effects = [None] * len(func_cfg.nodes)
+
+    def add_names(self, ast):
+        stack = [ast]
+        while stack:
+            ast = stack.pop()
+            if isinstance(ast, Var):
+                self.bit(ast)
+            elif isinstance(ast, BinOp):
+                stack.append(ast.left_child)
+                stack.append(ast.right_child)
+            elif isinstance(ast, UnaryOp):
+                if ast.op == ADDR:
+                    self.address_taken |= self.bit(ast.child)
+                else:
+                    stack.append(ast.child)
+            elif isinstance(ast, FunctionCall):
+                stack.extend(ast.actual_params)
+
+    def bit(self, var):
+        '''the bitset {var}, giving a new bit to a name seen for the first time'''
+        key = var_key(var)
+        i = self.bits.get(key)
+        if i is None:
+            name = var.value
+            i = self.bits[key] = len(self.names)
+            self.names.append(name)
+            if var.entry is None:
+                self.temps |= 1 << i
+            elif name not in self.local_names:
+                self.globals |= 1 << i
+        return 1 << i
+
+    def narrow_memory(self):
+        '''
+        drop from memory the variables whose address the code left only
+        loads and stores through (*&x), as after propagate_copies and
+        remove_dead_stores did away with the pointers set to it: no pointer
+        or call can reach them. returns whether memory changed
+        '''
+        escaping = 0
+        stack = [stmt for node in self.cfg.nodes for stmt in block_statements(node)]
+        while stack:
+            ast = stack.pop()
+            if isinstance(ast, BinOp):
+                stack.append(ast.left_child)
+                stack.append(ast.right_child)
+            elif isinstance(ast, UnaryOp):
+                if ast.op == ADDR:
+                    escaping |= self.bit(ast.child)
+                elif ast.op == DEREF and isinstance(ast.child, UnaryOp) and ast.child.op == ADDR:
+                    continue
+                else:
+                    stack.append(ast.child)
+            elif isinstance(ast, FunctionCall):
+                stack.extend(ast.actual_params)
+
+        memory = self.globals | (self.address_taken & escaping)
+        if memory == self.memory:
+            return False
+        self.memory = memory
+        self._effects = [None] * len(self.cfg.nodes)
+        return True
+
+    def index(self, name, temp=False):
+        '''bit number of the variable (or temporary) `name`'''
+        return self.bits[(temp, name)]
+
+    def set_names(self, bits):
+        '''sorted names of the variables in the bitset `bits`'''
+        return sorted(self.names[i] for i in iter_bits(bits))
+
+    def reads(self, ast):
+        '''bitset of the variables the value of `ast` may depend on'''
+        uses = 0
+        stack = [ast]
+        while stack:
+            ast = stack.pop()
+            if isinstance(ast, Var):
+                uses |= self.bit(ast)
+            elif isinstance(ast, BinOp):
+                stack.append(ast.left_child)
+                stack.append(ast.right_child)
+            elif isinstance(ast, UnaryOp):
+                if ast.op == DEREF:
+                    if isinstance(ast.child, UnaryOp) and ast.child.op == ADDR:
+                        # *&x reads x alone
+                        uses |= self.bit(ast.child.child)
+                        continue
+                    uses |= self.memory
+                if ast.op != ADDR:
+                    stack.append(ast.child)
+            elif isinstance(ast, FunctionCall):
+                uses |= self.memory
+                stack.extend(ast.actual_params)
+        return uses
+
+    def statement_effect(self, stmt):
+        '''
+        (uses, defs, clobbers) of a statement: the variables it may read,
+        the ones it surely writes, and the ones it may write through
+        pointers or a call
+        '''
+        if stmt is None:
+            return (0, 0, 0)
+
+        if isinstance(stmt, BinOp) and stmt.op == ASGN:
+            lhs, rhs = stmt.left_child, stmt.right_child
+            uses = self.reads(rhs)
+            defs = 0
+            clobbers = self.memory if isinstance(rhs, FunctionCall) else 0
+            if isinstance(lhs, Var):
+                defs = self.bit(lhs)
+            elif isinstance(lhs.child, UnaryOp) and lhs.child.op == ADDR:
+                # *&x = rhs writes x alone
+                defs = self.bit(lhs.child.child)
+            else:
+                # *e = rhs
+                uses |= self.reads(lhs.child)
+                clobbers = self.memory
+            return (uses, defs, clobbers)
+
+        clobbers = self.memory if isinstance(stmt, FunctionCall) else 0
+        return (self.reads(stmt), 0, clobbers)
+
+    def effects(self, i):
+        '''
+        statement_effect of every position of block i. passes replace
+        node.body, node.cond and node.return_id instead of changing them, so
+        the effects are computed again once any of them was replaced
+        '''
+        if len(self._effects) != len(self.cfg.nodes):
+            # a pass added or removed blocks
+            self._effects = [None] * len(self.cfg.nodes)
+        node = self.cfg.nodes[i]
+        jump = terminator(node)
+        cached = self._effects[i]
+        if cached is None or cached[0] is not node.body or cached[1] is not jump:
+            cached = self._effects[i] = (node.body, jump, [self.statement_effect(stmt)
+                                                           for stmt in block_statements(node)])
+        return cached[2]
+
+
+def iter_bits(bits):
+    '''indices of the set bits of `bits`, lowest first'''
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+class Dataflow(object):
+    '''
+    a gen/kill dataflow problem: at each position the fact becomes
+    gen | (fact & ~kill). subclasses give the statement_transfers of the
+    blocks, the boundary fact and the meet; solve() finds the fixed point,
+    leaving the fact at the start and end of every block in block_in and
+    block_out (None for blocks the entry does not reach).
+    '''
+
+    # direction of the flow: forward from the entry, or backward from the returns
+    forward = True
+    # meet over the incoming edges: union (may) or intersection (must)
+    intersect = False
+
+    def __init__(self, func_cfg):
+        self.cfg = func_cfg
+        self.universe = 0
+        self.block_in = None
+        self.block_out = None
+
+    def statement_transfers(self, i):
+        '''(gen, kill) of every position of block i, in statement order'''
+        raise NotImplementedError
+
+    def boundary(self):
+        '''fact at the entry (forward) or after the returns (backward)'''
+        return 0
+
+    def block_transfer(self, i):
+        '''(gen, kill) of the whole block i'''
+        transfers = self.statement_transfers(i)
+        if not self.forward:
+            transfers = reversed(transfers)
+
+        gen = kill = 0
+        for g, k in transfers:
+            gen = g | (gen & ~k)
+            kill |= k
+        return (gen, kill)
+
+    def solve(self):
+        cfg = self.cfg
+        n = len(cfg.nodes)
+        order = cfg.reverse_postorder()
+        if self.forward:
+            sources, targets = cfg.predecessors(), cfg.successors()
+        else:
+            order = order[::-1]
+            sources, targets = cfg.successors(), cfg.predecessors()
+
+        # priority of each reachable block in the worklist
+        priority = [None] * n
+        for k, i in enumerate(order):
+            priority[i] = k
+
+        transfers = [None] * n
+        for i in order:
+            transfers[i] = self.block_transfer(i)
+
+        top = self.universe if self.intersect else 0
+        boundary = self.boundary()
+        facts_in = [None] * n
+        facts_out = [None] * n
+        for i in order:
+            facts_out[i] = top
+
+        worklist = list(range(len(order)))
+        queued = [True] * n
+        while worklist:
+            i = order[heapq.heappop(worklist)]
+            queued[i] = False
+
+            # the entry meets the boundary with the back edges into it
+            fact = boundary if (self.forward and i == 0) else None
+            for j in sources[i]:
+                if priority[j] is None:
+                    continue
+                if fact is None:
+                    fact = facts_out[j]
+                elif self.intersect:
+                    fact &= facts_out[j]
+                else:
+                    fact |= facts_out[j]
+            if fact is None:
+                fact = boundary
+            facts_in[i] = fact
+
+            gen, kill = transfers[i]
+            fact = gen | (fact & ~kill)
+            if fact != facts_out[i]:
+                facts_out[i] = fact
+                for j in targets[i]:
+                    if not queued[j] and priority[j] is not None:
+                        queued[j] = True
+                        heapq.heappush(worklist, priority[j])
+
+        if self.forward:
+            self.block_in, self.block_out = facts_in, facts_out
+        else:
+            self.block_in, self.block_out = facts_out, facts_in
+        return self
+
+    def positions(self, i):
+        '''
+        the fact before every position of block i, followed by the fact
+        at the end of the block
+        '''
+        transfers = self.statement_transfers(i)
+        if self.forward:
+            facts = [self.block_in[i]]
+            for gen, kill in transfers:
+                facts.append(gen | (facts[-1] & ~kill))
+        else:
+            facts = [self.block_out[i]]
+            for gen, kill in reversed(transfers):
+                facts.append(gen | (facts[-1] & ~kill))
+            facts.reverse()
+        return facts
+
+
+class Liveness(Dataflow):
+    '''
+    variables whose value may still be read: backward, may. globals are
+    live at the returns.
+    '''
+
+    forward = False
+
+    def __init__(self, func_cfg, variables):
+        Dataflow.__init__(self, func_cfg)
+        self.variables = variables
+        self.solve()
+
+    def statement_transfers(self, i):
+        return [(uses, defs) for uses, defs, _ in self.variables.effects(i)]
+
+    def boundary(self):
+        return self.variables.globals
+
+
+class ReachingDefinitions(Dataflow):
+    '''
+    definitions that may reach a point without being overwritten: forward,
+    may. every assignment to a variable is a definition of it, a store
+    through a pointer or a call is one of every variable it may write, and
+    each variable has one at the entry of the function (position None).
+    definitions[d] is (block, position, variable bit number) of definition d.
+    '''
+
+    def __init__(self, func_cfg, variables):
+        Dataflow.__init__(self, func_cfg)
+        self.variables = variables
+
+        self.definitions = []
+        # variable bit number -> bitset of its definitions
+        self.var_defs = [0] * len(variables.names)
+        # (block, position) -> bitset of the definitions made there
+        self.made = {}
+
+        self.entry_defs = self.define(None, None, (1 << len(variables.names)) - 1)
+        for i in func_cfg.reverse_postorder():
+            for k, (_, defs, clobbers) in enumerate(variables.effects(i)):
+                if defs | clobbers:
+                    self.made[(i, k)] = self.define(i, k, defs | clobbers)
+
+        self.universe = (1 << len(self.definitions)) - 1
+        self.solve()
+
+    def define(self, block, position, bits):
+        made = 0
+        for v in iter_bits(bits):
+            d = len(self.definitions)
+            self.definitions.append((block, position, v))
+            self.var_defs[v] |= 1 << d
+            made |= 1 << d
+        return made
+
+    def definitions_of(self, var_bits):
+        '''bitset of all the definitions of the variables in `var_bits`'''
+        defs = 0
+        for v in iter_bits(var_bits):
+            defs |= self.var_defs[v]
+        return defs
+
+    def statement_transfers(self, i):
+        transfers = []
+        for k, (_, defs, _) in enumerate(self.variables.effects(i)):
+            gen = self.made.get((i, k), 0)
+            # only sure definitions overwrite the earlier ones
+            transfers.append((gen, self.definitions_of(defs) & ~gen))
+        return transfers
+
+    def boundary(self):
+        return self.entry_defs
+
+
+def expression_key(ast):
+    '''
+    key of the computation `ast` (the right hand side of a temporary
+    assignment), equal for the same operator on the same operands; None for
+    anything that is not an operator over plain values
+    '''
+    if isinstance(ast, BinOp):
+        return (ast.op, ast.dtype, operand_key(ast.left_child), operand_key(ast.right_child))
+    if isinstance(ast, UnaryOp) and ast.op not in (DEREF, ADDR):
+        return (ast.op, ast.dtype, operand_key(ast.child))
+    return None
+
+
+def operand_key(ast):
+    if isinstance(ast, Var):
+        return var_key(ast)
+    if isinstance(ast, UnaryOp):
+        child = operand_key(ast.child)
+        return None if child is None else (ast.op, child)
+    if isinstance(ast, (BinOp, FunctionCall)):
+        return None
+    # constant, keeping 1 and 1.0 apart
+    return (ast.dtype, ast.value)
+
+
+class AvailableExpressions(Dataflow):
+    '''
+    computations already done on every path, with none of their operands
+    written since: forward, must. expressions[e] is the key (see
+    expression_key) of expression e; its operands are in uses[e].
+    '''
+
+    intersect = True
+
+    def __init__(self, func_cfg, variables):
+        Dataflow.__init__(self, func_cfg)
+        self.variables = variables
+
+        self.expressions = []
+        self.uses = []
+        self.bits = {}
+        # variable bit number -> bitset of the expressions reading it
+        self.readers = [0] * len(variables.names)
+
+        for i in func_cfg.reverse_postorder():
+            for stmt in func_cfg.nodes[i].body:
+                if isinstance(stmt, BinOp) and stmt.op == ASGN:
+                    self.add(stmt.right_child)
+
+        self.universe = (1 << len(self.expressions)) - 1
+        self.solve()
+
+    def add(self, ast):
+        key = expression_key(ast)
+        if key is None or None in key[2:] or key in self.bits:
+            return
+
+        e = len(self.expressions)
+        self.bits[key] = e
+        self.expressions.append(key)
+        uses = self.variables.reads(ast)
+        self.uses.append(uses)
+        for v in iter_bits(uses):
+            self.readers[v] |= 1 << e
+
+    def expression_bit(self, ast):
+        '''bitset {expression computed by ast}, 0 if not tracked'''
+        e = self.bits.get(expression_key(ast))
+        return 0 if e is None else 1 << e
+
+    def killed_by(self, var_bits):
+        '''bitset of the expressions reading any of the variables in `var_bits`'''
+        killed = 0
+        for v in iter_bits(var_bits):
+            killed |= self.readers[v]
+        return killed
+
+    def statement_transfers(self, i):
+        transfers = []
+        for stmt, (_, defs, clobbers) in zip(block_statements(self.cfg.nodes[i]),
+                                            self.variables.effects(i)):
+            kill = self.killed_by(defs | clobbers)
+            gen = 0
+            if isinstance(stmt, BinOp) and stmt.op == ASGN:
+                gen = self.expression_bit(stmt.right_child) & ~kill
+            transfers.append((gen, kill))
+        return transfers
+
+
+def is_copy(stmt):
+    '''
+    whether `stmt` copies a value into a variable: a variable, a constant
+    or the address of a variable assigned to another variable
+    '''
+    if not (isinstance(stmt, BinOp) and stmt.op == ASGN and isinstance(stmt.left_child, Var)):
+        return False
+    src = stmt.right_child
+    if isinstance(src, Var):
+        return var_key(src) != var_key(stmt.left_child)
+    if isinstance(src, UnaryOp):
+        return src.op == ADDR
+    return not isinstance(src, (BinOp, FunctionCall))
+
+
+class AvailableCopies(Dataflow):
+    '''
+    copies x = y (see is_copy) with neither x nor y written since, on every
+    path: forward, must. copies[c] is the (x, y) of copy c; the variables
+    it depends on are in uses[c].
+    '''
+
+    intersect = True
+
+    def __init__(self, func_cfg, variables):
+        Dataflow.__init__(self, func_cfg)
+        self.variables = variables
+
+        self.copies = []
+        self.uses = []
+        self.bits = {}
+        # variable bit number -> bitset of the copies reading or writing it
+        self.readers = [0] * len(variables.names)
+
+        for i in func_cfg.reverse_postorder():
+            for stmt in func_cfg.nodes[i].body:
+                if is_copy(stmt):
+                    self.add(stmt.left_child, stmt.right_child)
+
+        self.universe = (1 << len(self.copies)) - 1
+        self.solve()
+
+    def add(self, dst, src):
+        key = (var_key(dst), operand_key(src))
+        if key in self.bits:
+            return
+
+        c = len(self.copies)
+        self.bits[key] = c
+        self.copies.append((dst, src))
+        uses = self.variables.bit(dst) | self.variables.reads(src)
+        self.uses.append(uses)
+        for v in iter_bits(uses):
+            self.readers[v] |= 1 << c
+
+    def copy_bit(self, stmt):
+        '''bitset {copy made by stmt}, 0 if it is none'''
+        if not is_copy(stmt):
+            return 0
+        c = self.bits.get((var_key(stmt.left_child), operand_key(stmt.right_child)))
+        return 0 if c is None else 1 << c
+
+    def killed_by(self, var_bits):
+        '''bitset of the copies reading or writing any of the variables in `var_bits`'''
+        killed = 0
+        for v in iter_bits(var_bits):
+            killed |= self.readers[v]
+        return killed
+
+    def statement_transfers(self, i):
+        transfers = []
+        for stmt, (_, defs, clobbers) in zip(block_statements(self.cfg.nodes[i]),
+                                            self.variables.effects(i)):
+            gen = self.copy_bit(stmt)
+            transfers.append((gen, self.killed_by(defs | clobbers) & ~gen))
+        return transfers
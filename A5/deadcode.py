@@ -0,0 +1,147 @@
+'''
+Dead code elimination over the three address code of a FunctionCFG.
+
+Branches on a constant become jumps, assignments whose value is never read
+are removed, and blocks left without code or that the entry can not reach
+are dropped. Liveness is solved again after a sweep over the blocks that
+changed what is live at the start of one, since removing an assignment can
+leave the ones feeding it in other blocks dead as well.
+'''
+from ast import BinOp, UnaryOp, Const, FunctionCall
+from dataflow import Liveness
+from fold import const_value
+
+
+def fold_branches(func_cfg):
+    '''
+    turn the blocks branching on a constant into jumps to the branch
+    taken, returns how many were changed
+    '''
+    folded = 0
+    for node in func_cfg.nodes:
+        if node.logical and isinstance(node.cond, Const):
+            goto = node.goto_t if const_value(node.cond) else node.goto_f
+            node.logical = False
+            del node.goto_t, node.goto_f, node.cond
+            node.goto = goto
+            folded += 1
+
+    if folded:
+        func_cfg.invalidate()
+    return folded
+
+
+def calls(ast):
+    '''the function calls in `ast`, in the order they are made'''
+    found = []
+    stack = [ast]
+    while stack:
+        ast = stack.pop()
+        if isinstance(ast, FunctionCall):
+            found.append(ast)
+        elif isinstance(ast, BinOp):
+            stack.append(ast.right_child)
+            stack.append(ast.left_child)
+        elif isinstance(ast, UnaryOp):
+            stack.append(ast.child)
+    return found
+
+
+def remove_dead_stores(func_cfg, variables):
+    '''
+    remove the assignments to temporaries and local variables that are not
+    read before being assigned again or the function returns. the calls
+    made by a removed right hand side are kept as statements.
+    returns the number of assignments removed
+    '''
+    removed = 0
+    changed = True
+    while changed:
+        changed = False
+        liveness = Liveness(func_cfg, variables)
+
+        for i in func_cfg.reverse_postorder():
+            node = func_cfg.nodes[i]
+            # what the jump reads is live before it
+            live = liveness.block_out[i] | variables.effects(i)[-1][0]
+
+            body = []
+            dropped = False
+            for stmt in reversed(node.body):
+                uses, defs, _ = variables.statement_effect(stmt)
+                if defs and not defs & (live | variables.memory):
+                    # defs is only set by assignments to a variable
+                    kept = calls(stmt.right_child)
+                    body.extend(reversed(kept))
+                    for call in kept:
+                        live |= variables.reads(call)
+                    removed += 1
+                    dropped = True
+                    continue
+
+                live = uses | (live & ~defs)
+                body.append(stmt)
+
+            if dropped:
+                body.reverse()
+                node.body = body
+                # chains of dead assignments within the block are all gone,
+                # stores in other blocks may only have died if less is live
+                # at the start of this one
+                if live != liveness.block_in[i]:
+                    changed = True
+
+    return removed
+
+
+def remove_dead_blocks(func_cfg):
+    '''
+    drop the blocks that the entry can not reach and the blocks with no
+    code besides their jump, redirecting the jumps to them to where they
+    lead. returns the number of blocks removed
+    '''
+    nodes = func_cfg.nodes
+
+    def empty(i):
+        node = nodes[i]
+        return (i != 0 and not node.body and not node.logical and not node.is_return and
+                func_cfg.index(node.goto) is not None)
+
+    # target[i]: index of the block jumps to block i go to instead
+    target = list(range(len(nodes)))
+    for i in range(len(nodes)):
+        if not empty(i) or target[i] != i:
+            continue
+        path = []
+        on_path = set()
+        j = i
+        while empty(j) and j not in on_path:
+            path.append(j)
+            on_path.add(j)
+            j = target[func_cfg.index(nodes[j].goto)]
+        if j in on_path:
+            # a loop of empty blocks, the jumps into it go to block j
+            path = path[:path.index(j)]
+        for k in path:
+            target[k] = j
+
+    def redirect(goto):
+        i = func_cfg.index(goto)
+        return goto if i is None else nodes[target[i]].id
+
+    for node in nodes:
+        if node.logical:
+            node.goto_t = redirect(node.goto_t)
+            node.goto_f = redirect(node.goto_f)
+        elif not node.is_return:
+            node.goto = redirect(node.goto)
+
+    func_cfg.invalidate()
+    keep = [False] * len(nodes)
+    for i in func_cfg.reverse_postorder():
+        keep[i] = True
+
+    removed = keep.count(False)
+    if removed:
+        func_cfg.remove_nodes(keep)
+    return removed
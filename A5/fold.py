@@ -0,0 +1,285 @@
+'''
+Constant folding, with the semantics of the generated MIPS code: ints are
+32 bit two's complement (division truncates towards zero) and floats are
+single precision, each operation rounding its result. add and sub trap on
+an overflow, so an int +, - or unary - whose result does not fit in 32
+bits is not folded but left to run time, as a division by zero is; an int
+* wraps, as mul does.
+
+fold() is applied by the parser to every operator as it is reduced, so the
+CFG and the code generator get the smaller trees; fold_constants() folds
+the three address code of a CFG again, after other passes have put
+constants in place of temporaries.
+'''
+import ctypes
+import math
+
+from ast import BinOp, UnaryOp, Var, Const, FunctionCall, ASGN,\
+    PLUS, MINUS, MUL, DIV, LT, LE, GT, GE, EQ, NE, AND, OR, NOT, UMINUS, ADDR
+from symtablev2 import INT, FLOAT, BOOL
+from dataflow import var_key
+
+
+INT_MIN = -(1 << 31)
+INT_MAX = (1 << 31) - 1
+
+
+def wrap_int(value):
+    '''`value` as a 32 bit two's complement int'''
+    value &= 0xffffffff
+    return value - (1 << 32) if value & 0x80000000 else value
+
+
+def round_float(value):
+    '''`value` rounded to single precision'''
+    return ctypes.c_float(value).value
+
+
+def const_value(const):
+    '''value of `const` in the target's representation of its type'''
+    if const.dtype is FLOAT:
+        return round_float(const.value)
+    if const.dtype is BOOL:
+        return 1 if const.value else 0
+    return wrap_int(const.value)
+
+
+def make_const(value, dtype):
+    '''Const of `dtype` holding `value`, None if the value can not be written out'''
+    if dtype is FLOAT:
+        value = round_float(value)
+        if math.isinf(value) or math.isnan(value):
+            # li.s takes a decimal number, leave it to the run time
+            return None
+        return Const(value, FLOAT)
+    if dtype is BOOL:
+        return Const(1 if value else 0, BOOL)
+    return Const(wrap_int(value), INT)
+
+
+def fitting(value, dtype):
+    '''`value`, None if it is an int that does not fit in 32 bits'''
+    if dtype is INT and not INT_MIN <= value <= INT_MAX:
+        return None
+    return value
+
+
+def evaluate(op, dtype, a, b=None):
+    '''
+    value of `op` on the constants a (and b) of type `dtype`, None if it
+    can not be computed at compile time (division by zero, an int +, -
+    or unary - overflowing)
+    '''
+    if op == UMINUS:
+        return fitting(-a, dtype)
+    if op == NOT:
+        return 0 if a else 1
+
+    if op == PLUS:
+        return fitting(a + b, dtype)
+    if op == MINUS:
+        return fitting(a - b, dtype)
+    if op == MUL:
+        return a * b
+    if op == DIV:
+        if b == 0:
+            return None
+        if dtype is FLOAT:
+            return a / b
+        # truncate towards zero, as div does
+        q = abs(a) // abs(b)
+        return q if (a < 0) == (b < 0) else -q
+
+    if op == LT:
+        return a < b
+    if op == LE:
+        return a <= b
+    if op == GT:
+        return a > b
+    if op == GE:
+        return a >= b
+    if op == EQ:
+        return a == b
+    if op == NE:
+        return a != b
+    if op == AND:
+        return a and b
+    if op == OR:
+        return a or b
+    return None
+
+
+def is_pure(ast):
+    '''whether evaluating `ast` has no effect besides its value (no call)'''
+    stack = [ast]
+    while stack:
+        ast = stack.pop()
+        if isinstance(ast, FunctionCall):
+            return False
+        if isinstance(ast, BinOp):
+            stack.append(ast.left_child)
+            stack.append(ast.right_child)
+        elif isinstance(ast, UnaryOp):
+            stack.append(ast.child)
+    return True
+
+
+def is_const(ast, value):
+    return isinstance(ast, Const) and const_value(ast) == value
+
+
+def simplify(ast):
+    '''
+    `ast` without operations that leave the other operand unchanged
+    (x + 0, x * 1, b && 1, ...) or whose result does not depend on it
+    (x * 0, b && 0, ...), None if there are none
+    '''
+    left, right = ast.left_child, ast.right_child
+    op = ast.op
+
+    if ast.dtype is INT:
+        if op == PLUS:
+            if is_const(left, 0):
+                return right
+            if is_const(right, 0):
+                return left
+        elif op == MINUS:
+            if is_const(right, 0):
+                return left
+        elif op == MUL:
+            if is_const(left, 1):
+                return right
+            if is_const(right, 1):
+                return left
+            if is_const(left, 0) and is_pure(right) or is_const(right, 0) and is_pure(left):
+                return Const(0, INT)
+        elif op == DIV:
+            if is_const(right, 1):
+                return left
+
+    elif ast.dtype is FLOAT:
+        # x + 0.0 is not x for x = -0.0
+        if op == MUL:
+            if is_const(left, 1.0):
+                return right
+            if is_const(right, 1.0):
+                return left
+        elif op == MINUS or op == DIV:
+            if is_const(right, 0.0 if op == MINUS else 1.0):
+                return left
+
+    elif op == AND or op == OR:
+        neutral = 1 if op == AND else 0
+        for const, other in ((left, right), (right, left)):
+            if is_const(const, neutral):
+                return other
+            if is_const(const, 1 - neutral) and is_pure(other):
+                return Const(1 - neutral, BOOL)
+
+    return None
+
+
+def fold(ast):
+    '''
+    `ast` with its own operation folded, its children being folded
+    already: a Const if all operands are constant, the remaining operand
+    if the operation does nothing, otherwise `ast` itself
+    '''
+    if isinstance(ast, BinOp) and ast.op != ASGN:
+        left, right = ast.left_child, ast.right_child
+        if isinstance(left, Const) and isinstance(right, Const):
+            value = evaluate(ast.op, left.dtype, const_value(left), const_value(right))
+            if value is not None:
+                const = make_const(value, ast.dtype)
+                if const is not None:
+                    return const
+        simpler = simplify(ast)
+        if simpler is not None:
+            return simpler
+
+    elif isinstance(ast, UnaryOp) and (ast.op == UMINUS or ast.op == NOT):
+        if isinstance(ast.child, Const):
+            value = evaluate(ast.op, ast.dtype, const_value(ast.child))
+            if value is not None:
+                const = make_const(value, ast.dtype)
+                if const is not None:
+                    return const
+
+    return ast
+
+
+def substitute(ast, values):
+    '''
+    `ast` with the variables it reads replaced by their values in `values`
+    (var_key -> operand), a new node if anything changed
+    '''
+    if isinstance(ast, Var):
+        return values.get(var_key(ast), ast)
+
+    if isinstance(ast, BinOp):
+        left = substitute(ast.left_child, values)
+        right = substitute(ast.right_child, values)
+        if left is ast.left_child and right is ast.right_child:
+            return ast
+        new = BinOp(left, right, ast.op)
+
+    elif isinstance(ast, UnaryOp) and ast.op != ADDR:
+        child = substitute(ast.child, values)
+        if child is ast.child:
+            return ast
+        new = UnaryOp(child, ast.op)
+
+    elif isinstance(ast, FunctionCall):
+        params = [substitute(p, values) for p in ast.actual_params]
+        if all(p is q for p, q in zip(params, ast.actual_params)):
+            return ast
+        new = FunctionCall(ast.id, params)
+
+    else:
+        # constants, and the variables under &, whose value is not read
+        return ast
+
+    new.dtype = ast.dtype
+    return new
+
+
+def fold_constants(func_cfg):
+    '''
+    fold the three address code of the blocks of `func_cfg`. within a
+    block, a temporary assigned a constant is replaced by it in the
+    statements after the assignment, until it is assigned again.
+    returns the number of operations folded away.
+    '''
+    folded = 0
+    for node in func_cfg.nodes:
+        consts = {}
+        body = []
+        for stmt in node.body:
+            if isinstance(stmt, BinOp) and stmt.op == ASGN:
+                lhs = stmt.left_child
+                rhs = substitute(stmt.right_child, consts)
+                value = fold(rhs)
+                if value is not rhs or rhs is not stmt.right_child:
+                    if value is not rhs:
+                        folded += 1
+                    dtype = stmt.dtype
+                    stmt = BinOp(lhs, value, ASGN)
+                    stmt.dtype = dtype
+
+                if isinstance(lhs, Var):
+                    consts.pop(var_key(lhs), None)
+                    if isinstance(value, Const) and lhs.entry is None:
+                        consts[var_key(lhs)] = value
+            else:
+                stmt = substitute(stmt, consts)
+            body.append(stmt)
+        node.body = body
+
+        if node.logical:
+            cond = fold(substitute(node.cond, consts))
+            if cond is not node.cond:
+                node.cond = cond
+        elif node.is_return and node.return_id is not None:
+            node.return_id = fold(substitute(node.return_id, consts))
+
+    return folded
@@ -0,0 +1,292 @@
+'''
+Content addressed on-disk cache of the per-function compilation results
+(the .cfg fragment and the MIPS code of a function).
+
+Basic block ids, temporaries and float comparison labels are numbered
+across the whole file, so the cached fragments are generated with marker
+prefixes in place of those numbers (relative to the start of the function)
+and relocated when they are used.
+'''
+import bisect
+import hashlib
+import json
+import os
+import re
+import tempfile
+from collections import Counter
+from io import StringIO
+
+from ast import BinOp, UnaryOp, Var, If, While, Function, Block,\
+    FunctionCall, ReturnStmt
+from cfg import CFG
+from asm import ASMCodeGenerator
+from symtablev2 import FUNCTION, BLOCK
+import optimize
+
+
+# markers can not clash with identifiers, NUL is not a legal source character
+TEMP_MARK = '\x00t'
+LABEL_MARK = '\x00L'
+FCMP_MARK = '\x00F'
+
+RELOCATION = re.compile('<bb (\\d+)>|\x00([tLF])(\\d+)')
+
+
+def source_hash(directory):
+    '''hash of the source of every module in `directory`'''
+    h = hashlib.sha1()
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.py'):
+            h.update(name.encode())
+            with open(os.path.join(directory, name), 'rb') as f:
+                h.update(f.read())
+    return h.hexdigest()
+
+
+# cached results are only valid for the compiler that made them: the
+# lexer, the parser (and its folding), the symbol table, the AST and every
+# phase after them shape the cached text, so all of the modules count
+CODEGEN_VERSION = source_hash(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TokenRecorder(object):
+    '''lexer wrapper keeping every token handed to the parser'''
+
+    def __init__(self, lexer):
+        self.lexer = lexer
+        self.tokens = []
+
+    def input(self, data):
+        self.lexer.input(data)
+
+    def token(self):
+        tok = self.lexer.token()
+        if tok is not None:
+            self.tokens.append(tok)
+        return tok
+
+
+class FunctionCache(object):
+    '''
+    one json file per function in <cache_dir>/<key[:2]>/<key>.json.
+    files are written atomically, so any number of processes can share a
+    cache directory, and the least recently used entries are evicted once
+    the directory grows past max_bytes.
+    '''
+
+    def __init__(self, cache_dir, max_bytes=64 * 2**20):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        # approximate size of the directory, None until first scanned
+        self.size = None
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.json')
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path, 'r') as f:
+                entry = json.load(f)
+            # bump the entry in the LRU order
+            os.utime(path)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        path = self.path(key)
+        dirname = os.path.dirname(path)
+        os.makedirs(dirname, exist_ok=True)
+
+        fd, temp_path = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entry, f)
+            os.replace(temp_path, path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            return
+
+        if self.size is None:
+            self.size = sum(size for _, size, _ in self.entries())
+        else:
+            self.size += os.path.getsize(path)
+
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def entries(self):
+        '''(path, size, last use) of every cache file'''
+        result = []
+        if not os.path.isdir(self.cache_dir):
+            return result
+        for subdir in os.scandir(self.cache_dir):
+            if not subdir.is_dir():
+                continue
+            for f in os.scandir(subdir.path):
+                try:
+                    stat = f.stat()
+                except OSError:
+                    # removed by another process
+                    continue
+                result.append((f.path, stat.st_size, stat.st_mtime))
+        return result
+
+    def evict(self):
+        '''remove least recently used entries until below 3/4 of max_bytes'''
+        entries = sorted(self.entries(), key=lambda x: x[2])
+        size = sum(x[1] for x in entries)
+        for path, file_size, _ in entries:
+            if size <= self.max_bytes * 3 // 4:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            size -= file_size
+        self.size = size
+
+
+def referenced_names(asts):
+    '''names of all variables and functions used in `asts`'''
+    names = set()
+    stack = list(asts)
+    while stack:
+        node = stack.pop()
+        if isinstance(node, Var):
+            names.add(node.value)
+        elif isinstance(node, BinOp):
+            stack.append(node.left_child)
+            stack.append(node.right_child)
+        elif isinstance(node, UnaryOp):
+            stack.append(node.child)
+        elif isinstance(node, FunctionCall):
+            names.add(node.id)
+            stack.extend(node.actual_params)
+        elif isinstance(node, If):
+            stack.append(node.cond)
+            stack.extend(node.body)
+            stack.extend(node.else_body)
+        elif isinstance(node, While):
+            stack.append(node.cond)
+            stack.extend(node.body)
+        elif isinstance(node, ReturnStmt):
+            if node.expression is not None:
+                stack.append(node.expression)
+        elif isinstance(node, Block):
+            stack.extend(node.asts)
+    return names
+
+
+def global_signature(name, entry):
+    if entry['type'] is FUNCTION:
+        return [name, 'function', entry['ret_type'], list(entry['signature'].types)]
+    return [name, entry['type']]
+
+
+def function_key(func, symtable, tokens, positions, optimized=False):
+    '''
+    hash of the tokens of the definition of `func` and of the signatures
+    of the globals and functions it refers to
+    Args:
+        tokens: all tokens of the file, ordered by lexpos
+        positions: their lexpos
+        optimized (bool): whether the code is optimized
+    '''
+    start = bisect.bisect_left(positions, func.span[0])
+    end = bisect.bisect_right(positions, func.span[1])
+
+    h = hashlib.sha1(CODEGEN_VERSION.encode())
+    h.update(json.dumps([func.name, func.ret_type, optimized]).encode())
+    for tok in tokens[start:end]:
+        h.update(('%s %s\n' % (tok.type, tok.value)).encode())
+
+    for name in sorted(referenced_names(func.body)):
+        entry = symtable.symbols.get(name)
+        if entry is not None and entry['type'] is not BLOCK:
+            h.update(json.dumps(global_signature(name, entry)).encode())
+
+    return h.hexdigest()
+
+
+def function_template(func, symtable, optimized=False):
+    '''.cfg and asm text of `func`, numbered from 0 with the marker prefixes'''
+    func_cfg = CFG([func], temp_prefix=TEMP_MARK, split_calls=optimized)
+    stats = optimize.optimize(func_cfg, symtable) if optimized else {}
+    cfg_file = StringIO()
+    func_cfg.write(cfg_file)
+
+    asm_file = StringIO()
+    asm_gen = ASMCodeGenerator(func_cfg, symtable, asm_file, data=False,
+                               label_prefix=LABEL_MARK, fcmp_prefix=FCMP_MARK)
+
+    return {
+        'cfg': cfg_file.getvalue(),
+        'asm': asm_file.getvalue(),
+        'nodes': func_cfg.node_count,
+        'temps': func_cfg.temp_count,
+        'fcmps': asm_gen.fcmp_count,
+        'stats': stats.get(func.name, {}),
+    }
+
+
+def relocate(text, node_base, temp_base, fcmp_base):
+    def replace(m):
+        if m.group(1) is not None:
+            return '<bb %d>' % (int(m.group(1)) + node_base)
+        n = int(m.group(3))
+        kind = m.group(2)
+        if kind == 't':
+            return 't%d' % (n + temp_base)
+        elif kind == 'L':
+            return 'label%d' % (n + node_base)
+        return '%d' % (n + fcmp_base)
+
+    return RELOCATION.sub(replace, text)
+
+
+def cached_codegen(asts, symtable, tokens, cache, cfg_file, asm_file, opt_stats=None):
+    '''
+    write the .cfg and asm of the program `asts` like CFG and
+    ASMCodeGenerator do, reusing the cached results of functions.
+    either file may be None to skip it.
+    if `opt_stats` is a dict, the functions are optimized and their
+    statistics added to it.
+    '''
+    optimized = opt_stats is not None
+
+    # .data part only
+    if asm_file is not None:
+        ASMCodeGenerator(None, symtable, asm_file)
+
+    positions = [tok.lexpos for tok in tokens]
+    node_base = temp_base = fcmp_base = 0
+
+    for func in asts:
+        if not isinstance(func, Function) or not func.has_def:
+            continue
+
+        key = function_key(func, symtable, tokens, positions, optimized)
+        entry = cache.get(key)
+        if entry is None:
+            entry = function_template(func, symtable, optimized)
+            cache.put(key, entry)
+
+        if optimized:
+            opt_stats[func.name] = Counter(entry['stats'])
+
+        if cfg_file is not None:
+            cfg_file.write(relocate(entry['cfg'], node_base, temp_base, fcmp_base))
+        if asm_file is not None:
+            asm_file.write(relocate(entry['asm'], node_base, temp_base, fcmp_base))
+
+        node_base += entry['nodes']
+        temp_base += entry['temps']
+        fcmp_base += entry['fcmps']
@@ -3,8 +3,18 @@ import ply.lex as lex
 
 class APLLexer(object):
 
-    def __init__(self):
-        self.lexer = lex.lex(module=self)
+    def __init__(self, backend='ply'):
+        '''
+        Args:
+            backend (str): 'ply' for the ply.lex based lexer,
+                           'dfa' for the table driven DFALexer
+        '''
+        if backend == 'dfa':
+            self.lexer = DFALexer()
+        elif backend == 'ply':
+            self.lexer = lex.lex(module=self)
+        else:
+            raise ValueError('unknown lexer backend %s' % (backend))
         self.lexer.linestart = 0
 
     def __iter__(self):
@@ -71,20 +81,12 @@ class APLLexer(object):
 
     def t_REAL(self, t):
         r'([0-9]+[.][0-9]*|[.][0-9]+)'
-        try:
-            val = float(t.value)
-        except ValueError:
-            print("float value too large %d", t.value)
-            t.value = 0
+        t.value = literal('REAL', t.value)
         return t
 
     def t_INTEGER(self, t):
         r'\d+'
-        try:
-            val = int(t.value)
-        except ValueError:
-            print("Integer value too large %d", t.value)
-            t.value = 0
+        t.value = literal('INTEGER', t.value)
         return t
 
     def t_error(self, t):
@@ -95,3 +97,209 @@ class APLLexer(object):
         r'\n+'
         t.lexer.lineno += len(t.value)
         t.lexer.linestart = t.lexer.lexpos
+
+
+class Literal(object):
+    '''value of an INTEGER or REAL token: the number and how it was written'''
+    __slots__ = ('value', 'text')
+
+    def __init__(self, value, text):
+        self.value = value
+        self.text = text
+
+    def __str__(self):
+        return self.text
+
+    def __repr__(self):
+        return self.text
+
+
+def literal(token_type, text):
+    '''Literal of the INTEGER or REAL token `text`'''
+    try:
+        if token_type == 'REAL':
+            return Literal(float(text), text)
+        return Literal(int(text), text)
+    except ValueError:
+        # int() refuses strings of more than sys.get_int_max_str_digits() digits
+        print("%s value too large %s" % ('float' if token_type == 'REAL' else 'Integer', text))
+        return Literal(0, text)
+
+
+# character classes of the DFA, every input character maps to one of these
+C_OTHER, C_LETTER, C_DIGIT, C_DOT, C_NEWLINE, C_SPACE = range(6)
+PUNCT = '(){}*;,&+-/=<>!|'
+NUM_CLASSES = 6 + len(PUNCT)
+
+
+def char_class(ch):
+    if ch == '_' or ('a' <= ch <= 'z') or ('A' <= ch <= 'Z'):
+        return C_LETTER
+    if '0' <= ch <= '9':
+        return C_DIGIT
+    if ch == '.':
+        return C_DOT
+    if ch == '\n':
+        return C_NEWLINE
+    if ch in APLLexer.t_ignore:
+        return C_SPACE
+    if ch in PUNCT:
+        return 6 + PUNCT.index(ch)
+    return C_OTHER
+
+
+# state -> (accepted token or None, {input class or punctuation: next state})
+# state 0 is the start state; 'newline' is accepted but never returned.
+DFA_SPEC = {
+    'start': (None, {
+        C_LETTER: 'id', C_DIGIT: 'int', C_DOT: 'dot', C_NEWLINE: 'newline',
+        '(': 'lparen', ')': 'rparen', '{': 'lbracket', '}': 'rbracket',
+        '*': 'star', ';': 'semicolon', ',': 'comma', '&': 'and',
+        '+': 'plus', '-': 'minus', '/': 'divide', '=': 'equals',
+        '<': 'lt', '>': 'gt', '!': 'bool_not', '|': 'bar',
+    }),
+    'id': ('ID', {C_LETTER: 'id', C_DIGIT: 'id'}),
+    'int': ('INTEGER', {C_DIGIT: 'int', C_DOT: 'real'}),
+    'dot': (None, {C_DIGIT: 'real'}),
+    'real': ('REAL', {C_DIGIT: 'real'}),
+    'newline': ('newline', {C_NEWLINE: 'newline'}),
+    'lparen': ('LPAREN', {}),
+    'rparen': ('RPAREN', {}),
+    'lbracket': ('LBRACKET', {}),
+    'rbracket': ('RBRACKET', {}),
+    'star': ('STAR', {}),
+    'semicolon': ('SEMICOLON', {}),
+    'comma': ('COMMA', {}),
+    'and': ('AND', {'&': 'bool_and'}),
+    'bool_and': ('BOOL_AND', {}),
+    'bar': (None, {'|': 'bool_or'}),
+    'bool_or': ('BOOL_OR', {}),
+    'plus': ('PLUS', {}),
+    'minus': ('MINUS', {}),
+    'divide': ('DIVIDE', {}),
+    'equals': ('EQUALS', {'=': 'eq'}),
+    'eq': ('EQ', {}),
+    'lt': ('LT', {'=': 'le'}),
+    'le': ('LE', {}),
+    'gt': ('GT', {'=': 'ge'}),
+    'ge': ('GE', {}),
+    'bool_not': ('BOOL_NOT', {'=': 'ne'}),
+    'ne': ('NE', {}),
+}
+
+
+def build_dfa_tables(spec):
+    '''
+    flatten DFA_SPEC into
+        trans: list, trans[state * NUM_CLASSES + class] = next state or -1
+        accept: list, accept[state] = token type or None
+    '''
+    names = list(spec.keys())
+    index = {name: i for i, name in enumerate(names)}
+    trans = [-1] * (len(names) * NUM_CLASSES)
+    accept = []
+    for name in names:
+        token_type, edges = spec[name]
+        accept.append(token_type)
+        for c, target in edges.items():
+            if isinstance(c, str):
+                c = 6 + PUNCT.index(c)
+            trans[index[name] * NUM_CLASSES + c] = index[target]
+    return trans, accept
+
+
+DFA_TRANS, DFA_ACCEPT = build_dfa_tables(DFA_SPEC)
+
+# str.translate table mapping latin-1 characters to their class, anything
+# else falls back to C_OTHER
+CLASS_TABLE = {i: char_class(chr(i)) for i in range(256)}
+
+
+class DFALexer(object):
+    '''
+    table driven scanner producing the same tokens (type, value, lineno,
+    lexpos) as the ply lexer built from APLLexer, usable by ply.yacc
+    '''
+
+    def __init__(self):
+        self.lexdata = ''
+        self.lexpos = 0
+        self.lexlen = 0
+        self.lineno = 1
+        self.linestart = 0
+        self._tokens = iter(())
+
+    def __iter__(self):
+        return self._tokens
+
+    def input(self, data):
+        if not isinstance(data, str):
+            raise ValueError('Expected a string')
+        self.lexdata = data
+        self.lexpos = 0
+        self.lexlen = len(data)
+        self._tokens = self._scan()
+
+    def token(self):
+        return next(self._tokens, None)
+
+    def _scan(self):
+        data = self.lexdata
+        n = self.lexlen
+        classes = data.translate(CLASS_TABLE)
+        trans = DFA_TRANS
+        accept = DFA_ACCEPT
+        reserved = APLLexer.reserved
+        width = NUM_CLASSES
+        LexToken = lex.LexToken
+
+        pos = self.lexpos
+        while pos < n:
+            c = ord(classes[pos])
+            if c == C_SPACE:
+                pos += 1
+                continue
+
+            # maximal munch, remember the last accepting state seen
+            state = trans[c] if c < width else -1
+            last_state = -1
+            last_end = pos
+            i = pos + 1
+            while state >= 0:
+                if accept[state] is not None:
+                    last_state = state
+                    last_end = i
+                if i >= n:
+                    break
+                c = ord(classes[i])
+                state = trans[state * width + c] if c < width else -1
+                i += 1
+
+            if last_state < 0:
+                print("Illegal character '%s'" % data[pos])
+                pos += 1
+                continue
+
+            token_type = accept[last_state]
+            value = data[pos:last_end]
+
+            if token_type == 'newline':
+                self.lineno += last_end - pos
+                self.lexpos = pos = last_end
+                self.linestart = pos
+                continue
+
+            if token_type == 'ID':
+                token_type = reserved.get(value, 'ID')
+            elif token_type == 'INTEGER' or token_type == 'REAL':
+                value = literal(token_type, value)
+
+            tok = LexToken()
+            tok.type = token_type
+            tok.value = value
+            tok.lineno = self.lineno
+            tok.lexpos = pos
+            self.lexpos = pos = last_end
+            yield tok
+
+        self.lexpos = pos
@@ -0,0 +1,225 @@
+'''
+Loop invariant code motion over the three address code of a FunctionCFG.
+
+The loops are the natural loops of FunctionCFG.loops(): a while loop is
+its condition block, which the loop's back edge jumps to, and its body.
+A temporary computed in a loop from values that no statement of the loop
+writes holds the same value on every iteration, so it is computed once in
+a preheader run right before the loop is entered instead. A load through
+a pointer is invariant only when the loop has no store through a pointer,
+no call and no assignment to a global or to a variable whose address is
+taken, as any of them may change Variables.memory.
+
+The preheader runs even when the loop is not entered, so the code that may
+stop the program there, a load through a pointer or an integer division,
+is only moved out of the blocks run on every entry into the loop, unless
+it loads through a pointer that is already loaded or stored through,
+holding the same value, whenever the loop is entered. A moved temporary is
+read from a stack slot inside the loop, so only computations costing more
+than its loads are moved.
+'''
+from ast import BinOp, UnaryOp, Var, Const, FunctionCall, ASGN, DEREF, ADDR, DIV
+from dataflow import block_statements, var_key
+from copyprop import temp_counts, count_temp_reads, has_call
+from fold import const_value
+from valuenum import expression_cost, operand_cost
+from symtablev2 import FLOAT
+
+
+def may_fault(ast, safe):
+    '''
+    whether computing `ast` may stop the program: a load through a pointer
+    not in `safe` (var_keys) or an integer division
+    '''
+    stack = [ast]
+    while stack:
+        ast = stack.pop()
+        if isinstance(ast, BinOp):
+            if ast.op == DIV and ast.left_child.dtype is not FLOAT and\
+               not (isinstance(ast.right_child, Const) and const_value(ast.right_child) != 0):
+                return True
+            stack.append(ast.left_child)
+            stack.append(ast.right_child)
+        elif isinstance(ast, UnaryOp):
+            if ast.op == DEREF:
+                child = ast.child
+                if isinstance(child, Var) and var_key(child) in safe:
+                    continue
+                if not (isinstance(child, UnaryOp) and child.op == ADDR):
+                    return True
+            if ast.op != ADDR:
+                stack.append(ast.child)
+    return False
+
+
+def dereferenced(ast, keys):
+    '''add the var_keys of the pointers `ast` loads or stores through to keys'''
+    stack = [ast]
+    while stack:
+        ast = stack.pop()
+        if isinstance(ast, BinOp):
+            stack.append(ast.left_child)
+            stack.append(ast.right_child)
+        elif isinstance(ast, UnaryOp):
+            if ast.op == DEREF and isinstance(ast.child, Var):
+                keys.add(var_key(ast.child))
+            stack.append(ast.child)
+        elif isinstance(ast, FunctionCall):
+            stack.extend(ast.actual_params)
+
+
+def block_dereferences(node):
+    '''var_keys of the pointers the block `node` loads or stores through'''
+    keys = set()
+    for stmt in block_statements(node):
+        if stmt is not None:
+            dereferenced(stmt, keys)
+    return keys
+
+
+def dominating_dereferences(func_cfg, variables, written):
+    '''
+    for every block, the var_keys of the pointers not in the bitset
+    `written` that it or a block dominating it loads or stores through
+    '''
+    idom = func_cfg.idom()
+    found = [frozenset()] * len(func_cfg.nodes)
+    for i in func_cfg.reverse_postorder():
+        keys = set(key for key in block_dereferences(func_cfg.nodes[i])
+                   if not (1 << variables.bits[key]) & written)
+        inherited = found[idom[i]] if i != 0 else frozenset()
+        found[i] = inherited | keys if keys else inherited
+    return found
+
+
+def computation_cost(ast):
+    '''instructions spent computing the right hand side `ast` into a temporary'''
+    if isinstance(ast, UnaryOp) and ast.op in (DEREF, ADDR):
+        # a load or an address is computed straight into the temporary
+        return operand_cost(ast)
+    return expression_cost(ast)
+
+
+def loop_invariants(func_cfg, variables, body, preheaders, order, safe, sets, reads):
+    '''
+    remove the statements computing a loop invariant temporary from the
+    blocks of the loop and from the preheaders of the loops nested in it,
+    returns them in the order they are to be computed in
+    Args:
+        body (set): indices of the blocks of the loop
+        preheaders (dict): index of the header of a loop -> its preheader code
+        order (list): position of every block in reverse postorder
+        safe (frozenset): var_keys of the pointers never written that are
+            loaded or stored through before the loop
+        sets, reads (dict): assignments and reads of every temporary (see temp_counts)
+    '''
+    nodes = func_cfg.nodes
+    succs = func_cfg.successors()
+    blocks = sorted(body, key=order.__getitem__)
+
+    # what the statements left in the loop may write
+    writes = 0
+    for i in blocks:
+        for _, defs, clobbers in variables.effects(i):
+            writes |= defs | clobbers
+        for stmt in preheaders.get(i, ()):
+            writes |= variables.bit(stmt.left_child)
+
+    # the blocks the loop is left from; a block dominating all of them is
+    # run every time the loop is entered (a loop never left may not be),
+    # and so is the preheader of a loop that starts at such a block
+    exits = [i for i in blocks if nodes[i].is_return or any(j not in body for j in succs[i])]
+    runs = set(i for i in blocks if exits and all(func_cfg.dominates(i, e) for e in exits))
+    safe = set(safe)
+    for i in runs:
+        safe |= set(key for key in block_dereferences(nodes[i])
+                    if not (1 << variables.bits[key]) & writes)
+
+    # the invariant computations, in the order they are made
+    invariants = []
+    for i in blocks:
+        for stmt in preheaders.get(i, []) + nodes[i].body:
+            if not (isinstance(stmt, BinOp) and stmt.op == ASGN):
+                continue
+            lhs, rhs = stmt.left_child, stmt.right_child
+            if isinstance(lhs, Var) and lhs.entry is None and isinstance(rhs, (BinOp, UnaryOp)) and\
+               sets[var_key(lhs)] == 1 and not has_call(rhs) and\
+               not variables.reads(rhs) & writes and (i in runs or not may_fault(rhs, safe)):
+                invariants.append(stmt)
+                # set once, the temporary is only written before the loop if moved
+                writes &= ~variables.bit(lhs)
+
+    # a temporary read by a moved computation is moved with it, another is
+    # moved if loading it in the loop costs less than computing it there
+    moved = set()
+    moved_reads = {}
+    for stmt in reversed(invariants):
+        key = var_key(stmt.left_child)
+        if moved_reads.get(key) or\
+           computation_cost(stmt.right_child) > reads.get(key, 0) - moved_reads.get(key, 0):
+            moved.add(id(stmt))
+            count_temp_reads(stmt.right_child, moved_reads)
+
+    if moved:
+        for i in blocks:
+            node = nodes[i]
+            kept = [stmt for stmt in node.body if id(stmt) not in moved]
+            if len(kept) != len(node.body):
+                node.body = kept
+            if i in preheaders:
+                preheaders[i] = [stmt for stmt in preheaders[i] if id(stmt) not in moved]
+    return [stmt for stmt in invariants if id(stmt) in moved]
+
+
+def hoist_invariants(func_cfg, variables):
+    '''
+    move the computations of temporaries that are the same on every
+    iteration of their loop out of it, into a block jumping to the loop's
+    header in place of the blocks outside the loop. when a single block
+    outside the loop jumps to the header and nowhere else, it gets them
+    instead. inner loops are done first, so that what is moved out of them
+    may be moved out of the loops around them as well; the blocks are
+    added once all loops are done. a loop whose header is the entry of the
+    function is left as it is.
+    returns the number of statements moved
+    '''
+    loops = func_cfg.loops()
+    if not loops:
+        return 0
+
+    sets, reads = temp_counts(func_cfg)
+    written = 0
+    for i in range(len(func_cfg.nodes)):
+        for _, defs, clobbers in variables.effects(i):
+            written |= defs | clobbers
+    safe = dominating_dereferences(func_cfg, variables, written)
+    order = [None] * len(func_cfg.nodes)
+    for k, i in enumerate(func_cfg.reverse_postorder()):
+        order[i] = k
+
+    # index of a loop's header -> the code moved before the loop
+    preheaders = {}
+    for h, body in reversed(loops):
+        if h != 0:
+            preheaders[h] = loop_invariants(func_cfg, variables, body, preheaders, order, safe[h],
+                                            sets, reads)
+
+    nodes = func_cfg.nodes
+    succs = func_cfg.successors()
+    preds = func_cfg.predecessors()
+    moved = 0
+    blocks = []
+    for h, body in loops:
+        code = preheaders.get(h)
+        if not code:
+            continue
+        moved += len(code)
+        outside = [p for p in preds[h] if p not in body]
+        if len(outside) == 1 and succs[outside[0]] == [h]:
+            pred = nodes[outside[0]]
+            pred.body = pred.body + code
+        else:
+            blocks.append((h, code, outside))
+    if blocks:
+        func_cfg.insert_blocks(blocks)
+    return moved
@@ -0,0 +1,76 @@
+'''
+Optimization passes over the three address code of a CFG, run with -O.
+
+Every pass works on one FunctionCFG at a time and counts what it did, so
+functions can be optimized as they are streamed or cached just as well as
+a whole file at once.
+'''
+from collections import Counter, OrderedDict
+
+from dataflow import Variables
+from fold import fold_constants
+from deadcode import fold_branches, remove_dead_stores, remove_dead_blocks
+from copyprop import propagate_copies, coalesce_temps, renumber_temps
+from valuenum import number_values, remove_redundancies
+from licm import hoist_invariants
+
+
+def optimize_function(func_cfg, symtable):
+    '''
+    run the passes over the function `func_cfg`
+    Args:
+        symtable (SymbolTable): the global symbol table
+    returns a Counter of the changes each pass made
+    '''
+    stats = Counter()
+    variables = Variables(func_cfg, symtable)
+    stats['copies'] += propagate_copies(func_cfg, variables)
+    stats['folded'] += fold_constants(func_cfg)
+    stats['branches'] += fold_branches(func_cfg)
+    removed, inserted = remove_redundancies(func_cfg, variables)
+    stats['redundant'] += removed
+    stats['inserted'] += inserted
+    stats['numbered'] += number_values(func_cfg, variables)
+    stats['dead stores'] += remove_dead_stores(func_cfg, variables)
+    # the pointers set to the address of a local are propagated and gone,
+    # loads through pointers can no longer reach the locals only used as *&x
+    variables.narrow_memory()
+    # value numbering forwards stored constants into the operations reading
+    # them, and stores to the locals left out of memory may now be dead
+    stats['folded'] += fold_constants(func_cfg)
+    stats['branches'] += fold_branches(func_cfg)
+    stats['dead stores'] += remove_dead_stores(func_cfg, variables)
+    stats['hoisted'] += hoist_invariants(func_cfg, variables)
+    stats['coalesced'] += coalesce_temps(func_cfg, variables)
+    stats['dead blocks'] += remove_dead_blocks(func_cfg)
+    renumber_temps(func_cfg)
+
+    # the code of the blocks is now their three address code
+    for node in func_cfg.nodes:
+        node.optimized = True
+    return stats
+
+
+def optimize(cfg, symtable):
+    '''
+    optimize every function of `cfg`, numbering its blocks consecutively
+    again afterwards
+    returns an OrderedDict of function name -> Counter of changes
+    '''
+    stats = OrderedDict()
+    for func_cfg in cfg.functions():
+        stats[func_cfg.func.name] = optimize_function(func_cfg, symtable)
+    cfg.renumber()
+    # temporaries are numbered per function, none are left taken from the
+    # numbering of the file
+    cfg.temp_count = cfg.temp_start
+    return stats
+
+
+def format_stats(stats):
+    '''one line per function of the optimize() statistics `stats`'''
+    lines = []
+    for name, counts in stats.items():
+        changes = ', '.join('%s %d' % (k, v) for k, v in sorted(counts.items()) if v)
+        lines.append('%s: %s' % (name, changes or 'unchanged'))
+    return '\n'.join(lines)
@@ -0,0 +1,81 @@
+'''
+Compile server keeping a warm APLParser behind a unix domain socket, and
+the client side of its protocol.
+
+Every connection carries one request and one response, each a single line
+of JSON:
+    request:  {"source": <program text>, "artifacts": [<artifact>, ...]}
+    response: {"error": null or {"line": int or null, "message": str},
+               "warnings": str,
+               "artifacts": {<artifact>: <output text>, ...}}
+where <artifact> is one of 'ast', 'cfg', 'sym', 'asm'.
+'''
+import json
+import os
+import socket
+import socketserver
+
+from artifacts import ARTIFACTS
+
+
+DEFAULT_SOCKET = os.environ.get('APLC_SOCKET', '/tmp/aplc-%d.sock' % (os.getuid()))
+
+
+class CompileHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        from Parser import capture_diagnostics
+
+        request = json.loads(self.rfile.readline().decode())
+        wanted = tuple(name for name in request.get('artifacts', ARTIFACTS) if name in ARTIFACTS)
+
+        artifacts, error, warnings = capture_diagnostics(
+            self.server.parser.compile_source, request['source'], wanted)
+
+        if error is not None:
+            error = {'line': error.lineno, 'message': error.message}
+
+        response = {
+            'error': error,
+            'warnings': warnings,
+            'artifacts': artifacts or {},
+        }
+        self.wfile.write((json.dumps(response) + '\n').encode())
+
+
+class CompileServer(socketserver.UnixStreamServer):
+    '''serves requests one at a time with a single warm APLParser'''
+
+    def __init__(self, socket_path, lexer_backend='ply', func_cache_dir=None, optimize=False):
+        from Parser import APLParser
+
+        self.parser = APLParser(lexer_backend=lexer_backend, func_cache_dir=func_cache_dir,
+                                optimize=optimize)
+
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        socketserver.UnixStreamServer.__init__(self, socket_path, CompileHandler)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+def serve(socket_path=DEFAULT_SOCKET, lexer_backend='ply', func_cache_dir=None, optimize=False):
+    server = CompileServer(socket_path, lexer_backend, func_cache_dir, optimize)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def request(source, artifacts, socket_path=DEFAULT_SOCKET):
+    '''send one compile request to the server, returns the decoded response'''
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        message = {'source': source, 'artifacts': list(artifacts)}
+        sock.sendall((json.dumps(message) + '\n').encode())
+
+        with sock.makefile('rb') as response:
+            return json.loads(response.readline().decode())
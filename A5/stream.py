@@ -0,0 +1,78 @@
+'''
+Per-function code generation for compiling a file while it is parsed.
+
+Functions only depend on the globals and prototypes declared before them,
+so each one can be lowered to a CFG, turned into MIPS and dropped as soon
+as its definition is reduced. Basic block ids, temporaries and float
+comparison labels carry on from the previous function, giving the same
+output as lowering the whole file at once.
+'''
+import shutil
+import tempfile
+
+from ast import write_ast
+from cfg import CFG
+from asm import ASMCodeGenerator
+from optimize import optimize
+
+
+class StreamEmitter(object):
+    '''
+    writes the .ast, .cfg and asm output of one function at a time.
+    the .text part of the asm is spooled to a temporary file, since the
+    .data part in front of it is only known once every global is declared.
+    any of the files may be None to skip that output.
+    if `opt_stats` is a dict, every function is optimized and its
+    statistics added to it.
+    '''
+
+    def __init__(self, symtable, ast_file, cfg_file, asm_file, opt_stats=None):
+        self.symtable = symtable
+        self.ast_file = ast_file
+        self.cfg_file = cfg_file
+        self.asm_file = asm_file
+        self.opt_stats = opt_stats
+
+        self.text_file = tempfile.TemporaryFile('w+') if asm_file is not None else None
+
+        self.node_count = 0
+        self.temp_count = 0
+        self.fcmp_count = 0
+
+    def function(self, func):
+        '''emit the definition or prototype `func`'''
+        if self.ast_file is not None:
+            write_ast(func, self.ast_file)
+
+        if not func.has_def or (self.cfg_file is None and self.text_file is None):
+            return
+
+        func_cfg = CFG([func], node_start=self.node_count, temp_start=self.temp_count,
+                       split_calls=self.opt_stats is not None)
+        if self.opt_stats is not None:
+            self.opt_stats.update(optimize(func_cfg, self.symtable))
+        self.node_count += func_cfg.node_count
+        self.temp_count = func_cfg.temp_count
+
+        if self.cfg_file is not None:
+            func_cfg.write(self.cfg_file)
+
+        if self.text_file is not None:
+            asm_gen = ASMCodeGenerator(func_cfg, self.symtable, self.text_file, data=False,
+                                       fcmp_start=self.fcmp_count)
+            self.fcmp_count = asm_gen.fcmp_count
+
+    def finish(self):
+        '''write the .data part followed by the spooled .text part'''
+        if self.text_file is None:
+            return
+
+        ASMCodeGenerator(None, self.symtable, self.asm_file)
+        self.text_file.seek(0)
+        shutil.copyfileobj(self.text_file, self.asm_file)
+        self.close()
+
+    def close(self):
+        if self.text_file is not None:
+            self.text_file.close()
+            self.text_file = None
@@ -6,6 +6,18 @@ files=(
     "cfg.py"
     "symtablev2.py"
     "asm.py"
+    "aplc.py"
+    "artifacts.py"
+    "server.py"
+    "funccache.py"
+    "stream.py"
+    "dataflow.py"
+    "fold.py"
+    "deadcode.py"
+    "copyprop.py"
+    "valuenum.py"
+    "licm.py"
+    "optimize.py"
     "README.txt"
 )
 mkdir -p $DIR
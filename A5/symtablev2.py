@@ -1,4 +1,4 @@
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
 
 
 TYPE_SIZES = {
@@ -8,6 +8,96 @@ TYPE_SIZES = {
 }
 
 
+class Type(tuple):
+    '''
+    (base type, pointer level) pair. there is a single instance per type,
+    see get_type, so types are compared with `is`. being a tuple, it
+    indexes, prints and encodes to json like the plain pairs it replaces.
+    '''
+
+    def __new__(cls, base, pointer_level):
+        _type = tuple.__new__(cls, (base, pointer_level))
+        _type.base = base
+        _type.pointer_level = pointer_level
+        _type.is_float = base == 'float' and pointer_level == 0
+
+        if pointer_level is None:
+            # function or block
+            _type.width = None
+        elif pointer_level > 0:
+            _type.width = TYPE_SIZES['pointer']
+        else:
+            _type.width = TYPE_SIZES.get(base)
+
+        _type.pointee = None
+        _type._pointer = None
+        return _type
+
+    @property
+    def pointer(self):
+        '''type of a pointer to this type'''
+        if self._pointer is None:
+            self._pointer = get_type(self.base, self.pointer_level + 1)
+        return self._pointer
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (get_type, (self.base, self.pointer_level))
+
+
+TYPES = {}
+
+
+def get_type(base, pointer_level=0):
+    '''the Type of `base` with `pointer_level` stars'''
+    _type = TYPES.get((base, pointer_level))
+    if _type is None:
+        _type = TYPES[(base, pointer_level)] = Type(base, pointer_level)
+        if pointer_level is not None and pointer_level > 0:
+            _type.pointee = get_type(base, pointer_level - 1)
+            _type.pointee._pointer = _type
+    return _type
+
+
+INT = get_type('int')
+FLOAT = get_type('float')
+VOID = get_type('void')
+BOOL = get_type('bool')
+
+# entry types of functions and blocks
+FUNCTION = get_type('function', None)
+BLOCK = get_type('block', None)
+
+
+# parameters of a function, all tuples in parameter order.
+#   offsets: of each parameter from the first one, in the callee's frame
+#   call_offsets: $sp relative offsets the caller stores the arguments at
+#   size: total width of the parameters
+Signature = namedtuple('Signature', ['names', 'types', 'widths', 'offsets', 'call_offsets', 'size'])
+
+
+def make_signature(params):
+    '''Signature of the parameters `params`, a list of (name, Type)'''
+    names = tuple(name for name, _ in params)
+    types = tuple(_type for _, _type in params)
+    widths = tuple(_type.width for _type in types)
+
+    offsets = []
+    offset = 0
+    for w in widths:
+        offsets.append(offset)
+        offset += w
+    size = offset
+
+    call_offsets = tuple(offset - size + w for offset, w in zip(offsets, widths))
+    return Signature(names, types, widths, tuple(offsets), call_offsets, size)
+
+
 class SymbolTable(object):
 
     def __init__(self, parent, name):
@@ -19,11 +109,14 @@ class SymbolTable(object):
         # applicable for function symbol tables
         self.num_params = None
 
+        # ScopeStack this table is active in, which is told about new entries
+        self.scopes = None
+
     def enter(self, name, _type, width):
         '''
         Args:
             name (str): id
-            _type (tuple (base_type(str), pointer_level(int))),
+            _type (Type),
             width (int): size of data type
             offset (int): current offset
         '''
@@ -35,6 +128,7 @@ class SymbolTable(object):
             'type': _type,
             'width': width,
         }
+        self.bind(name)
 
     def enterfunc(self, name, new_table, ret_type):
         if name in self.symbols:
@@ -45,21 +139,34 @@ class SymbolTable(object):
                 return
             else:
                 # check if prototype params match definition params
-                if entry['ret_type'] != ret_type:
+                if entry['ret_type'] is not ret_type:
                     print('[function %s] return type mismatch with prototype.' % (name))
                     return
 
         self.symbols[name] = {
-            'type': 'function',
+            'type': FUNCTION,
             'ret_type': ret_type,
             'tableptr': new_table,
+            'signature': make_signature([]),
         }
+        self.bind(name)
 
     def enterblock(self, name, new_table):
         self.symbols[name] = {
-            'type': 'block',
+            'type': BLOCK,
             'tableptr': new_table,
         }
+        self.bind(name)
+
+    def bind(self, name):
+        if self.scopes is not None:
+            self.scopes.bind(name, self.symbols[name])
+
+    def clear(self):
+        '''remove all entries'''
+        if self.scopes is not None:
+            self.scopes.unbind_all(self)
+        self.symbols.clear()
 
     def addwidth(self, width):
         self.size = width
@@ -78,11 +185,11 @@ class SymbolTable(object):
         return temp
 
     def look_up(self, name):
-        if name in self.symbols:
-            return self.symbols[name]
-
-        if self.parent is not None:
-            return self.parent.look_up(name)
+        table = self
+        while table is not None:
+            if name in table.symbols:
+                return table.symbols[name]
+            table = table.parent
 
         return None
 
@@ -93,10 +200,8 @@ def mktable(curr_symtable, name):
 
 
 def get_width(_type):
-    '''type <- tuple (<basetype>, <pointer_level>)'''
-    p_level = _type[1]
-    width = TYPE_SIZES[_type[0]] if p_level == 0 else TYPE_SIZES['pointer']
-    return width
+    '''type <- Type or tuple (<basetype>, <pointer_level>)'''
+    return get_type(*_type).width
 
 
 def print_procedures(symtable, file):
@@ -105,38 +210,22 @@ def print_procedures(symtable, file):
     file.write('Name\t\t|\tReturn Type  |  Parameter List\n')
 
     for k, v in symtable.symbols.items():
-        if v['type'] == 'function':
+        if v['type'] is FUNCTION:
             if k == 'main':
                 continue
             file.write(k + '\t\t|\t')
             ret_type = v['ret_type']
             file.write(ret_type[0] + '*'*ret_type[1] + '\t\t|\t')
-            table = v['tableptr']
-            num_params = table.num_params
-            params = []
-            for pk, pv in table.symbols.items():
-                if num_params == 0:
-                    break
-                params.append(pv['type'][0] + ' ' + '*' * pv['type'][1] + pk)
-                num_params -= 1
-
-            param_string = ''
-            num_params = table.num_params
-
-            if num_params > 1:
-                for i in range(num_params - 1):
-                    param_string += params[i] + ', '
-            if num_params > 0:
-                param_string += params[num_params - 1]
-
-            file.write(param_string + '\n')
+            signature = v['signature']
+            params = [t[0] + ' ' + '*' * t[1] + name for name, t in zip(signature.names, signature.types)]
+            file.write(', '.join(params) + '\n')
 
     file.write('-----------------------------------------------------------------\n')
 
 
 def print_variables_recursive(symtable, scope, file):
     for k, v in symtable.symbols.items():
-        if v['type'] in ('function', 'block'):
+        if v['type'] is FUNCTION or v['type'] is BLOCK:
             print_variables_recursive(v['tableptr'], scope + [k], file)
         else:
             file.write(k + '\t\t|\t')
@@ -185,3 +274,57 @@ class Stack:
 
     def size(self):
         return len(self.items)
+
+
+class ScopeStack(Stack):
+    '''
+    stack of the active symbol tables, innermost on top, resolving a name
+    in constant time: every name has a stack of its bindings, pushed and
+    popped together with the tables that declare it.
+    entries may only be added to the table on top.
+    '''
+
+    def __init__(self):
+        Stack.__init__(self)
+        # name -> list of (depth of the declaring table, entry)
+        self.bindings = {}
+
+    def push(self, table):
+        Stack.push(self, table)
+        table.scopes = self
+        for name, entry in table.symbols.items():
+            self.bind(name, entry)
+
+    def pop(self):
+        table = Stack.pop(self)
+        if table is not None:
+            self.unbind_all(table, len(self.items))
+            table.scopes = None
+        return table
+
+    def bind(self, name, entry):
+        depth = len(self.items) - 1
+        stack = self.bindings.setdefault(name, [])
+        if stack and stack[-1][0] == depth:
+            # redefinition in the same table, e.g. a function after its prototype
+            stack[-1] = (depth, entry)
+        else:
+            stack.append((depth, entry))
+
+    def unbind_all(self, table, depth=None):
+        '''drop the bindings of the names in `table` declared at `depth` (the top by default)'''
+        if depth is None:
+            depth = len(self.items) - 1
+        for name in table.symbols:
+            stack = self.bindings.get(name)
+            if stack and stack[-1][0] == depth:
+                stack.pop()
+                if not stack:
+                    del self.bindings[name]
+
+    def look_up(self, name):
+        '''same as self.top().look_up(name)'''
+        stack = self.bindings.get(name)
+        if stack:
+            return stack[-1][1]
+        return None
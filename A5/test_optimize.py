@@ -0,0 +1,208 @@
+'''
+Regression tests for the code generated with -O.
+
+>> python3 test_optimize.py
+'''
+import re
+import shutil
+import tempfile
+import unittest
+
+from Parser import APLParser
+
+
+EARLY_RETURN = '''
+float f(int *a) {
+    float y, *q;
+    q = &y;
+    *q = 1.5;
+    if (*a > 0) {
+        return *q * 2.0;
+    }
+    *a = (*a - 2) * 3;
+    return *q;
+}
+int g(int *a) {
+    int i, *p;
+    p = &i;
+    *p = 0;
+    while (*p < 10) {
+        if (*a > 5) {
+            return *a * *p;
+        }
+        *a = *a * 2 + *p;
+        *p = *p + 1;
+    }
+    return *a - 1;
+}
+void main() {
+    int x, *p;
+    p = &x;
+    *p = 3;
+    f(p);
+    *p = g(p);
+    return;
+}
+'''
+
+FORWARDED_CONSTANT = '''
+int f(int *a) {
+    int x, y, *p, *q;
+    p = &x;
+    q = &y;
+    *p = 5;
+    *q = (*p + 3) * 2;
+    if (*q > 10) {
+        *a = *q;
+    }
+    return *q;
+}
+void main() {
+    int z, *r;
+    r = &z;
+    *r = f(r);
+    return;
+}
+'''
+
+OVERFLOW = '''
+int f(int *a) {
+    *a = 2147483647 + 1;
+    *a = -(0 - 2147483647 - 1);
+    *a = 65536 * 65536 + 7;
+    return *a;
+}
+void main() {
+    int z, *r;
+    r = &z;
+    *r = f(r);
+    return;
+}
+'''
+
+CALL_IN_EXPRESSION = '''
+int g0, g1, *gp0, *gp1;
+int f0(int *a) {
+    *a = *a * 2;
+    return *a + 1;
+}
+void main() {
+    gp0 = &g0;
+    gp1 = &g1;
+    *gp0 = 5;
+    *gp1 = f0(gp0) + (*gp0 + 1);
+    if ((*gp0 - f0(gp0)) < *gp1) {
+        *gp1 = 0;
+    }
+    return;
+}
+'''
+
+COPY_CHAIN = '''
+int gk, *gr;
+int f(int *a) {
+    int i, *p;
+    p = &i;
+    *p = 0;
+    *gr = *gr * 3 + (1 * *p);
+    return 1;
+}
+void main() {
+    int z, *r;
+    gr = &gk;
+    r = &z;
+    *r = f(r);
+    return;
+}
+'''
+
+
+def compile_source(source, optimize=True, **options):
+    '''{artifact: output text} of the .cfg and .s of `source`, compiled with `options`'''
+    parser = APLParser(optimize=optimize, **options)
+    return parser.compile_source(source, ('cfg', 'asm'))
+
+
+class EarlyReturnTest(unittest.TestCase):
+    '''the temporaries of the blocks after a return are not the ones of the return'''
+
+    def test_temps_set_in_one_block(self):
+        # the passes of -O may set a temporary in several blocks on purpose
+        cfg = compile_source(EARLY_RETURN, optimize=False)['cfg']
+        for function in cfg.split('function ')[1:]:
+            blocks = {}
+            for block in function.split('<bb ')[1:]:
+                for temp in set(re.findall(r'^(t\d+) =', block, re.M)):
+                    blocks.setdefault(temp, []).append(block.split('>')[0])
+            for temp, found in blocks.items():
+                self.assertEqual(len(found), 1, '%s set in blocks %s' % (temp, found))
+
+    def test_float_code_uses_float_registers(self):
+        asm = compile_source(EARLY_RETURN)['asm']
+        self.assertIsNone(re.search(r'\w\.s \$[^f]', asm))
+        self.assertNotIn('None', asm)
+
+    def test_same_code_streamed_and_cached(self):
+        asm = compile_source(EARLY_RETURN)['asm']
+        self.assertEqual(compile_source(EARLY_RETURN, stream=True)['asm'], asm)
+        cache_dir = tempfile.mkdtemp()
+        try:
+            for _ in range(2):
+                self.assertEqual(compile_source(EARLY_RETURN, func_cache_dir=cache_dir)['asm'], asm)
+        finally:
+            shutil.rmtree(cache_dir)
+
+
+class ForwardedConstantTest(unittest.TestCase):
+    '''constants value numbering forwards from stores are folded'''
+
+    def test_folded_and_dead_store_removed(self):
+        cfg = compile_source(FORWARDED_CONSTANT)['cfg']
+        self.assertIn('*&y = 16', cfg)
+        self.assertNotIn('5 + 3', cfg)
+        self.assertNotIn('*&x', cfg)
+
+
+class OverflowTest(unittest.TestCase):
+    '''an int + or - overflowing is left to add and sub, which trap'''
+
+    def test_overflow_not_folded(self):
+        cfg = compile_source(OVERFLOW)['cfg']
+        self.assertIn('2147483647 + 1', cfg)
+        self.assertNotIn('*a = -2147483648\n', cfg)
+        # mul wraps
+        self.assertIn('*a = 7', cfg)
+
+
+class CallInExpressionTest(unittest.TestCase):
+    '''the operands around a call in an expression are read in order'''
+
+    def test_call_made_in_order(self):
+        cfg = compile_source(CALL_IN_EXPRESSION)['cfg']
+        lines = cfg[cfg.index('function main'):].split('\n')
+        calls = [i for i, line in enumerate(lines) if 'f0(gp0)' in line]
+        loads = [i for i, line in enumerate(lines) if '*gp0' in line]
+        # *gp0 is read after the call on its left and before the one on its right
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(len(loads), 2)
+        self.assertTrue(calls[0] < loads[0] < loads[1] < calls[1], cfg)
+
+    def test_unoptimized_cfg_unchanged(self):
+        cfg = compile_source(CALL_IN_EXPRESSION, optimize=False)['cfg']
+        self.assertIn('f0(gp0) + t', cfg)
+        self.assertIn('*gp0 - f0(gp0)', cfg)
+
+
+class CopyChainTest(unittest.TestCase):
+    '''a temporary merged into a copy that is merged in turn (t0 = x; t1 = t0; *p = t1)'''
+
+    def test_merged_value_kept(self):
+        cfg = compile_source(COPY_CHAIN)['cfg']
+        self.assertIn('*gr = *gr * 3', cfg)
+        for function in cfg.split('function ')[1:]:
+            temps = set(re.findall(r'^(t\d+) =', function, re.M))
+            self.assertLessEqual(set(re.findall(r'\bt\d+\b', function)), temps, function)
+
+
+if __name__ == '__main__':
+    unittest.main()
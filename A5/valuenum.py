@@ -0,0 +1,444 @@
+'''
+Value numbering and redundancy elimination over the three address code of
+a FunctionCFG.
+
+Within a block, the value of every operation and of every load through a
+pointer (*p, *&x) is remembered with the operand holding it, until a
+statement writes one of the variables it reads. An operation done again
+becomes a copy of that operand, which the later reads of its temporary
+use directly, leaving the copy to remove_dead_stores(). A value loaded
+more than once is loaded into a new temporary the first time, and a load
+through the pointer just stored through reads the value stored. A store
+through a pointer or a call may write anything in Variables.memory, so it
+forgets every load.
+
+Across blocks, remove_redundancies() uses AvailableExpressions: a
+computation available on every path into its block is replaced by a copy
+of a new temporary, set next to the computations it is available from.
+One available on some of the edges into its block only is computed on the
+others first, in a block of its own on an edge leaving a branch. The new
+temporary lives in a stack slot, so only computations costing more than
+storing and loading it are reused.
+'''
+from ast import BinOp, UnaryOp, Var, Const, FunctionCall, ASGN, DEREF, ADDR,\
+    PLUS, MUL, DIV, LT, LE, GT, GE, EQ, NE, AND, OR
+from dataflow import AvailableExpressions, block_statements, expression_key, operand_key, var_key
+from copyprop import has_call
+from symtablev2 import FLOAT
+
+COMMUTATIVE = (PLUS, MUL, EQ, NE, AND, OR)
+# instructions to keep a value in a stack slot for a later block: a store, then a load
+REUSE_COST = 2
+
+
+def value_key(ast):
+    '''
+    expression_key of the computation `ast`, with the operands of a
+    commutative operator in a fixed order; None if it is not numbered
+    '''
+    key = expression_key(ast)
+    if key is None or None in key[2:]:
+        return None
+    if isinstance(ast, BinOp) and ast.op in COMMUTATIVE:
+        key = key[:2] + tuple(sorted(key[2:], key=repr))
+    return key
+
+
+def is_temp(ast):
+    return isinstance(ast, Var) and ast.entry is None
+
+
+def load_key(ast):
+    '''key of the load `ast` through a variable or an address, None if it is not one'''
+    if isinstance(ast, UnaryOp) and ast.op == DEREF:
+        child = ast.child
+        if isinstance(child, Var) or (isinstance(child, UnaryOp) and child.op == ADDR):
+            return (DEREF, ast.dtype, operand_key(child))
+    return None
+
+
+def statement_reads(stmt):
+    '''the expressions `stmt` evaluates: the right hand side, then the pointer stored through'''
+    if isinstance(stmt, BinOp) and stmt.op == ASGN:
+        if isinstance(stmt.left_child, Var):
+            return [stmt.right_child]
+        return [stmt.right_child, stmt.left_child.child]
+    return [stmt]
+
+
+def loads(ast, found):
+    '''append the loads `ast` makes to found, in the order number_block meets them'''
+    if isinstance(ast, BinOp):
+        loads(ast.left_child, found)
+        loads(ast.right_child, found)
+    elif isinstance(ast, UnaryOp) and ast.op != ADDR:
+        loads(ast.child, found)
+        if load_key(ast) is not None:
+            found.append(ast)
+    elif isinstance(ast, FunctionCall):
+        for p in ast.actual_params:
+            loads(p, found)
+
+
+def count_loads(statements, effects, variables):
+    '''
+    for each statement of a block, one counter per load it makes: the
+    number of times the value it loads is loaded from the first of them
+    to a write that may change it. None for the statements making a call,
+    whose loads are left alone
+    '''
+    counters = []
+    # load key -> [count, bitset of the variables the load reads]
+    current = {}
+    for stmt, (_, defs, clobbers) in zip(statements, effects):
+        if stmt is None or has_call(stmt):
+            counters.append(None)
+            current = {}
+            continue
+
+        found = []
+        for ast in statement_reads(stmt):
+            loads(ast, found)
+        for i, load in enumerate(found):
+            key = load_key(load)
+            counter = current.get(key)
+            if counter is None:
+                counter = current[key] = [0, variables.reads(load)]
+            counter[0] += 1
+            found[i] = counter
+        counters.append(found)
+
+        written = defs | clobbers
+        if written:
+            current = dict((key, c) for key, c in current.items() if not c[1] & written)
+    return counters
+
+
+def number_block(func_cfg, i, variables):
+    '''value number block i of func_cfg, returns the number of operations and loads reused'''
+    node = func_cfg.nodes[i]
+    statements = block_statements(node)
+    effects = variables.effects(i)
+    counters = count_loads(statements, effects, variables)
+
+    # value or load key -> (operand holding it, bitset of the variables
+    # it depends on, the operand included)
+    avail = {}
+    # var_key of a temporary -> (operand holding its value, bitset of the
+    # two)
+    alias = {}
+    reused = [0]
+
+    def rewrite(ast, added, counters):
+        if isinstance(ast, Var):
+            if is_temp(ast) and var_key(ast) in alias:
+                return alias[var_key(ast)][0]
+            return ast
+
+        if isinstance(ast, BinOp):
+            left = rewrite(ast.left_child, added, counters)
+            right = rewrite(ast.right_child, added, counters)
+            if left is ast.left_child and right is ast.right_child:
+                return ast
+            new = BinOp(left, right, ast.op)
+
+        elif isinstance(ast, UnaryOp) and ast.op != ADDR:
+            is_load = load_key(ast) is not None
+            child = rewrite(ast.child, added, counters)
+            if child is ast.child:
+                new = ast
+            else:
+                new = UnaryOp(child, ast.op)
+                new.dtype = ast.dtype
+            if not is_load or counters is None:
+                return new
+
+            count = next(counters)[0]
+            key = load_key(new)
+            if key in avail:
+                reused[0] += 1
+                return avail[key][0]
+            if count > 1:
+                temp = func_cfg.new_temp(new.dtype)
+                added.append(BinOp(temp, new, ASGN))
+                avail[key] = (temp, variables.reads(new) | variables.bit(temp))
+                return temp
+            return new
+
+        elif isinstance(ast, FunctionCall):
+            params = [rewrite(p, added, counters) for p in ast.actual_params]
+            if all(p is q for p, q in zip(params, ast.actual_params)):
+                return ast
+            new = FunctionCall(ast.id, params)
+
+        else:
+            return ast
+
+        new.dtype = ast.dtype
+        return new
+
+    def forget(written):
+        for table in (avail, alias):
+            for key in [key for key, (_, uses) in table.items() if uses & written]:
+                del table[key]
+
+    # var_key of the temporaries set in the block so far
+    defined = set()
+    code = []
+    for stmt, effect, found in zip(statements, effects, counters):
+        if stmt is None:
+            code.append(stmt)
+            continue
+
+        if found is not None:
+            found = iter(found)
+        key = copied = stored = None
+        if isinstance(stmt, BinOp) and stmt.op == ASGN:
+            lhs = stmt.left_child
+            rhs = rewrite(stmt.right_child, code, found)
+            if not isinstance(lhs, Var):
+                child = rewrite(lhs.child, code, found)
+                if child is not lhs.child:
+                    lhs = UnaryOp(child, DEREF)
+                    lhs.dtype = stmt.left_child.dtype
+                if found is not None and isinstance(rhs, (Var, Const)):
+                    stored = load_key(lhs)
+            elif is_temp(lhs) and (isinstance(rhs, Const) or
+                                   is_temp(rhs) and var_key(rhs) in defined):
+                # later reads of the temporary read what it copies. a
+                # temporary set in other blocks is loaded once here instead
+                copied = rhs
+            elif lhs.entry is None and found is not None:
+                key = value_key(rhs)
+            if key in avail:
+                # the temporary is a copy of the operand that holds the value
+                rhs = copied = avail[key][0]
+                reused[0] += 1
+                key = None
+            if lhs is stmt.left_child and rhs is stmt.right_child:
+                new = stmt
+            else:
+                new = BinOp(lhs, rhs, ASGN)
+                new.dtype = stmt.dtype
+        else:
+            new = rewrite(stmt, code, found)
+        code.append(new)
+        if isinstance(new, BinOp) and new.op == ASGN and is_temp(new.left_child):
+            defined.add(var_key(new.left_child))
+
+        if found is None:
+            # nothing computed before a call is reused after it, the value
+            # would have to be saved on the stack across the call
+            avail.clear()
+        _, defs, clobbers = effect if new is stmt else variables.statement_effect(new)
+        if defs | clobbers:
+            forget(defs | clobbers)
+
+        if copied is not None:
+            alias[var_key(lhs)] = (copied, variables.bit(lhs) | variables.reads(copied))
+        elif key is not None:
+            avail[key] = (lhs, variables.reads(rhs) | variables.bit(lhs))
+        elif stored is not None:
+            # *p = v; ... *p reads v
+            avail[stored] = (rhs, variables.reads(lhs) | variables.reads(rhs))
+
+    if len(code) != len(statements) or any(a is not b for a, b in zip(code, statements)):
+        node.body = code[:-1]
+        if node.is_return:
+            node.return_id = code[-1]
+        elif node.logical:
+            node.cond = code[-1]
+    return reused[0]
+
+
+def number_values(func_cfg, variables):
+    '''
+    value number every block of func_cfg, returns the number of operations
+    and loads whose value was reused
+    '''
+    return sum(number_block(func_cfg, i, variables) for i in range(len(func_cfg.nodes)))
+
+
+def operand_cost(ast):
+    '''instructions the code generator spends getting the operand `ast` into a register'''
+    if isinstance(ast, Var):
+        return 0 if ast.entry is None else 1
+    if isinstance(ast, UnaryOp):
+        if ast.op == ADDR or load_key(ast) is not None and not isinstance(ast.child, Var):
+            # la/addi, or a load from *&x
+            return 1
+        return 1 + operand_cost(ast.child)
+    return 1
+
+
+def expression_cost(ast):
+    '''instructions the code generator spends on the computation `ast`'''
+    if isinstance(ast, BinOp):
+        # the operation and the move of its result
+        cost = 2 + operand_cost(ast.left_child) + operand_cost(ast.right_child)
+        if ast.op == DIV:
+            cost += 1
+        elif ast.left_child.dtype is FLOAT and ast.op in (LT, GT, LE, GE, EQ, NE):
+            cost += 3
+        return cost
+    return 2 + operand_cost(ast.child)
+
+
+def reads_temps(ast):
+    '''whether the expression `ast` reads a temporary'''
+    if isinstance(ast, Var):
+        return ast.entry is None
+    if isinstance(ast, BinOp):
+        return reads_temps(ast.left_child) or reads_temps(ast.right_child)
+    if isinstance(ast, UnaryOp):
+        return ast.op != ADDR and reads_temps(ast.child)
+    return False
+
+
+def remove_redundancies(func_cfg, variables):
+    '''
+    reuse the computations of the temporaries of func_cfg whose value is
+    available on every path into their block: the last computation of it
+    on each path also copies it to a new temporary, which the reuse copies
+    instead. one available on some of the edges into its block only is
+    computed on the others first. a value kept for a later block costs
+    REUSE_COST, which a computation has to cost more than to be reused,
+    and more than twice to be moved onto edges; values made in a loop are
+    not kept for after it.
+    returns (number of computations removed, number of computations added)
+    '''
+    available = AvailableExpressions(func_cfg, variables)
+    nodes = func_cfg.nodes
+    preds = func_cfg.predecessors()
+    succs = func_cfg.successors()
+    loops = func_cfg.loops()
+
+    def reachable(i):
+        return available.block_in[i] is not None
+
+    # (block, position) -> expression bit of the computations replaced by a
+    # copy of the temporary holding their value
+    replaced = {}
+    # (block, successor) -> [(expression bit, expression)] of the
+    # computations added on the edge
+    inserted = {}
+    # (block, position) -> position of the replaced computation of the
+    # same value earlier in the block, which it copies instead
+    repeats = {}
+    for i in func_cfg.reverse_postorder():
+        done = 0
+        # expression bit -> position of its replaced computation in block
+        # i, until its operands are written
+        first = {}
+        for k, (stmt, (gen, kill)) in enumerate(zip(nodes[i].body, available.statement_transfers(i))):
+            for b in [b for b in first if b & gen]:
+                repeats[(i, k)] = first[b]
+            for b in [b for b in first if b & kill]:
+                del first[b]
+            bit = gen & ~done
+            done |= gen | kill
+            if not bit or not isinstance(stmt.left_child, Var) or stmt.left_child.entry is not None:
+                continue
+            cost = expression_cost(stmt.right_child)
+            if cost <= REUSE_COST:
+                continue
+
+            if not available.block_in[i] & bit:
+                # partially redundant: computed on some of the edges into
+                # block i, the operands are the same on the others
+                into = [p for p in preds[i] if reachable(p)]
+                missing = [p for p in into if not available.block_out[p] & bit]
+                if (i == 0 or len(missing) == len(into) or i in missing or
+                        cost <= 2 * REUSE_COST or reads_temps(stmt.right_child)):
+                    continue
+                for p in missing:
+                    inserted.setdefault((p, i), []).append((bit, stmt.right_child))
+            replaced[(i, k)] = bit
+            first[bit] = k
+
+    # (block, position) -> expression bit of the computations the replaced
+    # ones reuse: the last one on every path to them
+    sources = {}
+    for (i, k), bit in list(replaced.items()):
+        found = []
+        visited = set()
+        stack = [p for p in preds[i] if reachable(p) and
+                 not any(b == bit for b, _ in inserted.get((p, i), ()))]
+        while stack:
+            p = stack.pop()
+            if p in visited:
+                continue
+            visited.add(p)
+            last = None
+            for k2, (gen, _) in enumerate(available.statement_transfers(p)):
+                if gen & bit:
+                    last = k2
+            if last is not None:
+                found.append((p, last))
+            elif available.block_in[p] & bit:
+                stack.extend(q for q in preds[p] if reachable(q))
+            else:
+                # never the case for a sound analysis
+                found = None
+                break
+        if found is not None and any(s in body and i not in body
+                                     for s, _ in found for _, body in loops):
+            # the value would be stored on every turn of a loop to be
+            # loaded once after it
+            found = None
+        if found is None:
+            del replaced[(i, k)]
+            for edge in [edge for edge in inserted if edge[1] == i]:
+                inserted[edge] = [(b, e) for b, e in inserted[edge] if b != bit]
+        else:
+            for place in found:
+                sources[place] = bit
+
+    if not replaced:
+        return (0, 0)
+
+    # expression bit -> temporary holding its value
+    holders = {}
+
+    def holder(bit, like):
+        if bit not in holders:
+            holders[bit] = func_cfg.new_temp(like.dtype)
+        return holders[bit]
+
+    removed = len(replaced)
+    for i, node in enumerate(nodes):
+        body = []
+        changed = False
+        for k, stmt in enumerate(node.body):
+            bit = replaced.get((i, k))
+            if bit is not None:
+                stmt = BinOp(stmt.left_child, holder(bit, stmt.left_child), ASGN)
+                changed = True
+            elif (i, repeats.get((i, k))) in replaced:
+                stmt = BinOp(stmt.left_child, node.body[repeats[(i, k)]].left_child, ASGN)
+                removed += 1
+                changed = True
+            body.append(stmt)
+            if (i, k) in sources and stmt is node.body[k]:
+                # the value is kept for the blocks reusing it
+                lhs = stmt.left_child
+                body.append(BinOp(holder(sources[(i, k)], lhs), lhs, ASGN))
+                changed = True
+        if changed:
+            node.body = body
+
+    # the computations on edges go at the end of the block the edge leaves
+    # if it has no other, in a block of their own on the edge otherwise
+    split = []
+    for (p, i), computed in sorted(inserted.items()):
+        code = [BinOp(holder(bit, expr), expr, ASGN) for bit, expr in computed]
+        if not code:
+            continue
+        if all(j == i for j in succs[p]):
+            nodes[p].body = nodes[p].body + code
+        else:
+            split.append((i, code, [p]))
+    if split:
+        func_cfg.insert_blocks(split)
+
+    return (removed, sum(len(v) for v in inserted.values()))